@@ -0,0 +1,133 @@
+import numpy as np
+
+
+def convert_amounts(user_amounts, min_qtys, step_sizes, entry_prices):
+    """
+    Same as helpers.convert_amount, but for arrays of positions
+    """
+    ceil_values = np.ceil(user_amounts / step_sizes) * step_sizes
+    floor_values = np.floor(user_amounts / step_sizes) * step_sizes
+
+    # Choose the closest value to the user amount
+    corrected_amounts = np.where(
+        np.abs(user_amounts - ceil_values) < np.abs(user_amounts - floor_values), ceil_values, floor_values
+    )
+    # Ensure the corrected amount is not less than the minimum quantity
+    corrected_amounts = np.where(corrected_amounts < min_qtys, min_qtys, corrected_amounts)
+    # Binance min. notional (5 USDT)
+    corrected_amounts = np.where(corrected_amounts * entry_prices < 5, ceil_values, corrected_amounts)
+    return corrected_amounts
+
+
+class AllocationEngine:
+    """
+    Kelly Criteria weighted sizing of copied positions (see Leaderboard.copy_trader_id)
+    Position fields are gathered into arrays once and every target size, delta and rounded quantity
+    is computed in a single NumPy pass instead of position by position
+    """
+    def __init__(
+        self,
+        balance_in_usdt: float,
+        trader_kcs: dict,
+        trader_positions_counts: dict,
+        last_prices: dict,
+        min_qty_and_step_sizes: dict,
+    ):
+        self.balance_in_usdt = float(balance_in_usdt)
+        self.trader_kcs = trader_kcs  # {trader_id: weighted KC, ...}
+        self.trader_positions_counts = trader_positions_counts  # {trader_id: positions count, ...}
+        self.last_prices = last_prices  # {"BTCUSDT": 26157, ...}
+        self.min_qty_and_step_sizes = min_qty_and_step_sizes  # {"BTCUSDT": {"min_qty": 0.001, "step_size": 0.001}}
+
+    def _get_arrays(self, positions: list):
+        symbols = [position["symbol"] for position in positions]
+        return {
+            "kc": np.array([self.trader_kcs[position["trader_id"]] for position in positions], dtype=float),
+            "positions_count": np.array(
+                [self.trader_positions_counts[position["trader_id"]] for position in positions], dtype=float
+            ),
+            "leverage": np.array([position["leverage"] for position in positions], dtype=float),
+            "amount_user": np.array([position["amount_user"] or 0 for position in positions], dtype=float),
+            "entry_price": np.array([position["entry_price"] for position in positions], dtype=float),
+            # NaN if unknown - such positions are skipped (or not rounded)
+            "last_price": np.array([self.last_prices.get(symbol) or np.nan for symbol in symbols], dtype=float),
+            "min_qty": np.array(
+                [self.min_qty_and_step_sizes.get(symbol, {}).get("min_qty", np.nan) for symbol in symbols],
+                dtype=float
+            ),
+            "step_size": np.array(
+                [self.min_qty_and_step_sizes.get(symbol, {}).get("step_size", np.nan) for symbol in symbols],
+                dtype=float
+            ),
+        }
+
+    def plan(self, positions_to_open: list, already_existing_positions: list):
+        """
+        Returns the action plan (position table IDs with new quantities)
+        Ex.: {
+            "partially_close": [{"id": 12, "quantity_to_close": 0.3}],
+            "cancel_and_reopen": [{"id": 15, "amount_user": 1.2}],
+            "open": [{"id": 21, "entry_price": 26157.0, "amount_user": 0.01}],
+        }
+        """
+        plan = {"partially_close": [], "cancel_and_reopen": [], "open": []}
+        # Existing positions are rebalanced only if there are new positions that need a part of the balance
+        if already_existing_positions and positions_to_open:
+            self._plan_rebalance(positions=already_existing_positions, plan=plan)
+        if positions_to_open:
+            self._plan_open(positions=positions_to_open, plan=plan)
+        return plan
+
+    def _plan_rebalance(self, positions: list, plan: dict):
+        arrays = self._get_arrays(positions)
+        is_filled = np.array([bool(position["is_filled"]) for position in positions])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # The trader's share of the balance is split equally between its positions
+            max_values_in_usdt = self.balance_in_usdt * (arrays["kc"] / arrays["positions_count"])
+
+            # Filled - partially close the part that exceeds the position's share (valued by the last price)
+            current_values_in_usdt = (arrays["amount_user"] * arrays["last_price"]) / arrays["leverage"]
+            values_to_close_in_usdt = current_values_in_usdt - max_values_in_usdt
+            quantities_to_close = (values_to_close_in_usdt * arrays["leverage"]) / arrays["last_price"]
+            quantities_to_close = np.floor(quantities_to_close / arrays["step_size"]) * arrays["step_size"]
+            quantities_to_close = np.minimum(quantities_to_close, arrays["amount_user"])
+            to_close = is_filled & (values_to_close_in_usdt > 0) & ~np.isnan(quantities_to_close)
+
+            # Not filled - cancel and reopen with a lower amount (valued by the original entry price)
+            values_in_usdt = arrays["amount_user"] * arrays["entry_price"]
+            amounts_user = convert_amounts(
+                user_amounts=max_values_in_usdt / arrays["entry_price"],
+                min_qtys=arrays["min_qty"],
+                step_sizes=arrays["step_size"],
+                entry_prices=arrays["entry_price"],
+            )
+            to_reopen = ~is_filled & (values_in_usdt > max_values_in_usdt) & ~np.isnan(amounts_user)
+
+        for idx in np.flatnonzero(to_close):
+            plan["partially_close"].append(
+                {"id": positions[idx]["id"], "quantity_to_close": float(quantities_to_close[idx])}
+            )
+        for idx in np.flatnonzero(to_reopen):
+            plan["cancel_and_reopen"].append({"id": positions[idx]["id"], "amount_user": float(amounts_user[idx])})
+
+    def _plan_open(self, positions: list, plan: dict):
+        arrays = self._get_arrays(positions)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            entry_prices = np.where(np.isnan(arrays["last_price"]), arrays["entry_price"], arrays["last_price"])
+            max_values_in_usdt = self.balance_in_usdt * (arrays["kc"] / arrays["positions_count"])
+            amounts_user = (max_values_in_usdt / entry_prices) * arrays["leverage"]
+            converted_amounts_user = convert_amounts(
+                user_amounts=amounts_user,
+                min_qtys=arrays["min_qty"],
+                step_sizes=arrays["step_size"],
+                entry_prices=entry_prices,
+            )
+            # Not rounded if the symbol's min. quantity and step size are unknown
+            amounts_user = np.where(np.isnan(converted_amounts_user), amounts_user, converted_amounts_user)
+
+        for idx in range(len(positions)):
+            plan["open"].append({
+                "id": positions[idx]["id"],
+                "entry_price": float(entry_prices[idx]),
+                "amount_user": float(amounts_user[idx]),
+            })
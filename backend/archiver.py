@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import traceback
+from loguru import logger
+import helpers
+from db_manager import DatabaseManager
+
+config = helpers.load_config_from_yaml()
+db_host = config["db_host"]
+db_user = config["db_user"]
+db_password = config["db_password"]
+database = config["database"]
+archive_batch_size = config.get("archive_batch_size", 1000)
+archive_min_age_hours = config.get("archive_min_age_hours", 24)
+archive_delay = config.get("archive_delay", 3600)
+position_latency_retention_hours = config.get("position_latency_retention_hours", 24)
+
+# Pause between batches so the archival doesn't hold locks the trading bots are waiting for
+BATCH_DELAY = 1
+
+
+def archive_position_table(db: DatabaseManager, position_table: str):
+    """
+    Moves inactive positions of 'position_table' to its history table in chunked batches
+    Returns the number of archived positions
+    """
+    db.add_history_partitions(position_table=position_table)
+
+    archived_count = 0
+    while True:
+        batch_archived_count = db.archive_inactive_positions(
+            position_table=position_table, batch_size=archive_batch_size, min_age_hours=archive_min_age_hours
+        )
+        archived_count += batch_archived_count
+        if batch_archived_count < archive_batch_size:
+            break
+        time.sleep(BATCH_DELAY)
+
+    logger.info(f"Archived {archived_count} positions of {position_table}")
+    return archived_count
+
+
+def prune_position_latencies(db: DatabaseManager):
+    """
+    Deletes latency timestamps (see latency_tracker.py) older than the retention window in chunked batches
+    Returns the number of positions whose timestamps were deleted
+    """
+    before_ts = helpers.get_current_timestamp_in_ms() - int(position_latency_retention_hours * 60 * 60 * 1000)
+
+    deleted_count = 0
+    while True:
+        batch_deleted_count = db.delete_position_latencies(before_ts=before_ts, batch_size=archive_batch_size)
+        deleted_count += batch_deleted_count
+        if batch_deleted_count < archive_batch_size:
+            break
+        time.sleep(BATCH_DELAY)
+
+    logger.info(f"Deleted latency timestamps of {deleted_count} positions")
+    return deleted_count
+
+
+def run():
+    logging_dir = "./logs/archiver/"
+    os.makedirs(logging_dir, exist_ok=True)
+    logger.add(f"{logging_dir}"+"{time:YYYY-MM-DD}.log", rotation="00:00", retention="1 day")
+
+    db = DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database)
+    position_tables = [f"position_{instance}" for instance in sys.argv[1:]] or db.x_inst_pos_table_names
+    while True:
+        for position_table in position_tables:
+            try:
+                archive_position_table(db=db, position_table=position_table)
+            except Exception:
+                logger.error(traceback.format_exc())
+        try:
+            prune_position_latencies(db=db)
+        except Exception:
+            logger.error(traceback.format_exc())
+        time.sleep(archive_delay)
+
+
+if __name__ == "__main__":
+    """
+    Usage: python archiver.py [x1 x2 ...] (all instances by default)
+    """
+    run()
@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+from types import MappingProxyType
+import yaml
+from loguru import logger
+
+CONFIG_FILE_PATH = "config.yml"
+
+# Seconds between 'config.yml' modification checks (a single 'os.stat' call)
+CONFIG_CHECK_INTERVAL = 1
+
+NUMBER = (int, float)
+
+# {key: (allowed types, is_required), ...} - a new version of the file is published only if it matches
+CONFIG_SCHEMA = {
+    "db_backend": (str, False),
+    "sqlite_dir": (str, False),
+    "db_host": (str, True),
+    "db_user": (str, True),
+    "db_password": (str, True),
+    "database": (str, True),
+    "db_pool_size": (int, False),
+    "db_health_check_interval": (NUMBER, False),
+    "db_pool_timeout": (NUMBER, False),
+    "db_async_pool_size": (int, False),
+    "archive_batch_size": (int, False),
+    "archive_min_age_hours": (NUMBER, False),
+    "archive_delay": (NUMBER, False),
+    "position_latency_retention_hours": (NUMBER, False),
+    "search_traders_config": (dict, False),
+    "get_trade_stats": (dict, False),
+    "filter_traders_config": (dict, False),
+    "equity_of_total_equity": (NUMBER, True),
+    "equity_per_single_pos": (NUMBER, True),
+    "incr_decr_perc": (NUMBER, True),
+    "max_pos_size_perc": (NUMBER, True),
+    "min_pos_size_perc": (NUMBER, True),
+    "max_time_to_fill": (NUMBER, True),
+    "ignore_neg_total_roi_traders": (bool, True),
+    "ignore_neg_all_timeframes_roi_traders": (bool, True),
+    "ignore_observed_traders": (bool, True),
+    "sl_ratio": (NUMBER, True),
+    "copy_trader_by": (str, True),
+    "kc_full_recompute_interval": (NUMBER, False),
+    "trader_cache_ttl": (NUMBER, False),
+    "max_concurrent_stages": (int, False),
+    "x1_copy_positions": (bool, False),
+    "x2_copy_positions": (bool, False),
+    "x3_copy_positions": (bool, False),
+    "scripts_to_check": (list, False),
+}
+
+
+def freeze(value):
+    """
+    Read-only copy of parsed YAML (dicts -> MappingProxyType, lists -> tuples)
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(inner_value) for key, inner_value in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(inner_value) for inner_value in value)
+    return value
+
+
+def validate_config(config_data: dict, schema: dict = CONFIG_SCHEMA):
+    """
+    Returns a list of errors (empty if the config is valid)
+    Ex.: ["'sl_ratio' must be int/float, got str", "'db_host' is missing"]
+    """
+    if not isinstance(config_data, dict):
+        return [f"config must be a mapping, got {type(config_data).__name__}"]
+
+    errors = []
+    for key, (allowed_types, is_required) in schema.items():
+        if key not in config_data:
+            if is_required:
+                errors.append(f"'{key}' is missing")
+            continue
+        value = config_data[key]
+        allowed_types = allowed_types if isinstance(allowed_types, tuple) else (allowed_types,)
+        # bool is a subclass of int, but True is not a valid number of seconds
+        if (isinstance(value, bool) and bool not in allowed_types) or not isinstance(value, allowed_types):
+            allowed_types_as_str = "/".join([allowed_type.__name__ for allowed_type in allowed_types])
+            errors.append(f"'{key}' must be {allowed_types_as_str}, got {type(value).__name__}")
+    return errors
+
+
+class ConfigService:
+    """
+    Parses 'config.yml' once and re-parses it only when the file changes (modification time/size are polled
+    at most every 'check_interval' seconds)
+    Every valid version is published as an immutable snapshot, so readers can keep a reference without copying it
+    and subscribers are notified. An invalid version is logged and the previous snapshot is kept
+    """
+    def __init__(self, file_path: str = CONFIG_FILE_PATH, schema: dict = CONFIG_SCHEMA,
+                 check_interval: float = CONFIG_CHECK_INTERVAL):
+        self.file_path = file_path
+        self.schema = schema
+        self.check_interval = check_interval
+        self.snapshot = MappingProxyType({})
+        self.version = 0  # number of published versions
+        self.file_signature = None  # (modification time, size)
+        self.last_check_ts = 0
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.refresh(force=True)
+
+    def get(self):
+        self.refresh()
+        return self.snapshot
+
+    def subscribe(self, callback):
+        """
+        'callback(snapshot)' is called after every newly published version
+        """
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def _get_file_signature(self):
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def refresh(self, force: bool = False):
+        """
+        Returns True if a new version was published
+        """
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.last_check_ts < self.check_interval:
+                return False
+            self.last_check_ts = now
+
+            file_signature = self._get_file_signature()
+            if not force and file_signature == self.file_signature:
+                return False
+            self.file_signature = file_signature
+
+            if file_signature is None:
+                config_data = {}  # same as before - a missing file is an empty config
+            else:
+                try:
+                    with open(self.file_path, "r") as file:
+                        config_data = yaml.safe_load(file) or {}
+                except Exception as e:
+                    logger.error(f"Error occurred while loading the YAML file: {e}")
+                    return False
+
+                errors = validate_config(config_data=config_data, schema=self.schema)
+                if errors and self.version:
+                    logger.error(f"Invalid {self.file_path}, keeping the previous version. Errors: {errors}")
+                    return False
+                elif errors:  # there is no previous version to keep
+                    logger.error(f"Invalid {self.file_path}. Errors: {errors}")
+
+            self.snapshot = freeze(config_data)
+            self.version += 1
+            subscribers = list(self.subscribers)
+
+        if self.version > 1:
+            logger.info(f"{self.file_path} changed, version {self.version} published")
+        for callback in subscribers:
+            try:
+                callback(self.snapshot)
+            except Exception as e:
+                logger.error(f"Error in config subscriber {callback}: {e}")
+        return True
+
+
+_config_services = {}
+_config_services_lock = threading.Lock()
+
+
+def get_config_service(file_path: str = CONFIG_FILE_PATH):
+    """
+    One service per file per process
+    """
+    with _config_services_lock:
+        if file_path not in _config_services:
+            _config_services[file_path] = ConfigService(file_path=file_path)
+        return _config_services[file_path]
@@ -0,0 +1,209 @@
+import asyncio
+import threading
+import aiomysql
+from loguru import logger
+import db_queries
+import helpers
+from db_pool import db_backend, get_connection_pool
+
+config = helpers.load_config_from_yaml()
+db_async_pool_size = config.get("db_async_pool_size", 5)
+
+
+def group_by_trader_id(rows: list):
+    """
+    Ex.: {"123qwerty123": [row_1, row_2, ...], ...}
+    """
+    rows_by_trader_id = {}
+    for row in rows:
+        rows_by_trader_id.setdefault(row["trader_id"], []).append(row)
+    return rows_by_trader_id
+
+
+class AsyncDatabaseManager:
+    """
+    asyncio (aiomysql) counterpart of the DatabaseManager methods used by every iteration
+    Its queries don't block the event loop, so they can run concurrently with each other and with
+    TradingAPI requests of the same loop (ex.: asyncio.gather of DB reads and a balance request)
+    Every thread has its own event loop (see helpers.init_worker_event_loop) - and its own long-lived pool,
+    so it's meant for long-lived threads (ex.: Leaderboard's stage workers). Pools are closed by 'close_all'
+    With the SQLite backend queries run in the default executor (an embedded database has no async driver)
+    Ex.:
+        kc_stats, db_positions = loop.run_until_complete(asyncio.gather(
+            async_db.get_all_traders_kc_stats(kc_stats_table_name="kc_stats_x1"),
+            async_db.fetch_active_non_ignored_positions(table="position_x1"),
+        ))
+        ...
+        async_db.close_all()
+    """
+    def __init__(self, db_host, db_user, db_password, database, pool_size: int = db_async_pool_size):
+        self.host = db_host
+        self.user = db_user
+        self.password = db_password
+        self.database = database
+        self.pool_size = pool_size
+        self.dialect = db_backend
+        # {thread ID: (event loop, pool), ...} - pools can't be shared between event loops (threads)
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def _run_sqlite(self, method: str, query: str, args=None):
+        backend = get_connection_pool(
+            db_host=self.host, db_user=self.user, db_password=self.password, database=self.database
+        )
+        connection = backend.get_connection()
+        try:
+            with connection.cursor(dictionary=True) as cursor:
+                cursor.execute(query, args)
+                result = cursor.lastrowid if method == "execute" else getattr(cursor, method)()
+            connection.commit()
+            return result
+        finally:
+            backend.release_connection(connection=connection)
+
+    async def get_pool(self):
+        thread_id = threading.get_ident()
+        if thread_id not in self.pools:
+            # Every statement is committed right away, so reads see data committed by other connections
+            pool = await aiomysql.create_pool(
+                host=self.host,
+                user=self.user,
+                password=self.password,
+                db=self.database,
+                minsize=1,
+                maxsize=self.pool_size,
+                autocommit=True,
+            )
+            with self.lock:
+                self.pools[thread_id] = (asyncio.get_running_loop(), pool)
+            logger.debug(f"Async MySQL connection pool created (size: {self.pool_size}).")
+        return self.pools[thread_id][1]
+
+    @staticmethod
+    async def close_pool(pool):
+        pool.close()
+        await pool.wait_closed()
+
+    def close_all(self):
+        """
+        Closes pools of all threads - once the threads are done (ex.: their executor is shut down),
+        every pool is closed on its own (not running anymore) event loop
+        """
+        with self.lock:
+            pools = list(self.pools.values())
+            self.pools = {}
+        for loop, pool in pools:
+            loop.run_until_complete(self.close_pool(pool))
+
+    async def fetchall(self, query: str, args=None):
+        if self.dialect == "sqlite":
+            return await asyncio.to_thread(self._run_sqlite, "fetchall", query, args)
+        pool = await self.get_pool()
+        async with pool.acquire() as connection:
+            async with connection.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(query, args)
+                return await cursor.fetchall()
+
+    async def fetchone(self, query: str, args=None):
+        if self.dialect == "sqlite":
+            return await asyncio.to_thread(self._run_sqlite, "fetchone", query, args)
+        pool = await self.get_pool()
+        async with pool.acquire() as connection:
+            async with connection.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(query, args)
+                return await cursor.fetchone()
+
+    async def execute(self, query: str, args=None):
+        """
+        Returns the last inserted row ID
+        """
+        if self.dialect == "sqlite":
+            return await asyncio.to_thread(self._run_sqlite, "execute", query, args)
+        pool = await self.get_pool()
+        async with pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, args)
+                return cursor.lastrowid
+
+    async def insert_data(self, table, data):
+        query = db_queries.get_insert_query(table=table, columns=data.keys())
+        return await self.execute(query, tuple(data.values()))
+
+    async def update_data(self, table, data, condition_column, condition_value):
+        query = db_queries.get_update_query(table=table, columns=data.keys(), condition_column=condition_column)
+        await self.execute(query, list(data.values()) + [condition_value])
+
+    async def fetch_active_db_positions(self, table):
+        query = db_queries.get_active_positions_query(table=table)
+        return group_by_trader_id(await self.fetchall(query))
+
+    async def fetch_active_non_ignored_trader_ids_to_copy(self, table: str):
+        """
+        Same as DatabaseManager.fetch_active_non_ignored_trader_ids_to_copy
+        """
+        query = db_queries.get_active_non_ignored_positions_query(table=table, select="DISTINCT(t.trader_id)")
+        return [row["trader_id"] for row in await self.fetchall(query)]
+
+    async def fetch_active_non_ignored_positions(self, table: str):
+        """
+        Ex.: {'trader_xyz_id': [pos1, pos2, ...]}
+        """
+        query = db_queries.get_active_non_ignored_positions_query(table=table)
+        return group_by_trader_id(await self.fetchall(query))
+
+    async def get_temp_positions_from_db(self, ignore_observed_traders: bool = True):
+        """
+        Ex.: {"trader_id_1": [{pos_1, pos_2, ...}], ...}
+        """
+        query = db_queries.get_temp_positions_query(ignore_observed_traders=ignore_observed_traders)
+        return group_by_trader_id(await self.fetchall(query))
+
+    async def calculate_total_kc(self, top_x_table_name: str, trader_ids: list):
+        if not trader_ids:
+            return None
+        query = db_queries.get_total_kc_query(top_x_table_name=top_x_table_name, trader_ids=trader_ids)
+        result = await self.fetchone(query, list(trader_ids) + list(trader_ids))
+        return result["kelly_criteria"]
+
+    async def get_all_traders_kc_stats(self, kc_stats_table_name: str):
+        """
+        Ex.: {"123qwerty123": 0.11, "321qwerty321": 0.09}
+        """
+        query = db_queries.get_kc_stats_query(kc_stats_table_name=kc_stats_table_name, column="kelly_criteria")
+        return {row["trader_id"]: row["kelly_criteria"] for row in await self.fetchall(query)}
+
+    async def get_all_traders_tc_stats(self, kc_stats_table_name: str):
+        """
+        Ex.: {"123qwerty123": 108, "321qwerty321": 29}
+        """
+        query = db_queries.get_kc_stats_query(kc_stats_table_name=kc_stats_table_name, column="trades_count")
+        return {row["trader_id"]: row["trades_count"] for row in await self.fetchall(query)}
+
+    async def get_all_traders_penalties(self, top_x_table_name: str):
+        """
+        Ex.: {"123qwerty123": 0.11, "321qwerty321": 0.09}
+        """
+        query = db_queries.get_penalties_query()
+        return {row["trader_id"]: row["penalty_value"] for row in await self.fetchall(query, (top_x_table_name,))}
+
+    async def get_all_active_stop_losses(self, position_table: str):
+        query = db_queries.get_active_orders_query(orders_table="stop_losses")
+        return {row["orig_position_id"]: row for row in await self.fetchall(query, (position_table,))}
+
+    async def get_all_active_pos_stop_losses(self, position_table: str):
+        """
+        These stop-losses might be not active (already triggered) but positions still open
+        """
+        query = db_queries.get_active_pos_orders_query(orders_table="stop_losses", position_table=position_table)
+        return {row["orig_position_id"]: row for row in await self.fetchall(query, (position_table,))}
+
+    async def get_all_active_take_profits(self, position_table: str):
+        query = db_queries.get_active_orders_query(orders_table="take_profits")
+        return {row["orig_position_id"]: row for row in await self.fetchall(query, (position_table,))}
+
+    async def get_all_active_pos_take_profits(self, position_table: str):
+        """
+        These take-profits might be not active (already triggered) but positions still open
+        """
+        query = db_queries.get_active_pos_orders_query(orders_table="take_profits", position_table=position_table)
+        return {row["orig_position_id"]: row for row in await self.fetchall(query, (position_table,))}
@@ -0,0 +1,154 @@
+from loguru import logger
+
+
+class BatchWriter:
+    """
+    Unit of work for DatabaseManager writes (inserts, updates and deletes)
+    Row changes are accumulated in memory and flushed in a single transaction (one commit per stage)
+    Writes are flushed in the order they were queued, consecutive writes of the same shape are sent
+    with one 'executemany'
+    Ex.:
+        with self.db.batch() as batch:
+            for position in positions:
+                batch.update_data(table=..., data={"pnl": ...}, condition_column="okx_pos_id", condition_value=...)
+    """
+    def __init__(self, db):
+        self.db = db
+        # [("update", table, condition_column, condition_value, data), ("insert", table, data, is_upsert),
+        #  ("delete", table, condition_column, condition_value), ("call", func), ...]
+        self.operations = []
+        # {(table, condition_column, condition_value): data, ...} - updates queued since the last insert/delete
+        self.pending_updates = {}
+        # Called after the batch is committed
+        self.after_flush_callbacks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Flushing even if the stage crashed - previously every row was committed right away,
+        # so changes made before the crash (ex.: orders already canceled on Binance) must not be lost
+        if exc_type is None:
+            self.flush()
+            return
+        try:
+            self.flush()
+        except Exception as e:
+            # The stage's exception is the one to re-raise (it's the cause)
+            logger.error(f"Unable to flush BatchWriter after {exc_type.__name__}: {e}")
+
+    def update_data(self, table, data, condition_column, condition_value):
+        """
+        Multiple updates of the same row are coalesced into one (later values win),
+        unless an insert or a delete was queued in between
+        """
+        row_key = (table, condition_column, condition_value)
+        if row_key in self.pending_updates:
+            self.pending_updates[row_key].update(data)
+            return
+        self.pending_updates[row_key] = dict(data)
+        self.operations.append(("update", table, condition_column, condition_value, self.pending_updates[row_key]))
+
+    def insert_data(self, table, data):
+        self.pending_updates = {}
+        self.operations.append(("insert", table, dict(data), False))
+
+    def insert_or_update_data(self, table, data):
+        self.pending_updates = {}
+        self.operations.append(("insert", table, dict(data), True))
+
+    def delete_data(self, table, condition_column, condition_value):
+        self.pending_updates = {}
+        self.operations.append(("delete", table, condition_column, condition_value))
+
+    def call(self, func):
+        """
+        func(cursor) is run in the batch's transaction, in order with the other writes
+        Ex.: batch.call(lambda cursor: self.db.apply_success_stats_outcomes(outcomes=..., cursor=cursor))
+        """
+        self.pending_updates = {}
+        self.operations.append(("call", func))
+
+    def after_flush(self, callback):
+        """
+        callback() is called once the batch is committed (never if the flush fails)
+        """
+        self.after_flush_callbacks.append(callback)
+
+    def __len__(self):
+        return len(self.operations)
+
+    def _group_operations(self):
+        """
+        Groups consecutive operations of the same shape so every group can be sent with 'executemany'
+        Ex.: [(("update", "position_x1", "okx_pos_id", ("pnl", "roe")), [(12.1, 0.4, 111), (3.2, 0.1, 222)]), ...]
+        """
+        groups = []
+        for operation in self.operations:
+            kind, table = operation[0], operation[1]
+            if kind == "update":
+                _, _, condition_column, condition_value, data = operation
+                key = (kind, table, condition_column, tuple(data.keys()))
+                values = tuple(data.values()) + (condition_value,)
+            elif kind == "insert":
+                _, _, data, is_upsert = operation
+                key = (kind, table, tuple(data.keys()), is_upsert)
+                values = tuple(data.values())
+            elif kind == "delete":
+                _, _, condition_column, condition_value = operation
+                key = (kind, table, condition_column)
+                values = (condition_value,)
+            else:
+                groups.append((operation, None))
+                continue
+            if groups and groups[-1][0] == key:
+                groups[-1][1].append(values)
+            else:
+                groups.append((key, [values]))
+        return groups
+
+    def flush(self):
+        after_flush_callbacks = self.after_flush_callbacks
+        self.after_flush_callbacks = []
+        if len(self):
+            groups = self._group_operations()
+            self.operations = []
+            self.pending_updates = {}
+
+            connection = self.db.connection
+            try:
+                with connection.cursor() as cursor:
+                    for key, rows in groups:
+                        if key[0] == "call":
+                            key[1](cursor)
+                            continue
+                        cursor.executemany(self._get_query(key), rows)
+
+                connection.commit()
+            except Exception as e:
+                connection.rollback()
+                logger.error(f"Error in BatchWriter.flush: {e}")
+                raise
+
+        for callback in after_flush_callbacks:
+            callback()
+
+    @staticmethod
+    def _get_query(key):
+        kind, table = key[0], key[1]
+        if kind == "insert":
+            _, _, columns, is_upsert = key
+            columns_as_str = ", ".join(columns)
+            placeholders = ", ".join(["%s"] * len(columns))
+            query = f"INSERT INTO {table} ({columns_as_str}) VALUES ({placeholders})"
+            if is_upsert:
+                update_statements = ", ".join([f"{column} = VALUES({column})" for column in columns])
+                query += f" ON DUPLICATE KEY UPDATE {update_statements}"
+            # mysql-connector rewrites INSERT's executemany into one multi-row statement
+            return query
+        if kind == "update":
+            _, _, condition_column, columns = key
+            set_values = ", ".join([f"{column} = %s" for column in columns])
+            return f"UPDATE {table} SET {set_values} WHERE {condition_column} = %s"
+        _, _, condition_column = key
+        return f"DELETE FROM {table} WHERE {condition_column} = %s"
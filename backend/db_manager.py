@@ -1,9 +1,14 @@
+import threading
 import time
 from datetime import datetime
 from typing import Optional
-import mysql.connector
 from loguru import logger
 import helpers
+from db_pool import db_pool_size, get_connection_pool
+from db_batch import BatchWriter
+import db_queries
+from db_migrations import run_migrations
+from records import get_normalizer
 from pprint import pprint
 
 config = helpers.load_config_from_yaml()
@@ -11,32 +16,76 @@ db_host = config["db_host"]
 db_user = config["db_user"]
 db_password = config["db_password"]
 database = config["database"]
+kc_full_recompute_interval = config.get("kc_full_recompute_interval", 86400)
+
+# Kelly Criteria is calculated over positions closed during the last year
+KC_WINDOW_IN_MS = 365 * 24 * 60 * 60 * 1000
+KC_MIN_VARIANCE = 1e-12
+
+# 'data_versions' table names (versions are bumped after every change of the data)
+FOLLOWED_TRADERS_DATA_VERSION = "followed_traders"  # 'trader.is_followed' and 'trader.is_observed'
+TRADER_METADATA_DATA_VERSION = "trader_metadata"  # any 'trader'/'trader_stats' data updated by the scraper
 
 class DatabaseManager:
-    def __init__(self, db_host, db_user, db_password, database):
+    def __init__(self, db_host, db_user, db_password, database, pool_size: int = db_pool_size):
         self.host = db_host
         self.user = db_user
         self.password = db_password
         self.database = database
-        self.connection = self._connect()
+        self.pool = get_connection_pool(
+            db_host=self.host, db_user=self.user, db_password=self.password, database=self.database,
+            pool_size=pool_size
+        )
+        # "mysql" or "sqlite" - the few statements that can't be translated to SQLite are branched on it
+        self.dialect = self.pool.dialect
+        # Every thread (ex.: concurrently running Leaderboard stages) borrows its own connection
+        # {"connection": ..., "last_health_check_ts": ...}
+        self.thread_state = threading.local()
+        # {trade_item_id: position, ...} - last snapshot written to 'position_temp' by this instance
+        self.temp_positions_snapshot = None
+        # {position_table: data version, ...} - followed traders version of the last 'sync_success_stats_traders'
+        self.synced_data_versions = {}
         self.init_x_inst_pos_table_names()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def connection(self):
+        """
+        Connection borrowed from the shared pool by the current thread
+        It is health-checked (pinged) at most once per 'db_health_check_interval' seconds
+        """
+        connection = getattr(self.thread_state, "connection", None)
+        if connection is None:
+            connection = self._connect()
+        elif time.time() - self.thread_state.last_health_check_ts > self.pool.health_check_interval:
+            self.thread_state.connection = self.pool.check_health(connection=connection)
+            self.thread_state.last_health_check_ts = time.time()
+        return self.thread_state.connection
+
     def _connect(self):
-        connection = mysql.connector.connect(
-            host=self.host,
-            user=self.user,
-            password=self.password
-        )
+        connection = self.pool.get_connection()
+        self.thread_state.connection = connection
+        self.thread_state.last_health_check_ts = time.time()
+        return connection
 
-        with connection.cursor() as cursor:
-            cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.database}")
+    def reconnect(self):
+        logger.warning("Reconnecting to MySQL server.")
+        self.close()
+        self._connect()
 
-        return mysql.connector.connect(
-            host=self.host,
-            user=self.user,
-            password=self.password,
-            database=self.database
-        )
+    def close(self):
+        """
+        Returns the current thread's connection to the pool
+        """
+        connection = getattr(self.thread_state, "connection", None)
+        if connection is not None:
+            self.pool.release_connection(connection=connection)
+            self.thread_state.connection = None
     
     def init_x_inst_pos_table_names(self):
         self.x_inst_pos_table_names = [
@@ -181,7 +230,17 @@ class DatabaseManager:
                 UNIQUE (trader_id, position_table)
             )
             """,
-            
+            """
+            CREATE TABLE IF NOT EXISTS position_latency (
+                trade_item_id BIGINT NOT NULL,
+                position_table VARCHAR(255) NOT NULL DEFAULT '',
+                stage VARCHAR(255) NOT NULL,
+                stage_ts BIGINT NOT NULL,
+                inserted_on DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (trade_item_id, position_table, stage)
+            )
+            """,
+
         ]
 
         for query in create_init_table_queries:
@@ -274,6 +333,9 @@ class DatabaseManager:
                     self.connection.commit()
         logger.info('Tables Successful Created!')
 
+        # Secondary indexes are created (and evolved) by versioned migrations
+        run_migrations(db=self)
+
     def insert_position(self, table, data):
        with self.connection.cursor() as cursor:
             try:
@@ -310,9 +372,7 @@ class DatabaseManager:
 
     def insert_data(self, table, data):
         with self.connection.cursor() as cursor:
-            columns = ', '.join(data.keys())
-            placeholders = ', '.join(['%s'] * len(data))
-            query = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+            query = db_queries.get_insert_query(table=table, columns=data.keys())
             
             values = tuple(data.values())
             cursor.execute(query, values)
@@ -340,12 +400,18 @@ class DatabaseManager:
 
     def update_data(self, table, data, condition_column, condition_value):
         with self.connection.cursor() as cursor:
-            set_values = ', '.join([f"{column} = %s" for column in data.keys()])
-            query = f"UPDATE {table} SET {set_values} WHERE {condition_column} = %s"
+            query = db_queries.get_update_query(table=table, columns=data.keys(), condition_column=condition_column)
             
             values = list(data.values()) + [condition_value]
             cursor.execute(query, values)
             self.connection.commit()
+
+    def batch(self):
+        """
+        Returns a BatchWriter which collects 'update_data', 'insert_data' and 'insert_or_update_data' calls
+        and commits them all at once when leaving the 'with' block
+        """
+        return BatchWriter(db=self)
    
     def fetch_all_trader_ids(self):   
         with self.connection.cursor(dictionary=True) as cursor:
@@ -373,7 +439,7 @@ class DatabaseManager:
        
     def fetch_active_db_positions(self, table):
         with self.connection.cursor(dictionary=True) as cursor:
-            query = f"SELECT * FROM {table} WHERE is_active = 1 ORDER BY inserted_on ASC"
+            query = db_queries.get_active_positions_query(table=table)
             cursor.execute(query)
             results = cursor.fetchall()
             
@@ -392,16 +458,7 @@ class DatabaseManager:
         SQL query will ignore all next traders with the same symbol
         """
         with self.connection.cursor(dictionary=True) as cursor:
-            query = f"""
-                SELECT DISTINCT(t.trader_id)
-                FROM {table} t 
-                INNER JOIN (
-                    SELECT MIN(id) AS earliest_id
-                    FROM {table}
-                    WHERE is_active = 1 AND is_ignored = 0
-                    GROUP BY symbol
-                ) AS subquery ON t.id = subquery.earliest_id
-            """
+            query = db_queries.get_active_non_ignored_positions_query(table=table, select="DISTINCT(t.trader_id)")
             cursor.execute(query)
             results = cursor.fetchall()
             trader_ids = [row["trader_id"] for row in results]
@@ -414,16 +471,7 @@ class DatabaseManager:
         Ex.: {'trader_xyz_id': [pos1, pos2, ...]}
         """
         with self.connection.cursor(dictionary=True) as cursor:
-            query = f"""
-                SELECT t.*
-                FROM {table} t 
-                INNER JOIN (
-                    SELECT MIN(id) AS earliest_id
-                    FROM {table}
-                    WHERE is_active = 1 AND is_ignored = 0
-                    GROUP BY symbol
-                ) AS subquery ON t.id = subquery.earliest_id
-            """
+            query = db_queries.get_active_non_ignored_positions_query(table=table)
             cursor.execute(query)
             results = cursor.fetchall()
 
@@ -448,6 +496,19 @@ class DatabaseManager:
             as_dict = {row['trader_id']: row['yield_ratio'] for row in results}
             return as_dict
         
+    def fetch_all_traders_metadata(self):
+        """
+        Returns ROI and followed/observed status of all traders (used by TraderMetadataCache)
+        Ex.: {"123qwerty123": {"trader_id": "123qwerty123", "yield_ratio": 0.34, "is_followed": 1, "is_observed": 0}, ...}
+        """
+        with self.connection.cursor(dictionary=True) as cursor:
+            # Start a new transaction so you would see traders updated by another connection
+            self.connection.commit()
+            query = "SELECT trader_id, yield_ratio, is_followed, is_observed FROM trader"
+            cursor.execute(query)
+            results = cursor.fetchall()
+            return {row["trader_id"]: row for row in results}
+
     def fetch_trader_ids_with_last_position_date(self, trader_ids: list):
         with self.connection.cursor(dictionary=True) as cursor:
             if not trader_ids:
@@ -500,87 +561,71 @@ class DatabaseManager:
             return results_restructured
     
     def upsert_init_traders(self, data: list):
+        """
+        Upserts all RapidAPI traders with a single multi-row statement and unfollows (or starts observing)
+        followed/observed traders that are not returned by RapidAPI anymore - all inside one transaction
+        """
         now = datetime.now()
 
+        # Re-keyed to 'trader' columns and typed once
+        api_traders_data_fixed = get_normalizer("init_traders").normalize_many(data)
+
         # get all trader IDs from RapidAPI
-        trader_ids_from_rapidapi = []
-        for trader_data_dict in data:
-            trader_id = trader_data_dict["id"]
-            trader_ids_from_rapidapi.append(trader_id)
-
-        db_followed_trader_ids = self.fetch_all_followed_trader_ids()
-        db_observed_trader_ids = self.fetch_observed_trader_ids()
-        db_combined_trader_ids = db_followed_trader_ids + db_observed_trader_ids
-        traders_to_stop_following_or_observing = list(set([trader_id for trader_id in db_combined_trader_ids if trader_id not in trader_ids_from_rapidapi]))
-        traders_to_stop_following_or_observing_rois = self.fetch_trader_ids_with_roi(trader_ids=traders_to_stop_following_or_observing)
-        traders_to_stop_following_or_observing_last_trading_dates = self.fetch_trader_ids_with_last_position_date(trader_ids=traders_to_stop_following_or_observing)
-        for trader_id in traders_to_stop_following_or_observing:
-            logger.debug(f"Unfollowing trader ID: {trader_id})")
-            data_to_update = {}
-
-            total_roi = None
-            if traders_to_stop_following_or_observing_rois.get(trader_id):
-                total_roi = traders_to_stop_following_or_observing_rois[trader_id]
-
-            last_pos_datetime = None
-            if traders_to_stop_following_or_observing_last_trading_dates.get(trader_id):
-                last_pos_datetime = traders_to_stop_following_or_observing_last_trading_dates[trader_id]["last_pos_datetime"]
-
-            should_be_observed = False
-            if total_roi is not None and last_pos_datetime is not None:
-                time_difference = now - last_pos_datetime # difference between current time and the time when the trader placed his most latest position
-                days_difference_from_the_last_trade = time_difference.days
-                if total_roi > 0 and days_difference_from_the_last_trade <= 30:
-                    should_be_observed = True
-
-            if should_be_observed:
-                logger.debug(f"Starting to observe trader ID: {trader_id})")
-                data_to_update["is_observed"] = 1
-            else:
-                data_to_update["is_observed"] = 0
-
-            data_to_update["is_init"] = 0
-            data_to_update["is_followed"] = 0
-
-            self.update_data(table="trader", data=data_to_update, condition_column="trader_id", condition_value=trader_id)
-
-        # Used for matching API returned keys to 'trader' table column keys
-        api_key_to_db_key_matcher = {
-            "id": "trader_id",
-            "aum": "aum",
-            "followPnl": "follow_pnl",
-            "followerLimit": "follower_limit",
-            "numberOfFollowers": "number_of_followers",
-            "totalNumberOfFollowers": "total_number_of_followers",
-            "initialDay": "initial_day",
-            "nickName": "nickname",
-            "pnl": "pnl",
-            "symbol": "symbol",
-            "targetId": "target_id",
-            "winRatio": "win_ratio",
-            "yieldRatio": "yield_ratio"
-        }
+        trader_ids_from_rapidapi = [trader_data_dict_fixed["trader_id"] for trader_data_dict_fixed in api_traders_data_fixed]
 
-        # Restructure data
-        api_traders_data_fixed = []
-        for trader_data_dict in data:
-            trader_data_dict_fixed = {api_key_to_db_key_matcher[key]: val for key, val in trader_data_dict.items() if api_key_to_db_key_matcher.get(key)}
-            api_traders_data_fixed.append(trader_data_dict_fixed)
-
-        # Iterate over all traders and insert or update data
-        for trader_data_dict_fixed in api_traders_data_fixed:
-            trader_id = trader_data_dict_fixed["trader_id"]
-            trader_exist = self.is_trader_exist(trader_id=trader_id)
-            trader_data_dict_fixed["is_init"] = 1
-            if trader_exist:
-                logger.debug(f"Updating existing trader: {trader_id}")
-                # trader_data_dict_fixed["is_followed"] = 1 # If we update an existing trader, we set 'following' as 1 in case the trader's following status was set as 0 previously
-                # trader_data_dict_fixed["is_observed"] = 0 # If we start following this trader again - then we no need to need to observe it
-                self.update_data(table="trader", data=trader_data_dict_fixed, condition_column="trader_id", condition_value=trader_id)
-            else:
-                logger.debug(f"Inserting new trader: {trader_id}")
-                trader_data_dict_fixed["is_followed"] = 0 # When we add this trader - we don't start following him/her as we will decide this later
-                self.insert_data(table="trader", data=trader_data_dict_fixed)
+        with self.connection.cursor() as cursor:
+            try:
+                # Traders that are not in RapidAPI anymore are unfollowed
+                # and observed only if their total ROI is positive and they traded during the last 30 days
+                query = """
+                    UPDATE trader
+                    SET
+                        is_observed = IF(
+                            yield_ratio > 0 AND last_pos_datetime IS NOT NULL
+                            AND TIMESTAMPDIFF(DAY, last_pos_datetime, %s) <= 30, 1, 0
+                        ),
+                        is_init = 0,
+                        is_followed = 0
+                    WHERE (is_followed = 1 OR is_observed = 1)
+                """
+                values = [now]
+                if trader_ids_from_rapidapi:
+                    placeholders = ', '.join(['%s'] * len(trader_ids_from_rapidapi))
+                    query += f" AND trader_id NOT IN ({placeholders})"
+                    values += trader_ids_from_rapidapi
+                cursor.execute(query, values)
+                logger.debug(f"Unfollowed {cursor.rowcount} traders that are not returned by RapidAPI anymore")
+
+                # Group traders by their columns so every group is a single multi-row upsert
+                grouped_traders = {}
+                for trader_data_dict_fixed in api_traders_data_fixed:
+                    trader_data_dict_fixed["is_init"] = 1
+                    # When we add this trader - we don't start following him/her as we will decide this later
+                    # (existing traders keep their following status)
+                    trader_data_dict_fixed["is_followed"] = 0
+                    columns = tuple(trader_data_dict_fixed.keys())
+                    grouped_traders.setdefault(columns, []).append(tuple(trader_data_dict_fixed.values()))
+
+                for columns, rows in grouped_traders.items():
+                    placeholders = ', '.join(['%s'] * len(columns))
+                    update_statements = ', '.join([
+                        f"{column} = VALUES({column})" for column in columns if column not in ["trader_id", "is_followed"]
+                    ])
+                    query = f"""
+                        INSERT INTO trader ({', '.join(columns)}) VALUES ({placeholders})
+                        ON DUPLICATE KEY UPDATE {update_statements}
+                    """
+                    cursor.executemany(query, rows)
+                self.connection.commit()
+            except Exception as e:
+                self.connection.rollback()
+                logger.error(f"Error in upsert_init_traders: {e}")
+                raise
+        logger.debug(f"Upserted {len(api_traders_data_fixed)} traders")
+
+        # Bumped after the changes are committed, so readers never sync old data with the new version
+        self.bump_data_version(name=FOLLOWED_TRADERS_DATA_VERSION)
+        self.bump_data_version(name=TRADER_METADATA_DATA_VERSION)
 
     def detect_traders_to_follow(self):
         config = helpers.load_config_from_yaml()
@@ -675,30 +720,108 @@ class DatabaseManager:
                 cursor.execute(query, traders_to_follow)
         
         self.connection.commit()
+        self.bump_data_version(name=FOLLOWED_TRADERS_DATA_VERSION)
+        self.bump_data_version(name=TRADER_METADATA_DATA_VERSION)
 
        
-    def insert_temp_positions(self, traders_ids_and_positions: dict):
+    def is_index_exist(self, table: str, index_name: str):
+        with self.connection.cursor() as cursor:
+            if self.dialect == "sqlite":
+                query = "SELECT 1 FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s"
+                cursor.execute(query, (table, self.pool.get_index_name(table=table, index_name=index_name)))
+                return cursor.fetchone() is not None
+            query = """
+                SELECT 1 FROM information_schema.statistics
+                WHERE table_schema = %s AND table_name = %s AND index_name = %s
+                LIMIT 1
+            """
+            cursor.execute(query, (self.database, table, index_name))
+            return cursor.fetchone() is not None
+
+    def is_column_exist(self, table: str, column: str):
+        with self.connection.cursor() as cursor:
+            if self.dialect == "sqlite":
+                cursor.execute("SELECT 1 FROM pragma_table_info(%s) WHERE name = %s", (table, column))
+                return cursor.fetchone() is not None
+            query = """
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = %s AND table_name = %s AND column_name = %s
+                LIMIT 1
+            """
+            cursor.execute(query, (self.database, table, column))
+            return cursor.fetchone() is not None
+
+    def add_column(self, table: str, column: str, definition: str):
+        """
+        Adds the column only if it doesn't exist yet
+        Ex.: add_column(table="kc_stats_x1", column="roe_sq_sum", definition="DOUBLE DEFAULT 0")
+        """
+        if self.is_column_exist(table=table, column=column):
+            return False
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            logger.info(f"Added column '{column}' to {table}")
+        return True
+
+    def add_index(self, table: str, index_name: str, columns: list, is_unique: bool = False):
+        """
+        Creates the index only if it doesn't exist yet (MySQL has no 'CREATE INDEX IF NOT EXISTS')
+        """
+        if self.is_index_exist(table=table, index_name=index_name):
+            return False
         with self.connection.cursor() as cursor:
-            current_time = int(str(time.time()).replace(".", "")[:13])  # Get the current timestamp (use the same format as in the leaderboard.py)
+            index_type = "UNIQUE INDEX" if is_unique else "INDEX"
+            db_index_name = self.pool.get_index_name(table=table, index_name=index_name)
+            cursor.execute(f"CREATE {index_type} {db_index_name} ON {table} ({', '.join(columns)})")
+            logger.info(f"Created index '{index_name}' on {table} ({', '.join(columns)})")
+        return True
 
-            for trader_id in traders_ids_and_positions:
-                positions = traders_ids_and_positions[trader_id]
+    def insert_temp_positions(self, traders_ids_and_positions: dict):
+        """
+        Refreshes 'position_temp' with the latest API snapshot in a single transaction,
+        so readers (leaderboard.py) never see a half-written snapshot
+        Only new/changed positions are upserted (keyed on 'trade_item_id') and vanished ones are deleted
+        """
+        current_time = int(str(time.time()).replace(".", "")[:13])  # Get the current timestamp (use the same format as in the leaderboard.py)
 
-                # Insert new positions with timestamps
-                for position in positions:
-                    # Add 'insert_timestamp' to the position with the current timestamp
-                    position['inserted_on_ts'] = current_time
-                    columns = ', '.join(position.keys())
-                    placeholders = ', '.join(['%s'] * len(position))
-                    query = f"INSERT INTO position_temp ({columns}) VALUES ({placeholders})"
-                    values = tuple(position.values())
-                    cursor.execute(query, values)
+        if self.temp_positions_snapshot is None:
+            # Rows written before this instance was created are unknown - they will be upserted/deleted once
+            with self.connection.cursor() as cursor:
+                cursor.execute("SELECT trade_item_id FROM position_temp")
+                self.temp_positions_snapshot = {row[0]: None for row in cursor.fetchall()}
+
+        current_snapshot = {}
+        for trader_id in traders_ids_and_positions:
+            for position in traders_ids_and_positions[trader_id]:
+                if position.get("trade_item_id") is None:
+                    logger.warning(f"Skipping API position without 'trade_item_id': {position}")
+                    continue
+                # Add 'inserted_on_ts' to the position with the current timestamp
+                position["inserted_on_ts"] = current_time
+                current_snapshot[int(position["trade_item_id"])] = position
+
+        with self.batch() as batch:
+            for trade_item_id, position in current_snapshot.items():
+                prev_position = self.temp_positions_snapshot.get(trade_item_id)
+                if prev_position is not None and self._is_same_temp_position(prev_position, position):
+                    continue
+                batch.insert_or_update_data(table="position_temp", data=dict(position))
 
             # Delete old positions not received from the API
-            query = f"DELETE FROM position_temp WHERE inserted_on_ts < %s"
-            cursor.execute(query, (current_time,))
+            for trade_item_id in self.temp_positions_snapshot:
+                if trade_item_id not in current_snapshot:
+                    batch.delete_data(table="position_temp", condition_column="trade_item_id", condition_value=trade_item_id)
 
-            self.connection.commit()
+        self.temp_positions_snapshot = {
+            trade_item_id: position.copy() for trade_item_id, position in current_snapshot.items()
+        }
+
+    @staticmethod
+    def _is_same_temp_position(prev_position: dict, position: dict):
+        # 'inserted_on_ts' changes on every poll - unchanged positions keep the timestamp of their last write
+        return all([
+            prev_position.get(key) == val for key, val in position.items() if key != "inserted_on_ts"
+        ]) and set(prev_position.keys()) == set(position.keys())
 
     def get_temp_positions_from_db(self, ignore_observed_traders: bool = True):
         """
@@ -715,19 +838,12 @@ class DatabaseManager:
             # https://stackoverflow.com/a/52386871
             self.connection.commit()
 
-            query = f"SELECT * FROM trader WHERE is_followed = 1"
-            cursor.execute(query)
-            results = cursor.fetchall()
-            trader_ids = [dict_i["trader_id"] for dict_i in results]
-
-            # get positions for certain traders' IDs
-            query = "SELECT * FROM position_temp"
+            query = db_queries.get_temp_positions_query(ignore_observed_traders=ignore_observed_traders)
             cursor.execute(query)
             results = cursor.fetchall()
-            results_filtered = [dict_i for dict_i in results if dict_i["trader_id"] in trader_ids]
             
             results_restructured = {}
-            for dict_i in results_filtered:
+            for dict_i in results:
                 trader_id = dict_i["trader_id"]
                 if dict_i["trader_id"] in results_restructured:
                     results_restructured[trader_id].append(dict_i)
@@ -743,53 +859,52 @@ class DatabaseManager:
         If the trader exists and is not active - it sets the trader as active and resets his stats
         If the 'is_win' arg is provided - it updates trader win/lose stats
         """
+        self.apply_success_stats_outcomes(outcomes=[(trader_id, position_table_name, is_win)])
 
-        # Check if trader exists in the table
-        with self.connection.cursor(dictionary=True) as cursor:
-            query = "SELECT * FROM success_stats WHERE trader_id = %s AND position_table = %s"
-            cursor.execute(query, (trader_id, position_table_name))
-            existing_trader = cursor.fetchone()
-
-        if existing_trader:
-            is_trader_active = existing_trader["is_active"]
-            if not is_trader_active:
-                logger.debug(f"Activating existing trader of 'sucess_stats' table. Trader ID: {trader_id}")
-                # We need to activate the trader and reset previous stats
-                with self.connection.cursor() as cursor:
-                    query = "UPDATE success_stats SET is_active = 1, win_count = 0, lose_count = 0 WHERE trader_id = %s AND position_table = %s"
-                    cursor.execute(query, (trader_id, position_table_name))
-                    self.connection.commit()
-                    
-                    if is_win is not None:
-                        # We refetch the trader if we will be updating his win or lose data
-                        with self.connection.cursor(dictionary=True) as cursor:
-                            query = "SELECT * FROM success_stats WHERE trader_id = %s AND position_table = %s"
-                            cursor.execute(query, (trader_id, position_table_name))
-                            existing_trader = cursor.fetchone()
+    def apply_success_stats_outcomes(self, outcomes: list, cursor=None):
+        """
+        Applies a batch of win/lose outcomes as atomic increments (single upsert statement)
+        Not existing traders are inserted, inactive ones are reactivated with reset stats (same as 'insert_or_update_success_stats')
+        Ex.: outcomes = [("123qwerty123", "position_x1", True), ("321qwerty321", "position_x1", False), ...]
+        ('is_win' = None only inserts/reactivates the trader)
+        'cursor' - runs in the caller's transaction, which commits it (ex.: BatchWriter.call)
+        """
+        if not outcomes:
+            return
+
+        # {(trader_id, position_table): [win_count, lose_count], ...}
+        counts = {}
+        for trader_id, position_table_name, is_win in outcomes:
+            trader_counts = counts.setdefault((trader_id, position_table_name), [0, 0])
+            if is_win is True:
+                trader_counts[0] += 1
+            elif is_win is False:
+                trader_counts[1] += 1
+
+        # 'is_active' has to be updated last - win/lose counts are reset based on its previous value
+        query = """
+            INSERT INTO success_stats (trader_id, position_table, is_active, win_count, lose_count)
+            VALUES (%s, %s, 1, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                win_count = IF(is_active = 1, win_count, 0) + VALUES(win_count),
+                lose_count = IF(is_active = 1, lose_count, 0) + VALUES(lose_count),
+                is_active = 1
+        """
+        values = [
+            (trader_id, position_table_name, win_count, lose_count)
+            for (trader_id, position_table_name), (win_count, lose_count) in counts.items()
+        ]
+        if cursor is not None:
+            cursor.executemany(query, values)
         else:
-            # We need to add a trader
-            logger.success(f"Inserting new trader to the 'sucess_stats' table. Trader ID: {trader_id}")
             with self.connection.cursor() as cursor:
-                query = "INSERT INTO success_stats(trader_id, position_table) VALUES(%s, %s)"
-                cursor.execute(query, (trader_id, position_table_name))
+                cursor.executemany(query, values)
                 self.connection.commit()
 
-        if is_win is True:
-            prev_win_count = existing_trader["win_count"]
-            new_win_count = prev_win_count + 1
-            logger.debug(f"Adding a win to the 'sucess_stats' table. Trader ID: {trader_id}")
-            with self.connection.cursor() as cursor:
-                query = "UPDATE success_stats SET win_count = %s WHERE trader_id = %s AND position_table = %s"
-                cursor.execute(query, (new_win_count, trader_id, position_table_name))
-                self.connection.commit()
-        elif is_win is False:
-            prev_lose_count = existing_trader["lose_count"]
-            new_lose_count = prev_lose_count + 1
-            logger.debug(f"Adding a lose to the 'sucess_stats' table. Trader ID: {trader_id}")
-            with self.connection.cursor() as cursor:
-                query = "UPDATE success_stats SET lose_count = %s WHERE trader_id = %s AND position_table = %s"
-                cursor.execute(query, (new_lose_count, trader_id, position_table_name))
-                self.connection.commit()
+        # Traders that aren't followed/observed anymore might have been reactivated - they need to be synced again
+        for (trader_id, position_table_name) in counts:
+            self.synced_data_versions.pop(position_table_name, None)
+        logger.debug(f"Applied {len(outcomes)} outcomes to the 'sucess_stats' table ({len(counts)} traders)")
 
     def deactivate_trader_in_success_stats(self, trader_id: str, position_table_name: str):
         with self.connection.cursor() as cursor:
@@ -810,83 +925,242 @@ class DatabaseManager:
             
             return results_as_dict
         
-    def deactivate_trader_ids_of_success_stats_table(self, position_table_name: str):
-        with self.connection.cursor(dictionary=True) as cursor:
-            query = f"SELECT * FROM trader WHERE is_followed = 1 OR is_observed = 1"
-            cursor.execute(query)
-            results = cursor.fetchall()
-            followed_and_observed_trader_ids = [dict_i["trader_id"] for dict_i in results]
+    def sync_success_stats_traders(self, position_table_name: str):
+        """
+        Reconciles 'success_stats' traders of 'position_table_name' with followed/observed traders:
+        deactivates traders that are not followed/observed anymore
+        and inserts (or reactivates with reset stats) the ones that are
+        Skipped if followed/observed traders haven't changed since the last sync (see 'data_versions' table)
+        """
+        followed_traders_version = self.get_data_version(name=FOLLOWED_TRADERS_DATA_VERSION)
+        if self.synced_data_versions.get(position_table_name) == followed_traders_version:
+            return False
 
-        # get all active trader IDs of 'success_stats' table by 'position_table_name' arg
-        with self.connection.cursor(dictionary=True) as cursor:
-            query = "SELECT * FROM success_stats WHERE is_active = 1 AND position_table = %s"
-            cursor.execute(query, (position_table_name,))
-            results = cursor.fetchall()
-            is_active_trader_ids = [dict_i["trader_id"] for dict_i in results]
+        with self.connection.cursor() as cursor:
+            try:
+                # Anti-join as a subquery (multi-table UPDATE is MySQL only)
+                query = """
+                    UPDATE success_stats
+                    SET is_active = 0
+                    WHERE position_table = %s AND is_active = 1 AND trader_id NOT IN (
+                        SELECT t.trader_id FROM trader t WHERE t.is_followed = 1 OR t.is_observed = 1
+                    )
+                """
+                cursor.execute(query, (position_table_name,))
+
+                # 'is_active' has to be updated last - win/lose counts are reset based on its previous value
+                query = """
+                    INSERT INTO success_stats (trader_id, position_table, is_active, win_count, lose_count)
+                    SELECT t.trader_id, %s, 1, 0, 0
+                    FROM trader t
+                    WHERE t.is_followed = 1 OR t.is_observed = 1
+                    ON DUPLICATE KEY UPDATE
+                        win_count = IF(success_stats.is_active = 1, success_stats.win_count, 0),
+                        lose_count = IF(success_stats.is_active = 1, success_stats.lose_count, 0),
+                        is_active = 1
+                """
+                cursor.execute(query, (position_table_name,))
+                self.connection.commit()
+            except Exception as e:
+                self.connection.rollback()
+                logger.error(f"Error in sync_success_stats_traders: {e}")
+                raise
 
-        # disable trader IDs (of 'sucess_stats' table) that are not followed anymore
-        trader_ids_to_disable = [trader_id for trader_id in is_active_trader_ids if trader_id not in followed_and_observed_trader_ids]
-        for trader_id in trader_ids_to_disable:
-            self.deactivate_trader_in_success_stats(trader_id=trader_id, position_table_name=position_table_name)
+        self.synced_data_versions[position_table_name] = followed_traders_version
+        return True
 
-    def insert_trader_ids_to_success_stats_table(self, position_table_name: str):
-        with self.connection.cursor(dictionary=True) as cursor:
-            query = f"SELECT * FROM trader WHERE is_followed = 1 OR is_observed = 1"
+    def get_data_version(self, name: str):
+        """
+        Returns the version of the data (bumped by every change of it), 0 if it was never changed
+        """
+        with self.connection.cursor() as cursor:
+            # Start a new transaction so you would see versions bumped by another connection
+            self.connection.commit()
+            cursor.execute("SELECT version FROM data_versions WHERE name = %s", (name,))
+            result = cursor.fetchone()
+            return result[0] if result else 0
+
+    def bump_data_version(self, name: str):
+        with self.connection.cursor() as cursor:
+            query = """
+                INSERT INTO data_versions (name, version) VALUES (%s, 1)
+                ON DUPLICATE KEY UPDATE version = version + 1
+            """
+            cursor.execute(query, (name,))
+            self.connection.commit()
+
+    def _update_kc_derived_stats(self, cursor, kc_stats_table_name: str, trader_ids: Optional[list] = None):
+        """
+        Derives AVG/STDDEV (population, same as MySQL's STDDEV)/Kelly Criteria from the running sums
+        """
+        avg_roe = "(roe_sum / NULLIF(trades_count, 0))"
+        roe_variance = f"(roe_sq_sum / NULLIF(trades_count, 0) - POW({avg_roe}, 2))"
+        roe_variance = f"IF({roe_variance} < {KC_MIN_VARIANCE}, 0, {roe_variance})"  # float rounding of a zero variance
+        query = f"""
+            UPDATE {kc_stats_table_name} SET
+                avg_roe = {avg_roe},
+                roe_std_dev = SQRT({roe_variance}),
+                kelly_criteria = {avg_roe} / NULLIF({roe_variance}, 0)
+        """
+        if trader_ids is None:
             cursor.execute(query)
-            results = cursor.fetchall()
-            followed_and_observed_trader_ids = [dict_i["trader_id"] for dict_i in results]
+        elif trader_ids:
+            placeholders = ', '.join('%s' for _ in trader_ids)
+            cursor.execute(query + f" WHERE trader_id IN ({placeholders})", list(trader_ids))
 
-        # get all active trader IDs of 'success_stats' table by 'position_table_name' arg
+    def get_kc_stats_meta(self, kc_stats_table_name: str, for_update: bool = False):
+        """
+        'for_update' - the row is locked till the end of the current transaction
+        """
         with self.connection.cursor(dictionary=True) as cursor:
-            query = "SELECT * FROM success_stats WHERE is_active = 1 AND position_table = %s"
-            cursor.execute(query, (position_table_name,))
-            results = cursor.fetchall()
-            is_active_trader_ids = [dict_i["trader_id"] for dict_i in results]
-
-        # insert trader IDs to the 'sucess_stats' table that are not in this table, yet
-        # there might be scenarios when the trader ID will exist in the 'success_stats' table but it's not active
-        # in this case it will just reactivate the trader
-        trader_ids_to_insert = [trader_id for trader_id in followed_and_observed_trader_ids if trader_id not in is_active_trader_ids]
-        for trader_id in trader_ids_to_insert:
-            self.insert_or_update_success_stats(trader_id=trader_id, position_table_name=position_table_name)
+            query = "SELECT * FROM kc_stats_meta WHERE kc_stats_table = %s"
+            if for_update:
+                query += " FOR UPDATE"
+            cursor.execute(query, (kc_stats_table_name,))
+            return cursor.fetchone()
 
     def insert_or_update_kc(self, kc_stats_table_name: str, top_x_table_name: str):
+        """
+        Full recompute of Kelly Criteria running sums over the last year of closed positions
+        Used for the first run and periodically (drift correction) by 'update_kc_stats'
+        """
+        now_ts = helpers.get_current_timestamp_in_ms()
+        window_start_ts = now_ts - KC_WINDOW_IN_MS
         with self.connection.cursor() as cursor:
-            query = f"""
-                INSERT INTO {kc_stats_table_name} (trader_id, trades_count, roe_sum, avg_roe, roe_std_dev, kelly_criteria)
-                SELECT
-                    trader_id,
-                    COUNT(*) AS trades_count,
-                    SUM(pnl_ratio) AS roe_sum,
-                    AVG(pnl_ratio) AS avg_roe,
-                    STDDEV(pnl_ratio) AS roe_std_dev,
-                    (AVG(pnl_ratio) / NULLIF(STDDEV(pnl_ratio) * STDDEV(pnl_ratio), 0)) AS kelly_criteria
-                FROM {top_x_table_name}
-                WHERE is_active = 0 AND u_time >= (UNIX_TIMESTAMP(NOW()) - 365 * 24 * 60 * 60) * 1000
-                GROUP BY trader_id
-                ON DUPLICATE KEY UPDATE
-                    trades_count = VALUES(trades_count),
-                    roe_sum = VALUES(roe_sum),
-                    avg_roe = VALUES(avg_roe),
-                    roe_std_dev = VALUES(roe_std_dev),
-                    kelly_criteria = VALUES(kelly_criteria);        
-            """
-            cursor.execute(query)
-            self.connection.commit()
+            try:
+                # Everything closed till now is included by this recompute
+                query = f"UPDATE {top_x_table_name} SET is_kc_counted = 1 WHERE is_active = 0 AND is_kc_counted = 0"
+                cursor.execute(query)
+
+                query = f"UPDATE {kc_stats_table_name} SET trades_count = 0, roe_sum = 0, roe_sq_sum = 0"
+                cursor.execute(query)
+
+                query = f"""
+                    INSERT INTO {kc_stats_table_name} (trader_id, trades_count, roe_sum, roe_sq_sum)
+                    SELECT
+                        trader_id,
+                        COUNT(*) AS trades_count,
+                        SUM(pnl_ratio) AS roe_sum,
+                        SUM(pnl_ratio * pnl_ratio) AS roe_sq_sum
+                    FROM (
+                        SELECT trader_id, pnl_ratio FROM {top_x_table_name}
+                        WHERE is_active = 0 AND u_time >= %s
+                        UNION ALL
+                        SELECT trader_id, pnl_ratio FROM {self.get_history_table_name(top_x_table_name)}
+                        WHERE u_time >= %s
+                    ) AS closed_positions
+                    GROUP BY trader_id
+                    ON DUPLICATE KEY UPDATE
+                        trades_count = VALUES(trades_count),
+                        roe_sum = VALUES(roe_sum),
+                        roe_sq_sum = VALUES(roe_sq_sum)
+                """
+                cursor.execute(query, (window_start_ts, window_start_ts))
+                self._update_kc_derived_stats(cursor=cursor, kc_stats_table_name=kc_stats_table_name)
+
+                query = """
+                    INSERT INTO kc_stats_meta (kc_stats_table, window_start_ts, recomputed_on_ts) VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        window_start_ts = VALUES(window_start_ts),
+                        recomputed_on_ts = VALUES(recomputed_on_ts)
+                """
+                cursor.execute(query, (kc_stats_table_name, window_start_ts, now_ts))
+                self.connection.commit()
+            except Exception as e:
+                self.connection.rollback()
+                logger.error(f"Error in insert_or_update_kc: {e}")
+                raise
+
+    def update_kc_stats(self, kc_stats_table_name: str, top_x_table_name: str):
+        """
+        Keeps Kelly Criteria running sums (count, sum, sum of squares) up to date:
+        adds positions closed since the last call and subtracts positions that left the 1 year window
+        Costs O(newly closed + expired positions), the full recompute runs every 'kc_full_recompute_interval' seconds
+        """
+        # Locked till the stats are committed - concurrent callers of the same table (ex.: leaderboard.py and
+        # rapidapi.get_hist_positions) would otherwise subtract the same expired window twice
+        kc_stats_meta = self.get_kc_stats_meta(kc_stats_table_name=kc_stats_table_name, for_update=True)
+        now_ts = helpers.get_current_timestamp_in_ms()
+        if kc_stats_meta is None or now_ts - kc_stats_meta["recomputed_on_ts"] >= kc_full_recompute_interval * 1000:
+            logger.debug(f"Recomputing {kc_stats_table_name} stats from scratch")
+            self.insert_or_update_kc(kc_stats_table_name=kc_stats_table_name, top_x_table_name=top_x_table_name)
+            return
+
+        prev_window_start_ts = kc_stats_meta["window_start_ts"]
+        window_start_ts = now_ts - KC_WINDOW_IN_MS
+        with self.connection.cursor(dictionary=True) as cursor:
+            try:
+                # Positions that left the window (archived positions were all counted before being archived)
+                query = f"""
+                    SELECT
+                        trader_id,
+                        -COUNT(*) AS trades_count,
+                        -SUM(pnl_ratio) AS roe_sum,
+                        -SUM(pnl_ratio * pnl_ratio) AS roe_sq_sum
+                    FROM (
+                        SELECT trader_id, pnl_ratio FROM {top_x_table_name}
+                        WHERE is_active = 0 AND is_kc_counted = 1 AND u_time >= %s AND u_time < %s
+                        UNION ALL
+                        SELECT trader_id, pnl_ratio FROM {self.get_history_table_name(top_x_table_name)}
+                        WHERE u_time >= %s AND u_time < %s
+                    ) AS expired_positions
+                    GROUP BY trader_id
+                """
+                cursor.execute(query, (prev_window_start_ts, window_start_ts, prev_window_start_ts, window_start_ts))
+                expired_stats = cursor.fetchall()
+
+                # Positions closed since the last call (marked first, so positions closed meanwhile wait for the next call)
+                query = f"UPDATE {top_x_table_name} SET is_kc_counted = 2 WHERE is_active = 0 AND is_kc_counted = 0"
+                cursor.execute(query)
+                query = f"""
+                    SELECT
+                        trader_id,
+                        COUNT(*) AS trades_count,
+                        SUM(pnl_ratio) AS roe_sum,
+                        SUM(pnl_ratio * pnl_ratio) AS roe_sq_sum
+                    FROM {top_x_table_name}
+                    WHERE is_active = 0 AND is_kc_counted = 2 AND u_time >= %s
+                    GROUP BY trader_id
+                """
+                cursor.execute(query, (window_start_ts,))
+                closed_stats = cursor.fetchall()
+                query = f"UPDATE {top_x_table_name} SET is_kc_counted = 1 WHERE is_active = 0 AND is_kc_counted = 2"
+                cursor.execute(query)
+
+                stats_deltas = [
+                    (row["trader_id"], row["trades_count"], row["roe_sum"] or 0, row["roe_sq_sum"] or 0)
+                    for row in expired_stats + closed_stats
+                ]
+                if stats_deltas:
+                    query = f"""
+                        INSERT INTO {kc_stats_table_name} (trader_id, trades_count, roe_sum, roe_sq_sum)
+                        VALUES (%s, %s, %s, %s)
+                        ON DUPLICATE KEY UPDATE
+                            trades_count = trades_count + VALUES(trades_count),
+                            roe_sum = roe_sum + VALUES(roe_sum),
+                            roe_sq_sum = roe_sq_sum + VALUES(roe_sq_sum)
+                    """
+                    cursor.executemany(query, stats_deltas)
+                    self._update_kc_derived_stats(
+                        cursor=cursor,
+                        kc_stats_table_name=kc_stats_table_name,
+                        trader_ids=list(set([row[0] for row in stats_deltas]))
+                    )
+
+                query = "UPDATE kc_stats_meta SET window_start_ts = %s WHERE kc_stats_table = %s"
+                cursor.execute(query, (window_start_ts, kc_stats_table_name))
+                self.connection.commit()
+            except Exception as e:
+                self.connection.rollback()
+                logger.error(f"Error in update_kc_stats: {e}")
+                raise
 
     def calculate_total_kc(self, top_x_table_name: str, trader_ids: list):
         with self.connection.cursor(dictionary=True) as cursor:
-            query = f"""
-                SELECT
-                    COUNT(*) AS trades_count,
-                    SUM(roe) AS roe_sum,
-                    AVG(roe) AS avg_roe,
-                    STDDEV(roe) AS roe_std_dev,
-                    (AVG(roe) / NULLIF(STDDEV(roe) * STDDEV(roe), 0)) AS kelly_criteria
-                FROM {top_x_table_name}
-                WHERE is_active = 0 AND trader_id IN %s    
-            """
-            cursor.execute(query, (tuple(trader_ids),))
+            if not trader_ids:
+                return None
+            query = db_queries.get_total_kc_query(top_x_table_name=top_x_table_name, trader_ids=trader_ids)
+            cursor.execute(query, list(trader_ids) + list(trader_ids))
             result = cursor.fetchone()
             return result["kelly_criteria"]
 
@@ -899,11 +1173,7 @@ class DatabaseManager:
         }
         """
         with self.connection.cursor(dictionary=True) as cursor:
-            query = f"""
-                SELECT trader_id, kelly_criteria
-                FROM {kc_stats_table_name}
-                ORDER BY kelly_criteria DESC
-            """
+            query = db_queries.get_kc_stats_query(kc_stats_table_name=kc_stats_table_name, column="kelly_criteria")
             cursor.execute(query)
             results = cursor.fetchall()
 
@@ -923,11 +1193,7 @@ class DatabaseManager:
         }
         """
         with self.connection.cursor(dictionary=True) as cursor:
-            query = f"""
-                SELECT trader_id, trades_count
-                FROM {kc_stats_table_name}
-                ORDER BY trades_count DESC
-            """
+            query = db_queries.get_kc_stats_query(kc_stats_table_name=kc_stats_table_name, column="trades_count")
             cursor.execute(query)
             results = cursor.fetchall()
 
@@ -941,6 +1207,7 @@ class DatabaseManager:
     def get_all_traders_trades_counts(self, top_x_table_name: str):
         """
         Returns trade counts of all traders
+        Archived positions are counted by 'archive_inactive_positions' (only the hot table is counted here)
         Ex.: {
             "123qwerty123": 5,
             "321qwerty321": 49,
@@ -948,9 +1215,16 @@ class DatabaseManager:
         """
         with self.connection.cursor(dictionary=True) as cursor:
             query = f"""
-                SELECT trader_id, COUNT(*) AS trade_count
-                FROM {top_x_table_name}
-                WHERE is_active = 0
+                SELECT trader_id, SUM(trade_count) AS trade_count
+                FROM (
+                    SELECT trader_id, COUNT(*) AS trade_count FROM {top_x_table_name}
+                    WHERE is_active = 0
+                    GROUP BY trader_id
+                    UNION ALL
+                    SELECT trader_id, archived_trades_count AS trade_count
+                    FROM {self.get_kc_stats_table_name(top_x_table_name)}
+                    WHERE archived_trades_count > 0
+                ) AS closed_positions
                 GROUP BY trader_id
             """
             cursor.execute(query)
@@ -959,7 +1233,7 @@ class DatabaseManager:
             results_as_dict = {}
             for row in results:
                 trader_id = row["trader_id"]
-                results_as_dict[trader_id] = row["trade_count"]
+                results_as_dict[trader_id] = int(row["trade_count"])
             
             return results_as_dict
         
@@ -1014,11 +1288,7 @@ class DatabaseManager:
 
     def get_all_active_stop_losses(self, position_table: str):
         with self.connection.cursor(dictionary=True) as cursor:
-            query = f"""
-                SELECT *
-                FROM stop_losses
-                WHERE position_table = %s AND is_active = 1
-            """
+            query = db_queries.get_active_orders_query(orders_table="stop_losses")
             cursor.execute(query, (position_table,))
             results = cursor.fetchall()
 
@@ -1035,14 +1305,8 @@ class DatabaseManager:
         but positions still open (not closed by the trader)
         """
         with self.connection.cursor(dictionary=True) as cursor:
-            query = f"""
-                SELECT sl.*
-                FROM stop_losses sl 
-                LEFT JOIN {position_table} pos_table
-                ON sl.orig_position_id = pos_table.bin_pos_id 
-                WHERE sl.position_table = '{position_table}' AND sl.is_filled = 0 AND pos_table.is_active = 1
-            """
-            cursor.execute(query)
+            query = db_queries.get_active_pos_orders_query(orders_table="stop_losses", position_table=position_table)
+            cursor.execute(query, (position_table,))
             results = cursor.fetchall()
 
             results_as_dict = {}
@@ -1054,11 +1318,7 @@ class DatabaseManager:
         
     def get_all_active_take_profits(self, position_table: str):
         with self.connection.cursor(dictionary=True) as cursor:
-            query = f"""
-                SELECT *
-                FROM take_profits
-                WHERE position_table = %s AND is_active = 1
-            """
+            query = db_queries.get_active_orders_query(orders_table="take_profits")
             cursor.execute(query, (position_table,))
             results = cursor.fetchall()
 
@@ -1075,14 +1335,8 @@ class DatabaseManager:
         but positions still open (not closed by the trader)
         """
         with self.connection.cursor(dictionary=True) as cursor:
-            query = f"""
-                SELECT tp.*
-                FROM take_profits tp 
-                LEFT JOIN {position_table} pos_table
-                ON tp.orig_position_id = pos_table.bin_pos_id 
-                WHERE tp.position_table = '{position_table}' AND tp.is_filled = 0 AND pos_table.is_active = 1
-            """
-            cursor.execute(query)
+            query = db_queries.get_active_pos_orders_query(orders_table="take_profits", position_table=position_table)
+            cursor.execute(query, (position_table,))
             results = cursor.fetchall()
 
             results_as_dict = {}
@@ -1135,11 +1389,7 @@ class DatabaseManager:
         }
         """
         with self.connection.cursor(dictionary=True) as cursor:
-            query = f"""
-                SELECT trader_id, penalty_value
-                FROM penalties
-                WHERE position_table = %s
-            """
+            query = db_queries.get_penalties_query()
             cursor.execute(query, (top_x_table_name,))
             results = cursor.fetchall()
 
@@ -1168,7 +1418,231 @@ class DatabaseManager:
             result = cursor.fetchone()
 
             return result
-        
+
+    def insert_position_latencies(self, rows: list):
+        """
+        Inserts (trade_item_id, position_table, stage, stage_ts) rows
+        Only the first timestamp of every stage is kept, so repeated polls of the same position are ignored
+        """
+        if not rows:
+            return
+
+        with self.connection.cursor() as cursor:
+            query = """
+                INSERT IGNORE INTO position_latency (trade_item_id, position_table, stage, stage_ts)
+                VALUES (%s, %s, %s, %s)
+            """
+            cursor.executemany(query, rows)
+            self.connection.commit()
+
+    def delete_position_latencies(self, before_ts: int, batch_size: int):
+        """
+        Deletes stage timestamps of a single batch of positions that were seen by the scraper before 'before_ts'
+        Returns the number of positions whose timestamps were deleted
+        """
+        with self.connection.cursor(dictionary=True) as cursor:
+            query = """
+                SELECT trade_item_id
+                FROM position_latency
+                WHERE position_table = '' AND stage = 'scraper_poll' AND stage_ts < %s
+                LIMIT %s
+            """
+            cursor.execute(query, (before_ts, batch_size))
+            trade_item_ids = [row["trade_item_id"] for row in cursor.fetchall()]
+            if not trade_item_ids:
+                return 0
+
+            placeholders = ', '.join('%s' for _ in trade_item_ids)
+            query = f"DELETE FROM position_latency WHERE trade_item_id IN ({placeholders})"
+            cursor.execute(query, trade_item_ids)
+            self.connection.commit()
+
+            return len(trade_item_ids)
+
+    def fetch_position_latencies(self, position_table: str, since_ts: int):
+        """
+        Returns stage timestamps of positions that were seen by the scraper since 'since_ts'
+        Shared stages (scraper, position_temp) are stored with an empty 'position_table'
+        Ex.: {
+            713447112856645632: {"trader_open": 1716371046911, "scraper_poll": 1716371067047, ...},
+        }
+        """
+        with self.connection.cursor(dictionary=True) as cursor:
+            query = """
+                SELECT pl.trade_item_id, pl.stage, pl.stage_ts
+                FROM position_latency pl
+                INNER JOIN (
+                    SELECT trade_item_id
+                    FROM position_latency
+                    WHERE position_table = '' AND stage = 'scraper_poll' AND stage_ts >= %s
+                ) AS polled ON pl.trade_item_id = polled.trade_item_id
+                WHERE pl.position_table IN ('', %s)
+            """
+            cursor.execute(query, (since_ts, position_table))
+            results = cursor.fetchall()
+
+            results_as_dict = {}
+            for row in results:
+                trade_item_id = row["trade_item_id"]
+                if trade_item_id not in results_as_dict:
+                    results_as_dict[trade_item_id] = {}
+                results_as_dict[trade_item_id][row["stage"]] = row["stage_ts"]
+
+            return results_as_dict
+
+    @staticmethod
+    def get_history_table_name(position_table: str):
+        """
+        Ex.: 'position_x1' -> 'position_history_x1'
+        """
+        return db_queries.get_history_table_name(position_table)
+
+    @staticmethod
+    def get_kc_stats_table_name(position_table: str):
+        """
+        Ex.: 'position_x1' -> 'kc_stats_x1'
+        """
+        return position_table.replace("position_", "kc_stats_", 1)
+
+    def get_history_partition_boundaries(self, history_table: str):
+        """
+        Returns upper boundaries ('u_time' in ms) of all monthly partitions (except the MAXVALUE one)
+        SQLite has no partitions (a history table is a single table)
+        """
+        if self.dialect == "sqlite":
+            return []
+        with self.connection.cursor() as cursor:
+            query = """
+                SELECT partition_description FROM information_schema.partitions
+                WHERE table_schema = %s AND table_name = %s AND partition_name IS NOT NULL
+            """
+            cursor.execute(query, (self.database, history_table))
+            return sorted([int(row[0]) for row in cursor.fetchall() if row[0] != "MAXVALUE"])
+
+    def create_history_table(self, position_table: str):
+        """
+        Creates 'position_history_xN' table with the same columns as 'position_xN' partitioned by month of 'u_time'
+        Closed positions are moved there by the archiver (archiver.py) to keep 'position_xN' small
+        """
+        history_table = self.get_history_table_name(position_table)
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {history_table} LIKE {position_table}")
+            if self.dialect == "sqlite":
+                self.connection.commit()
+                return
+            if self.get_history_partition_boundaries(history_table=history_table):
+                return
+
+            # Every unique key of a partitioned table must include the partitioning column
+            cursor.execute(f"""
+                ALTER TABLE {history_table}
+                DROP PRIMARY KEY, MODIFY u_time BIGINT NOT NULL, ADD PRIMARY KEY (okx_pos_id, u_time)
+            """)
+            current_month_start_ts = helpers.get_month_start_timestamp_in_ms(month_offset=0)
+            cursor.execute(f"""
+                ALTER TABLE {history_table} PARTITION BY RANGE (u_time) (
+                    PARTITION p_old VALUES LESS THAN ({current_month_start_ts}),
+                    PARTITION p_future VALUES LESS THAN MAXVALUE
+                )
+            """)
+            self.connection.commit()
+        self.add_history_partitions(position_table=position_table)
+
+    def add_history_partitions(self, position_table: str, months_ahead: int = 2):
+        """
+        Splits the MAXVALUE partition so there is a separate partition for every month up to 'months_ahead'
+        """
+        if self.dialect == "sqlite":
+            return
+        history_table = self.get_history_table_name(position_table)
+        boundaries = self.get_history_partition_boundaries(history_table=history_table)
+        max_boundary = boundaries[-1] if boundaries else 0
+        with self.connection.cursor() as cursor:
+            for month_offset in range(months_ahead + 1):
+                month_start_ts = helpers.get_month_start_timestamp_in_ms(month_offset=month_offset)
+                month_end_ts = helpers.get_month_start_timestamp_in_ms(month_offset=month_offset + 1)
+                if month_end_ts <= max_boundary:
+                    continue
+                partition_name = "p_" + datetime.utcfromtimestamp(month_start_ts / 1000).strftime("%Y%m")
+                cursor.execute(f"""
+                    ALTER TABLE {history_table} REORGANIZE PARTITION p_future INTO (
+                        PARTITION {partition_name} VALUES LESS THAN ({month_end_ts}),
+                        PARTITION p_future VALUES LESS THAN MAXVALUE
+                    )
+                """)
+                logger.info(f"Added partition {partition_name} to {history_table}")
+                max_boundary = month_end_ts
+            self.connection.commit()
+
+    def get_archived_position_ids(self, position_table: str, okx_pos_ids: list):
+        """
+        Returns the ones of 'okx_pos_ids' that are already moved to 'position_history_xN'
+        Ex.: {111, 222}
+        """
+        if not okx_pos_ids:
+            return set()
+        with self.connection.cursor() as cursor:
+            placeholders = ', '.join('%s' for _ in okx_pos_ids)
+            query = f"SELECT okx_pos_id FROM {self.get_history_table_name(position_table)} WHERE okx_pos_id IN ({placeholders})"
+            cursor.execute(query, list(okx_pos_ids))
+            return set([row[0] for row in cursor.fetchall()])
+
+    def archive_inactive_positions(self, position_table: str, batch_size: int, min_age_hours: int):
+        """
+        Moves a single batch of inactive positions (not updated for 'min_age_hours') to 'position_history_xN'
+        Returns the number of archived positions
+        """
+        history_table = self.get_history_table_name(position_table)
+        with self.connection.cursor() as cursor:
+            # Positions without 'u_time' can't be placed into a partition, they stay in the hot table
+            # Positions not added to Kelly Criteria running sums yet ('update_kc_stats') stay as well
+            query = f"""
+                SELECT okx_pos_id FROM {position_table}
+                WHERE is_active = 0 AND is_kc_counted = 1 AND u_time IS NOT NULL AND updated_on < NOW() - INTERVAL %s HOUR
+                ORDER BY okx_pos_id
+                LIMIT %s
+            """
+            cursor.execute(query, (min_age_hours, batch_size))
+            okx_pos_ids = [row[0] for row in cursor.fetchall()]
+            if not okx_pos_ids:
+                return 0
+            placeholders = ', '.join('%s' for _ in okx_pos_ids)
+
+            try:
+                # All-time trade counts ('get_all_traders_trades_counts') of rows that aren't archived yet
+                query = f"""
+                    SELECT trader_id, COUNT(*) FROM {position_table}
+                    WHERE okx_pos_id IN ({placeholders}) AND okx_pos_id NOT IN (
+                        SELECT okx_pos_id FROM {history_table} WHERE okx_pos_id IN ({placeholders})
+                    )
+                    GROUP BY trader_id
+                """
+                cursor.execute(query, okx_pos_ids + okx_pos_ids)
+                archived_trades_counts = cursor.fetchall()
+                if archived_trades_counts:
+                    query = f"""
+                        INSERT INTO {self.get_kc_stats_table_name(position_table)}
+                            (trader_id, trades_count, roe_sum, roe_sq_sum, archived_trades_count)
+                        VALUES (%s, 0, 0, 0, %s)
+                        ON DUPLICATE KEY UPDATE
+                            archived_trades_count = archived_trades_count + VALUES(archived_trades_count)
+                    """
+                    cursor.executemany(query, archived_trades_counts)
+
+                query = f"""
+                    INSERT IGNORE INTO {history_table} SELECT * FROM {position_table} WHERE okx_pos_id IN ({placeholders})
+                """
+                cursor.execute(query, okx_pos_ids)
+                query = f"DELETE FROM {position_table} WHERE okx_pos_id IN ({placeholders})"
+                cursor.execute(query, okx_pos_ids)
+                self.connection.commit()
+            except Exception as e:
+                self.connection.rollback()
+                logger.error(f"Error in archive_inactive_positions: {e}")
+                raise
+
+            return len(okx_pos_ids)
+
     def replicate_existing_table(self, from_table: str, to_table: str):
         logger.debug(f"Trying to replicate tables ({from_table} -> {to_table})")
         with self.connection.cursor(dictionary=True) as cursor:
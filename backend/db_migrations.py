@@ -0,0 +1,234 @@
+import sys
+from loguru import logger
+import helpers
+
+config = helpers.load_config_from_yaml()
+db_host = config["db_host"]
+db_user = config["db_user"]
+db_password = config["db_password"]
+database = config["database"]
+
+SCHEMA_VERSION_TABLE = "schema_version"
+
+
+def migration_1(db):
+    # 'position_temp' is refreshed with upserts keyed on 'trade_item_id'
+    if not db.is_index_exist(table="position_temp", index_name="trade_item_id"):
+        with db.connection.cursor() as cursor:
+            # It's only a snapshot of API positions - it will be fully written again on the next RapidAPI poll
+            cursor.execute("DELETE FROM position_temp")
+            db.connection.commit()
+        db.add_index(table="position_temp", index_name="trade_item_id", columns=["trade_item_id"], is_unique=True)
+
+    # 'get_temp_positions_from_db' join ('position_temp.trader_id' is already indexed by its foreign key)
+    db.add_index(table="trader", index_name="trader_is_followed_is_observed", columns=["is_followed", "is_observed"])
+
+
+def migration_2(db):
+    for position_table in db.x_inst_pos_table_names:
+        # Active positions fetches (grouped by trader)
+        db.add_index(table=position_table, index_name="is_active_trader_id", columns=["is_active", "trader_id"])
+        # Same trader's positions of the same symbol ('position_xN' has no 'symbol' column, 'inst_id' is used instead)
+        db.add_index(table=position_table, index_name="trader_id_inst_id", columns=["trader_id", "inst_id"])
+        # Stop-loss/take-profit joins ('orig_position_id' = 'bin_pos_id')
+        db.add_index(table=position_table, index_name="bin_pos_id", columns=["bin_pos_id"])
+        # Kelly Criteria aggregation of closed positions over the last year
+        db.add_index(
+            table=position_table, index_name="is_active_u_time_trader_id", columns=["is_active", "u_time", "trader_id"]
+        )
+
+    for table in ["stop_losses", "take_profits"]:
+        db.add_index(table=table, index_name="position_table_is_active", columns=["position_table", "is_active"])
+        db.add_index(table=table, index_name="position_table_is_filled", columns=["position_table", "is_filled"])
+
+    db.add_index(table="success_stats", index_name="position_table_is_active", columns=["position_table", "is_active"])
+
+
+def migration_3(db):
+    # Monthly partitioned history tables of closed positions (filled by archiver.py)
+    for position_table in db.x_inst_pos_table_names:
+        db.create_history_table(position_table=position_table)
+
+
+def migration_4(db):
+    # Kelly Criteria running sums ('update_kc_stats')
+    for position_table in db.x_inst_pos_table_names:
+        history_table = db.get_history_table_name(position_table)
+        # Both tables need the same columns in the same order (archiver copies rows with 'SELECT *')
+        db.add_column(table=position_table, column="is_kc_counted", definition="TINYINT NOT NULL DEFAULT 0")
+        db.add_column(table=history_table, column="is_kc_counted", definition="TINYINT NOT NULL DEFAULT 0")
+        db.add_index(table=position_table, index_name="is_active_is_kc_counted", columns=["is_active", "is_kc_counted"])
+
+        kc_stats_table = position_table.replace("position_", "kc_stats_", 1)
+        if db.dialect == "mysql":  # SQLite columns store whatever is written (DECIMAL doesn't round)
+            with db.connection.cursor() as cursor:
+                # DECIMAL(10, 4) sums would accumulate rounding errors
+                cursor.execute(f"ALTER TABLE {kc_stats_table} MODIFY roe_sum DOUBLE")
+        db.add_column(table=kc_stats_table, column="roe_sq_sum", definition="DOUBLE DEFAULT 0")
+
+    with db.connection.cursor() as cursor:
+        query = """
+            CREATE TABLE IF NOT EXISTS kc_stats_meta (
+                kc_stats_table VARCHAR(255) NOT NULL PRIMARY KEY,
+                window_start_ts BIGINT NOT NULL,
+                recomputed_on_ts BIGINT NOT NULL
+            )
+        """
+        cursor.execute(query)
+        db.connection.commit()
+
+
+def migration_5(db):
+    # Versions of data that readers cache or sync from (ex.: followed/observed traders)
+    with db.connection.cursor() as cursor:
+        query = """
+            CREATE TABLE IF NOT EXISTS data_versions (
+                name VARCHAR(255) NOT NULL PRIMARY KEY,
+                version BIGINT NOT NULL DEFAULT 0,
+                updated_on DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            )
+        """
+        cursor.execute(query)
+        db.connection.commit()
+
+
+def migration_6(db):
+    # All-time trade counts of archived positions (kept by 'archive_inactive_positions')
+    for position_table in db.x_inst_pos_table_names:
+        kc_stats_table = position_table.replace("position_", "kc_stats_", 1)
+        db.add_column(table=kc_stats_table, column="archived_trades_count", definition="INT NOT NULL DEFAULT 0")
+        with db.connection.cursor() as cursor:
+            query = f"""
+                INSERT INTO {kc_stats_table} (trader_id, trades_count, roe_sum, roe_sq_sum, archived_trades_count)
+                SELECT trader_id, 0, 0, 0, COUNT(*)
+                FROM {db.get_history_table_name(position_table)}
+                GROUP BY trader_id
+                ON DUPLICATE KEY UPDATE archived_trades_count = VALUES(archived_trades_count)
+            """
+            cursor.execute(query)
+            db.connection.commit()
+
+
+# Versions are applied in order and never change once released - add a new migration instead
+MIGRATIONS = [
+    (1, "position_temp unique trade_item_id, trader is_followed/is_observed index", migration_1),
+    (2, "position_xN, stop_losses, take_profits and success_stats secondary indexes", migration_2),
+    (3, "position_history_xN tables partitioned by month", migration_3),
+    (4, "Kelly Criteria running sums (kc_stats_xN.roe_sq_sum, kc_stats_meta, position_xN.is_kc_counted)", migration_4),
+    (5, "data_versions table", migration_5),
+    (6, "kc_stats_xN.archived_trades_count", migration_6),
+]
+
+
+def get_schema_version(db):
+    with db.connection.cursor() as cursor:
+        query = f"""
+            CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} (
+                version INT NOT NULL PRIMARY KEY,
+                description VARCHAR(255),
+                applied_on DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """
+        cursor.execute(query)
+        cursor.execute(f"SELECT MAX(version) FROM {SCHEMA_VERSION_TABLE}")
+        version = cursor.fetchone()[0]
+        db.connection.commit()
+        return version or 0
+
+
+def run_migrations(db):
+    """
+    Applies pending migrations and records every applied version in the 'schema_version' table
+    Migrations are idempotent (MySQL DDL can't be rolled back), so a crashed one is safe to run again
+    """
+    current_version = get_schema_version(db=db)
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        logger.info(f"Applying DB migration {version}: {description}")
+        migration(db=db)
+        with db.connection.cursor() as cursor:
+            query = f"INSERT INTO {SCHEMA_VERSION_TABLE} (version, description) VALUES (%s, %s)"
+            cursor.execute(query, (version, description))
+            db.connection.commit()
+        current_version = version
+    logger.info(f"DB schema version: {current_version}")
+    return current_version
+
+
+def get_hot_queries(position_table: str):
+    return {
+        "fetch_active_db_positions": f"SELECT * FROM {position_table} WHERE is_active = 1 ORDER BY inserted_on ASC",
+        "get_all_active_stop_losses": f"""
+            SELECT * FROM stop_losses WHERE position_table = '{position_table}' AND is_active = 1
+        """,
+        "get_all_active_pos_stop_losses": f"""
+            SELECT sl.* FROM stop_losses sl
+            LEFT JOIN {position_table} pos_table ON sl.orig_position_id = pos_table.bin_pos_id
+            WHERE sl.position_table = '{position_table}' AND sl.is_filled = 0 AND pos_table.is_active = 1
+        """,
+        "get_all_active_pos_take_profits": f"""
+            SELECT tp.* FROM take_profits tp
+            LEFT JOIN {position_table} pos_table ON tp.orig_position_id = pos_table.bin_pos_id
+            WHERE tp.position_table = '{position_table}' AND tp.is_filled = 0 AND pos_table.is_active = 1
+        """,
+        "insert_or_update_kc": f"""
+            SELECT trader_id, COUNT(*), AVG(pnl_ratio), STDDEV(pnl_ratio) FROM (
+                SELECT trader_id, pnl_ratio FROM {position_table}
+                WHERE is_active = 0 AND u_time >= (UNIX_TIMESTAMP(NOW()) - 365 * 24 * 60 * 60) * 1000
+                UNION ALL
+                SELECT trader_id, pnl_ratio FROM {position_table.replace("position_", "position_history_", 1)}
+                WHERE u_time >= (UNIX_TIMESTAMP(NOW()) - 365 * 24 * 60 * 60) * 1000
+            ) AS closed_positions
+            GROUP BY trader_id
+        """,
+        "get_all_traders_success_stats": f"""
+            SELECT * FROM success_stats WHERE is_active = 1 AND position_table = '{position_table}'
+        """,
+        "get_temp_positions_from_db": """
+            SELECT pt.* FROM position_temp pt
+            JOIN trader t ON t.trader_id = pt.trader_id
+            WHERE t.is_followed = 1
+        """,
+    }
+
+
+def explain_hot_queries(db, position_table: str):
+    """
+    Diagnostic mode - runs EXPLAIN on the known hot queries and flags full table scans
+    Returns names of queries that do a full scan
+    """
+    if db.dialect != "mysql":
+        logger.error("EXPLAIN of hot queries is MySQL only")
+        return []
+    full_scan_query_names = []
+    for query_name, query in get_hot_queries(position_table=position_table).items():
+        with db.connection.cursor(dictionary=True) as cursor:
+            cursor.execute(f"EXPLAIN {query}")
+            explain_rows = cursor.fetchall()
+        for row in explain_rows:
+            msg = f"{query_name} - table: {row['table']}, type: {row['type']}, key: {row['key']}, rows: {row['rows']}"
+            if row["type"] == "ALL":
+                logger.warning(f"Full scan! {msg}")
+                full_scan_query_names.append(query_name)
+            else:
+                logger.info(msg)
+    return full_scan_query_names
+
+
+if __name__ == "__main__":
+    """
+    Usage:
+        python db_migrations.py                 # applies pending migrations
+        python db_migrations.py --explain x1    # flags full scans of hot queries of the 'position_x1' table
+    """
+    from db_manager import DatabaseManager
+
+    db = DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database)
+    if len(sys.argv) == 3 and sys.argv[1] == "--explain" and sys.argv[2] in ["x1", "x2", "x3"]:
+        explain_hot_queries(db=db, position_table=f"position_{sys.argv[2]}")
+    elif len(sys.argv) == 1:
+        run_migrations(db=db)
+    else:
+        logger.error("Usage: python db_migrations.py [--explain <instance>]")
+        sys.exit(1)
@@ -0,0 +1,127 @@
+import threading
+import time
+import mysql.connector
+from mysql.connector import errorcode, pooling
+from loguru import logger
+import helpers
+from db_sqlite import SQLiteBackend
+
+config = helpers.load_config_from_yaml()
+db_pool_size = config.get("db_pool_size", 5)
+db_health_check_interval = config.get("db_health_check_interval", 30)
+# Seconds to wait for a free connection if all connections of the pool are borrowed
+db_pool_timeout = config.get("db_pool_timeout", 30)
+# "mysql" or "sqlite" (embedded database file per database in 'sqlite_dir', see db_sqlite.py)
+db_backend = config.get("db_backend", "mysql")
+sqlite_dir = config.get("sqlite_dir", "./data")
+
+# "MySQL server has gone away" and "Lost connection to MySQL server during query"
+CONNECTION_LOST_ERRNOS = [errorcode.CR_SERVER_GONE_ERROR, errorcode.CR_SERVER_LOST]
+
+# One pool per database per process, shared by every DatabaseManager instance
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+
+def is_connection_lost_error(error: Exception):
+    if isinstance(error, (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)):
+        return error.errno in CONNECTION_LOST_ERRNOS or "gone away" in str(error)
+    return False
+
+
+class ConnectionPool:
+    dialect = "mysql"
+
+    def __init__(
+        self,
+        db_host,
+        db_user,
+        db_password,
+        database,
+        pool_size: int = db_pool_size,
+        health_check_interval: int = db_health_check_interval
+    ):
+        self.host = db_host
+        self.user = db_user
+        self.password = db_password
+        self.database = database
+        self.pool_size = pool_size
+        self.health_check_interval = health_check_interval
+        self._create_database()
+        self.pool = pooling.MySQLConnectionPool(
+            pool_name=f"{self.database}_pool",
+            pool_size=self.pool_size,
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=self.database
+        )
+        logger.debug(f"MySQL connection pool created (size: {self.pool_size}).")
+
+    def _create_database(self):
+        # Runs only once per process instead of once per DatabaseManager instance
+        connection = mysql.connector.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.database}")
+        connection.close()
+
+    def get_connection(self, timeout: float = db_pool_timeout):
+        # Concurrently running stages of every instance borrow connections, the pool might be exhausted for a moment
+        deadline = time.time() + timeout
+        while True:
+            try:
+                connection = self.pool.get_connection()
+                break
+            except mysql.connector.errors.PoolError:
+                if time.time() >= deadline:
+                    raise
+                time.sleep(0.1)
+        return self.check_health(connection=connection)
+
+    def check_health(self, connection):
+        """
+        Pings the connection and reconnects it if the server has gone away
+        Returns a healthy connection (the same one or a newly borrowed one)
+        """
+        try:
+            connection.ping(reconnect=True, attempts=3, delay=1)
+            return connection
+        except mysql.connector.Error as e:
+            logger.warning(f"Unhealthy MySQL connection, borrowing a new one from the pool: {e}")
+            self.release_connection(connection=connection)
+            return self.pool.get_connection()
+
+    def release_connection(self, connection):
+        try:
+            connection.close()  # returns the connection to the pool
+        except mysql.connector.Error as e:
+            logger.warning(f"Unable to return MySQL connection to the pool: {e}")
+
+    @staticmethod
+    def get_index_name(table: str, index_name: str):
+        return index_name
+
+
+def get_connection_pool(db_host, db_user, db_password, database, pool_size: int = db_pool_size):
+    """
+    'pool_size' is used only by the first call for the database (the pool is created once)
+    """
+    pool_key = (db_host, db_user, database)
+    with _connection_pools_lock:
+        if pool_key not in _connection_pools:
+            if db_backend == "sqlite":
+                _connection_pools[pool_key] = SQLiteBackend(
+                    database=database,
+                    sqlite_dir=sqlite_dir,
+                    busy_timeout=db_pool_timeout,
+                    health_check_interval=db_health_check_interval,
+                )
+            else:
+                _connection_pools[pool_key] = ConnectionPool(
+                    db_host=db_host, db_user=db_user, db_password=db_password, database=database, pool_size=pool_size
+                )
+        return _connection_pools[pool_key]
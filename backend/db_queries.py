@@ -0,0 +1,121 @@
+"""
+SQL of the queries that both DatabaseManager and AsyncDatabaseManager run
+(one place to change a query, the managers only execute them and shape the results)
+"""
+
+
+def get_history_table_name(position_table: str):
+    """
+    Ex.: 'position_x1' -> 'position_history_x1'
+    """
+    return position_table.replace("position_", "position_history_", 1)
+
+
+def get_insert_query(table: str, columns):
+    columns_as_str = ", ".join(columns)
+    placeholders = ", ".join(["%s"] * len(columns))
+    return f"INSERT INTO {table} ({columns_as_str}) VALUES ({placeholders})"
+
+
+def get_update_query(table: str, columns, condition_column: str):
+    set_values = ", ".join([f"{column} = %s" for column in columns])
+    return f"UPDATE {table} SET {set_values} WHERE {condition_column} = %s"
+
+
+def get_active_positions_query(table: str):
+    return f"SELECT * FROM {table} WHERE is_active = 1 ORDER BY inserted_on ASC"
+
+
+def get_active_non_ignored_positions_query(table: str, select: str = "t.*"):
+    """
+    The earliest active non-ignored position of every symbol (next traders with the same symbol are ignored)
+    """
+    return f"""
+        SELECT {select}
+        FROM {table} t
+        INNER JOIN (
+            SELECT MIN(id) AS earliest_id
+            FROM {table}
+            WHERE is_active = 1 AND is_ignored = 0
+            GROUP BY symbol
+        ) AS subquery ON t.id = subquery.earliest_id
+    """
+
+
+def get_temp_positions_query(ignore_observed_traders: bool = True):
+    # Positions of followed (and observed, if not ignored) traders
+    trader_condition = "t.is_followed = 1"
+    if not ignore_observed_traders:
+        trader_condition = "(t.is_followed = 1 OR t.is_observed = 1)"
+    return f"""
+        SELECT pt.* FROM position_temp pt
+        JOIN trader t ON t.trader_id = pt.trader_id
+        WHERE {trader_condition}
+    """
+
+
+def get_total_kc_query(top_x_table_name: str, trader_ids: list):
+    """
+    Parameters: trader IDs + trader IDs (flat, the driver can't bind a tuple to 'IN %s')
+    """
+    placeholders = ", ".join(["%s"] * len(trader_ids))
+    return f"""
+        SELECT
+            COUNT(*) AS trades_count,
+            SUM(roe) AS roe_sum,
+            AVG(roe) AS avg_roe,
+            STDDEV(roe) AS roe_std_dev,
+            (AVG(roe) / NULLIF(STDDEV(roe) * STDDEV(roe), 0)) AS kelly_criteria
+        FROM (
+            SELECT roe FROM {top_x_table_name} WHERE is_active = 0 AND trader_id IN ({placeholders})
+            UNION ALL
+            SELECT roe FROM {get_history_table_name(top_x_table_name)} WHERE trader_id IN ({placeholders})
+        ) AS closed_positions
+    """
+
+
+def get_kc_stats_query(kc_stats_table_name: str, column: str):
+    """
+    Ex.: column = "kelly_criteria" or "trades_count"
+    """
+    return f"""
+        SELECT trader_id, {column}
+        FROM {kc_stats_table_name}
+        ORDER BY {column} DESC
+    """
+
+
+def get_penalties_query():
+    """
+    Parameters: (position table,)
+    """
+    return """
+        SELECT trader_id, penalty_value
+        FROM penalties
+        WHERE position_table = %s
+    """
+
+
+def get_active_orders_query(orders_table: str):
+    """
+    'stop_losses'/'take_profits' - parameters: (position table,)
+    """
+    return f"""
+        SELECT *
+        FROM {orders_table}
+        WHERE position_table = %s AND is_active = 1
+    """
+
+
+def get_active_pos_orders_query(orders_table: str, position_table: str):
+    """
+    'stop_losses'/'take_profits' of open positions (not filled, but they might be not active - already triggered)
+    Parameters: (position table,)
+    """
+    return f"""
+        SELECT o.*
+        FROM {orders_table} o
+        LEFT JOIN {position_table} pos_table
+        ON o.orig_position_id = pos_table.bin_pos_id
+        WHERE o.position_table = %s AND o.is_filled = 0 AND pos_table.is_active = 1
+    """
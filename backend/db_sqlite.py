@@ -0,0 +1,281 @@
+import math
+import os
+import queue
+import re
+import sqlite3
+from datetime import datetime
+from decimal import Decimal
+import mysql.connector
+from loguru import logger
+
+# MySQL column types that are returned as Python objects (same as mysql-connector returns them)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" ", "seconds"))
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_converter("DATETIME", lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter("DECIMAL", lambda value: Decimal(value.decode()))
+
+# SQLite errors are raised as mysql-connector errors, so callers handle them the same way for both backends
+ERRORS = {
+    sqlite3.IntegrityError: mysql.connector.errors.IntegrityError,
+    sqlite3.OperationalError: mysql.connector.errors.OperationalError,
+    sqlite3.ProgrammingError: mysql.connector.errors.ProgrammingError,
+}
+
+NOW_SQL = "DATETIME('now', 'localtime')"  # MySQL's NOW()/CURRENT_TIMESTAMP are in the session (local) time zone
+CREATE_TABLE_RE = re.compile(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+CREATE_TABLE_LIKE_RE = re.compile(r"CREATE\s+TABLE\s+IF\s+NOT\s+EXISTS\s+(\w+)\s+LIKE\s+(\w+)", re.IGNORECASE)
+ON_UPDATE_COLUMN_RE = re.compile(r"(\w+)\s+DATETIME[^,]*?\s+ON\s+UPDATE\s+CURRENT_TIMESTAMP", re.IGNORECASE)
+ON_DUPLICATE_KEY_RE = re.compile(r"ON\s+DUPLICATE\s+KEY\s+UPDATE", re.IGNORECASE)
+FOR_UPDATE_RE = re.compile(r"\s+FOR\s+UPDATE\b", re.IGNORECASE)
+
+# (MySQL pattern, SQLite replacement), applied in order
+QUERY_REPLACEMENTS = [
+    (re.compile(r"\b\w*INT\s+AUTO_INCREMENT\s+PRIMARY\s+KEY", re.IGNORECASE), "INTEGER PRIMARY KEY AUTOINCREMENT"),
+    (re.compile(r"\s+ON\s+UPDATE\s+CURRENT_TIMESTAMP", re.IGNORECASE), ""),  # emulated by a trigger
+    (re.compile(r"DEFAULT\s+(CURRENT_TIMESTAMP|NOW\(\))", re.IGNORECASE), f"DEFAULT ({NOW_SQL})"),
+    (
+        re.compile(r"NOW\(\)\s*-\s*INTERVAL\s+(%s|\d+)\s+HOUR", re.IGNORECASE),
+        r"DATETIME('now', 'localtime', '-' || (\1) || ' hours')"
+    ),
+    (re.compile(r"INSERT\s+IGNORE", re.IGNORECASE), "INSERT OR IGNORE"),
+    (re.compile(r"\bIF\s*\(", re.IGNORECASE), "IIF("),
+    (re.compile(r"TIMESTAMPDIFF\(\s*(\w+)\s*,", re.IGNORECASE), r"TIMESTAMPDIFF('\1',"),
+    # MySQL's '/' never divides integers as integers
+    (re.compile(r" / "), " * 1.0 / "),
+]
+
+
+class StddevAggregate:
+    """
+    Population standard deviation (same as MySQL's STDDEV)
+    """
+    def __init__(self):
+        self.values = []
+
+    def step(self, value):
+        if value is not None:
+            self.values.append(float(value))
+
+    def finalize(self):
+        if not self.values:
+            return None
+        avg = sum(self.values) / len(self.values)
+        return math.sqrt(sum([(value - avg) ** 2 for value in self.values]) / len(self.values))
+
+
+def unix_timestamp(value=None):
+    if value is None:
+        return int(datetime.now().timestamp())
+    return int(datetime.fromisoformat(str(value)).timestamp())
+
+
+def timestampdiff(unit: str, from_value, to_value):
+    if from_value is None or to_value is None:
+        return None
+    seconds = (datetime.fromisoformat(str(to_value)) - datetime.fromisoformat(str(from_value))).total_seconds()
+    units_in_seconds = {"SECOND": 1, "MINUTE": 60, "HOUR": 3600, "DAY": 86400, "WEEK": 604800}
+    return int(seconds / units_in_seconds[unit.upper()])
+
+
+def translate_query(query: str, params=None):
+    """
+    MySQL query (as used by DatabaseManager) -> SQLite query
+    Tuple/list parameters of 'IN %s' are expanded into separate placeholders
+    Ex.: translate_query("SELECT * FROM t WHERE id IN %s", ((1, 2),)) -> ("SELECT * FROM t WHERE id IN (?, ?)", [1, 2])
+    """
+    for pattern, replacement in QUERY_REPLACEMENTS:
+        query = pattern.sub(replacement, query)
+
+    match = ON_DUPLICATE_KEY_RE.search(query)
+    if match:
+        update_statements = re.sub(r"VALUES\((\w+)\)", r"excluded.\1", query[match.end():])
+        query = query[:match.start()] + "ON CONFLICT DO UPDATE SET" + update_statements
+
+    if params is None:
+        return query.replace("%s", "?"), None  # ex.: 'executemany' queries (parameters are never tuples there)
+
+    query_parts = query.split("%s")
+
+    translated_query = query_parts[0]
+    translated_params = []
+    for param, query_part in zip(params, query_parts[1:]):
+        if isinstance(param, (tuple, list)):
+            translated_query += "(" + ", ".join(["?"] * len(param)) + ")" + query_part
+            translated_params += list(param)
+        else:
+            translated_query += "?" + query_part
+            translated_params.append(param)
+    return translated_query, translated_params
+
+
+class SQLiteCursor:
+    """
+    mysql-connector like cursor (context manager, '%s' placeholders, dictionary rows)
+    """
+    def __init__(self, connection, dictionary: bool = False):
+        self.connection = connection
+        self.cursor = connection.raw_connection.cursor()
+        self.dictionary = dictionary
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def _run(self, func, *args):
+        try:
+            return func(*args)
+        except sqlite3.Error as e:
+            raise ERRORS.get(type(e), mysql.connector.errors.DatabaseError)(msg=str(e)) from e
+
+    def execute(self, query: str, params=None):
+        match = CREATE_TABLE_LIKE_RE.search(query)
+        if match:
+            query = self.connection.get_create_table_like_query(table=match.group(1), like_table=match.group(2))
+        on_update_columns = ON_UPDATE_COLUMN_RE.findall(query)
+        table_match = CREATE_TABLE_RE.search(query)
+        if FOR_UPDATE_RE.search(query):
+            # SQLite locks the whole database instead of rows - the write lock is taken by the locking read
+            query = FOR_UPDATE_RE.sub("", query)
+            if not self.connection.raw_connection.in_transaction:
+                self._run(self.cursor.execute, "BEGIN IMMEDIATE")
+
+        query, params = translate_query(query, params)
+        if params is None:
+            self._run(self.cursor.execute, query)
+        else:
+            self._run(self.cursor.execute, query, params)
+
+        # 'ON UPDATE CURRENT_TIMESTAMP' columns
+        if table_match:
+            for column in on_update_columns:
+                self.connection.create_on_update_trigger(table=table_match.group(1), column=column)
+
+    def executemany(self, query: str, params_list):
+        query, _ = translate_query(query)
+        self._run(self.cursor.executemany, query, [list(params) for params in params_list])
+
+    def _to_row(self, row):
+        if row is None or not self.dictionary:
+            return row
+        return {description[0]: value for description, value in zip(self.cursor.description, row)}
+
+    def fetchone(self):
+        return self._to_row(self._run(self.cursor.fetchone))
+
+    def fetchall(self):
+        return [self._to_row(row) for row in self._run(self.cursor.fetchall)]
+
+    def close(self):
+        self.cursor.close()
+
+
+class SQLiteConnection:
+    """
+    mysql-connector like connection of an embedded SQLite database
+    """
+    def __init__(self, path: str, busy_timeout: float):
+        # Borrowed by a single thread at a time (see SQLiteBackend)
+        self.raw_connection = sqlite3.connect(
+            path, timeout=busy_timeout, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False
+        )
+        self.raw_connection.execute("PRAGMA foreign_keys = ON")  # enforced by InnoDB as well
+        self.raw_connection.execute("PRAGMA synchronous = NORMAL")  # durable enough in WAL mode
+        self.raw_connection.create_function("NOW", 0, lambda: datetime.now().isoformat(" ", "seconds"))
+        self.raw_connection.create_function("UNIX_TIMESTAMP", -1, unix_timestamp)
+        self.raw_connection.create_function("TIMESTAMPDIFF", 3, timestampdiff)
+        self.raw_connection.create_function("POW", 2, lambda x, y: None if x is None else math.pow(x, y))
+        self.raw_connection.create_function("SQRT", 1, lambda x: None if x is None or x < 0 else math.sqrt(x))
+        self.raw_connection.create_aggregate("STDDEV", 1, StddevAggregate)
+
+    def cursor(self, dictionary: bool = False):
+        return SQLiteCursor(connection=self, dictionary=dictionary)
+
+    def commit(self):
+        self.raw_connection.commit()
+
+    def rollback(self):
+        self.raw_connection.rollback()
+
+    def get_create_table_like_query(self, table: str, like_table: str):
+        """
+        MySQL's 'CREATE TABLE ... LIKE' (the table's own SQL with a new name)
+        """
+        row = self.raw_connection.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (like_table,)
+        ).fetchone()
+        if row is None:
+            raise mysql.connector.errors.ProgrammingError(msg=f"Table '{like_table}' doesn't exist")
+        return CREATE_TABLE_RE.sub(f"CREATE TABLE IF NOT EXISTS {table}", row[0], count=1)
+
+    def create_on_update_trigger(self, table: str, column: str):
+        """
+        Sets the column to the current time on every update that doesn't set it explicitly
+        """
+        self.raw_connection.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_{column}_on_update
+            AFTER UPDATE ON {table} FOR EACH ROW WHEN NEW.{column} IS OLD.{column}
+            BEGIN
+                UPDATE {table} SET {column} = {NOW_SQL} WHERE rowid = NEW.rowid;
+            END
+        """)
+
+    def close(self):
+        self.raw_connection.close()
+
+
+class SQLiteBackend:
+    """
+    Embedded SQLite storage with the same interface as db_pool.ConnectionPool
+    (single-node deployments without a MySQL server, hermetic replays)
+    The database file is in WAL mode, so readers don't block the writer and vice versa
+    DatabaseManager's MySQL queries are translated (see 'translate_query'), the few statements that
+    can't be translated are branched on 'dialect' by DatabaseManager itself
+    """
+    dialect = "sqlite"
+
+    def __init__(self, database: str, sqlite_dir: str, busy_timeout: float = 30, health_check_interval: int = 30):
+        self.database = database
+        self.health_check_interval = health_check_interval
+        self.busy_timeout = busy_timeout
+        os.makedirs(sqlite_dir, exist_ok=True)
+        self.path = os.path.join(sqlite_dir, f"{database}.sqlite3")
+        # Not borrowed connections
+        self.idle_connections = queue.SimpleQueue()
+
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode = WAL")  # persistent, set once per database file
+        connection.close()
+        logger.debug(f"SQLite database opened: {self.path}")
+
+    def get_connection(self):
+        try:
+            return self.idle_connections.get_nowait()
+        except queue.Empty:
+            return SQLiteConnection(path=self.path, busy_timeout=self.busy_timeout)
+
+    def check_health(self, connection):
+        return connection  # an embedded database can't go away
+
+    def release_connection(self, connection):
+        try:
+            connection.rollback()  # nothing uncommitted is kept by an idle connection
+        except sqlite3.Error as e:
+            logger.warning(f"Unable to roll back SQLite connection, closing it: {e}")
+            connection.close()
+            return
+        self.idle_connections.put(connection)
+
+    @staticmethod
+    def get_index_name(table: str, index_name: str):
+        # SQLite index names are unique per database (MySQL ones per table)
+        return f"{table}__{index_name}"
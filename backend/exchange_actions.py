@@ -0,0 +1,414 @@
+import asyncio
+import itertools
+import math
+import queue
+import threading
+from concurrent.futures import Future
+from aiolimiter import AsyncLimiter
+from loguru import logger
+
+# Lower value = more urgent. Queued work of a more urgent priority is always sent first
+PRIORITY_EXIT = 0  # cancels/closes (ex.: positions the lead trader has exited)
+PRIORITY_ENTRY = 1  # partial closes (rebalancing) and opens
+PRIORITY_PROTECTION = 2  # stop-loss/take-profit maintenance
+
+# {action: (TradingAPI bound task, metadata key of the orders list, priority, phase), ...}
+# Phases of the same priority run one after another (ex.: partial closes -> opens),
+# actions of the same phase run concurrently
+ACTIONS = {
+    "cancel": ("cancel_multi_orders", "orders", PRIORITY_EXIT, 0),
+    "close": ("close_multi_orders", "orders", PRIORITY_EXIT, 0),
+    "partially_close": ("partially_close_multi_orders", "orders", PRIORITY_ENTRY, 0),
+    "open": ("open_multi_orders", "orders", PRIORITY_ENTRY, 1),
+    "cancel_sl": ("cancel_sls", "positions", PRIORITY_PROTECTION, 0),
+    "cancel_tp": ("cancel_tps", "positions", PRIORITY_PROTECTION, 0),
+    "create_sl": ("create_sls", "positions", PRIORITY_PROTECTION, 1),
+    "create_tp": ("create_tps", "positions", PRIORITY_PROTECTION, 1),
+}
+EXIT_ACTIONS = ["cancel", "close"]
+# Actions that make no sense for a position that is being canceled or closed
+POSITION_ACTIONS = ["partially_close", "open", "create_sl", "create_tp"]
+
+# Same as TradingAPI.init_limiter, but shared by all concurrently running actions
+REQUESTS_PER_SECOND = 10
+
+# Stop-loss/take-profit actions are diffed against the open orders of the account before they are sent
+# {action: type of the matching open order (None for cancels), ...} (see ExchangeActionLane._reconcile)
+RECONCILED_ACTIONS = {
+    "create_sl": "STOP_MARKET",
+    "create_tp": "TAKE_PROFIT_MARKET",
+    "cancel_sl": None,
+    "cancel_tp": None,
+}
+# Relative difference of amount/stop price under which an open order is the requested one
+RECONCILE_TOLERANCE = 0.001
+
+
+class ExchangeActionLane:
+    """
+    Worker thread (with its own event loop) that sends exchange actions in priority order
+    Stages keep running while submitted actions are on their way to the exchange, so urgent exits
+    don't wait for the rest of the iteration
+    Stop-loss/take-profit requests that already match the open orders of the account are not sent (see '_reconcile')
+    Ex.:
+        future = lane.submit(priority=PRIORITY_EXIT, phases=[grouped_requests, ...], trading_api_factory=...)
+        phases_results = future.result()
+    """
+    def __init__(self):
+        # (priority, sequence number, phases, trading API factory, future)
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()  # FIFO order of the same priority
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="exchange-action-lane", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        """
+        The lane's thread exits once the already submitted requests are executed
+        """
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                self.queue.put((float("inf"), next(self.sequence), None, None, None))
+
+    def submit(self, priority: int, phases: list, trading_api_factory):
+        """
+        'phases' - [{(action, metadata items): [request, ...], ...}, ...]
+        Returns a Future of results: [[group results, ...] of every phase, ...]
+        """
+        self.start()
+        future = Future()
+        self.queue.put((priority, next(self.sequence), phases, trading_api_factory, future))
+        return future
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        while True:
+            _, _, phases, trading_api_factory, future = self.queue.get()
+            if future is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                phases_results = []
+                for grouped_requests in phases:
+                    phases_results.append(loop.run_until_complete(
+                        self._execute_phase(grouped_requests=grouped_requests, trading_api_factory=trading_api_factory)
+                    ))
+                future.set_result(phases_results)
+            except Exception as e:
+                future.set_exception(e)
+        loop.close()
+
+    async def _execute_phase(self, grouped_requests: dict, trading_api_factory):
+        limiter = AsyncLimiter(REQUESTS_PER_SECOND, 1)
+        open_orders = await self._fetch_open_orders(
+            grouped_requests=grouped_requests, trading_api_factory=trading_api_factory, limiter=limiter
+        )
+        used_order_ids = set()  # an open order can satisfy a single request
+        tasks = []
+        known_results = []  # [{index of the request: (status, result), ...} of every group, ...]
+        for (action, metadata_items), requests in grouped_requests.items():
+            bound_task, orders_key, _, _ = ACTIONS[action]
+            metadata = dict(metadata_items)
+            # Every concurrent action needs its own exchange session (TradingAPI keeps it as an attribute)
+            trader = trading_api_factory()
+            trader.limiter = limiter
+            group_known_results = self._reconcile(
+                action=action,
+                requests=requests,
+                metadata=metadata,
+                open_orders=open_orders,
+                used_order_ids=used_order_ids,
+                trader=trader,
+            )
+            known_results.append(group_known_results)
+            metadata[orders_key] = [
+                request["order"] for i, request in enumerate(requests) if i not in group_known_results
+            ]
+            if metadata[orders_key]:
+                tasks.append(trader.fetch_api_urls(bound_task=bound_task, metadata=metadata))
+            else:
+                tasks.append(asyncio.sleep(0, result=[]))
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Results of the sent requests are merged with the reconciled ones (in the order of the requests)
+        phase_results = []
+        for requests, group_known_results, group_results in zip(grouped_requests.values(), known_results, results):
+            if isinstance(group_results, Exception) or not group_known_results:
+                phase_results.append(group_results)
+                continue
+            sent_results = iter(group_results)
+            phase_results.append([
+                group_known_results[i] if i in group_known_results else next(sent_results)
+                for i in range(len(requests))
+            ])
+        return phase_results
+
+    async def _fetch_open_orders(self, grouped_requests: dict, trading_api_factory, limiter):
+        """
+        Open orders of the symbols of stop-loss/take-profit requests, fetched once per phase
+        Ex.: {"BTCUSDT": [order, ...], ...} (symbols whose orders couldn't be fetched are left out)
+        """
+        symbols = sorted(set([
+            request["order"]["symbol"]
+            for (action, _), requests in grouped_requests.items()
+            if action in RECONCILED_ACTIONS
+            for request in requests
+        ]))
+        if not symbols:
+            return {}
+        trader = trading_api_factory()
+        trader.limiter = limiter
+        try:
+            responses = await trader.fetch_api_urls(bound_task="fetch_open_orders", metadata={"symbols": symbols})
+        except Exception as e:
+            logger.error(f"Failed to fetch open orders, sending stop-loss/take-profit orders as requested: {e}")
+            return {}
+        open_orders = {}
+        for response in responses:
+            if not isinstance(response["response"], list):
+                logger.error(f"Failed to fetch open orders of {response['symbol']}: {response['response']}")
+                continue
+            open_orders[response["symbol"]] = response["response"]
+        return open_orders
+
+    def _reconcile(self, action: str, requests: list, metadata: dict, open_orders: dict, used_order_ids: set, trader):
+        """
+        Requests whose desired state is already on the exchange get their result without being sent:
+            - creating a stop-loss/take-profit that is already open (same side, type, amount and stop price)
+              gets the open order as its result (same as if it was created)
+            - canceling a stop-loss/take-profit that isn't open anymore gets 'OrderNotFound'
+              (same as TradingAPI's response)
+        Ex.: {0: (True, order), 3: (True, {"orig_position_id": ..., "sl_table_id": ..., "status": "OrderNotFound"})}
+        """
+        if action not in RECONCILED_ACTIONS:
+            return {}
+        known_results = {}
+        for i, request in enumerate(requests):
+            order = request["order"]
+            symbol_open_orders = open_orders.get(order["symbol"])
+            if symbol_open_orders is None:
+                continue  # unknown state, sent as requested
+            if action in ["cancel_sl", "cancel_tp"]:
+                if any(str(open_order["id"]) == str(order["position_id"]) for open_order in symbol_open_orders):
+                    continue
+                table_id_key = "sl_table_id" if action == "cancel_sl" else "tp_table_id"
+                known_results[i] = (True, {
+                    "orig_position_id": order["orig_position_id"],
+                    table_id_key: order["id"],
+                    "status": "OrderNotFound",
+                })
+                continue
+
+            if action == "create_sl":
+                stop_price = trader.get_sl_price(position=order, sl_ratio=metadata["sl_ratio"])
+            else:
+                stop_price = order["tp_price"]
+            side = trader.flip_side(side=order["side"])
+            for open_order in symbol_open_orders:
+                if (
+                    open_order["id"] in used_order_ids
+                    or open_order["side"] != side
+                    or str(open_order["info"].get("type")).upper() != RECONCILED_ACTIONS[action]
+                    or not open_order.get("amount") or not open_order.get("stopPrice")
+                    or not math.isclose(open_order["amount"], order["user_amount"], rel_tol=RECONCILE_TOLERANCE)
+                    or not math.isclose(open_order["stopPrice"], stop_price, rel_tol=RECONCILE_TOLERANCE)
+                ):
+                    continue
+                used_order_ids.add(open_order["id"])
+                result = dict(open_order)
+                result["orig_position_id"] = order["position_id"]
+                result["position_type"] = "sl" if action == "create_sl" else "tp"
+                result["user_amount"] = order["user_amount"]
+                known_results[i] = (True, result)
+                break
+        if known_results:
+            logger.info(f"'{action}' of {len(known_results)} orders already matches the exchange, not sending them")
+        return known_results
+
+
+class ExchangeActionPlan:
+    """
+    Exchange orders requested by all Leaderboard stages of a single iteration
+    Stages add what they want to happen to a position (identified by 'position_key', ex.: position table ID)
+    instead of submitting it right away, so the plan can be reconciled before anything is sent:
+        - the same action of the same position is sent once (the first request wins)
+        - canceling/closing a position drops its partial close, stop-loss/take-profit creation and opening
+          requested by any stage (after a cancel only a reopen is allowed)
+    Requests are sent through the lane by priority: exits -> entries -> stop-loss/take-profit maintenance
+    Exits can be submitted as soon as they are known ('submit'), everything else is submitted by 'execute'
+    Results are passed to the callbacks of their requests by 'execute' (on the calling thread),
+    results of already submitted requests can be collected earlier by 'collect_submitted' (ex.: exits,
+    so the next stages see which positions are closed/canceled)
+    Ex.:
+        self.action_plan.add(action="close", order=db_position, position_key=db_position["id"], on_result=...)
+        self.action_plan.submit(priority=PRIORITY_EXIT)
+        ...
+        self.action_plan.execute(batch=batch)
+    """
+    def __init__(self, trading_api_factory, lane: ExchangeActionLane):
+        self.trading_api_factory = trading_api_factory
+        self.lane = lane
+        # Not yet submitted requests
+        # [{"action": ..., "order": {...}, "position_key": ..., "on_result": ..., "metadata": {...}, ...}, ...]
+        self.requests = []
+        # {position_key: {action: request, ...}, ...} (submitted requests included)
+        self.requests_by_position_key = {}
+        # [(phases, future), ...]
+        self.submissions = []
+        self.after_execute_callbacks = []
+        self.requested_count = 0
+        self.submitted_count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.requests)
+
+    def _get_requests(self, position_key, actions: list):
+        position_requests = self.requests_by_position_key.get(position_key, {})
+        return [position_requests[action] for action in actions if action in position_requests]
+
+    def add(self, action: str, order: dict, position_key, on_result=None, metadata: dict = None):
+        """
+        'on_result(status, result, batch)' is called with the exchange response of the order
+        'metadata' - additional TradingAPI metadata (ex.: {"sl_ratio": 0.1} of 'create_sl')
+        Returns False if the request was dropped (already requested or conflicts with an exit of the position)
+        """
+        if action not in ACTIONS:
+            raise Exception(f"Invalid exchange action: {action}")
+        # Stages running concurrently (see StageGraph) can add requests at the same time
+        with self.lock:
+            self.requested_count += 1
+
+            if self._get_requests(position_key=position_key, actions=[action]):
+                return False  # already requested
+            if action in EXIT_ACTIONS:
+                if self._get_requests(position_key=position_key, actions=EXIT_ACTIONS):
+                    return False  # already canceled/closed
+                for request in self._get_requests(position_key=position_key, actions=POSITION_ACTIONS):
+                    if request["is_submitted"]:
+                        continue  # already sent
+                    logger.debug(f"Dropping '{request['action']}' of position {position_key} ('{action}' requested)")
+                    self.requests.remove(request)
+                    del self.requests_by_position_key[position_key][request["action"]]
+            elif action in POSITION_ACTIONS:
+                # A reopen of a canceled (not filled) position is allowed
+                exit_actions = ["close"] if action == "open" else EXIT_ACTIONS
+                if self._get_requests(position_key=position_key, actions=exit_actions):
+                    return False
+
+            request = {
+                "action": action,
+                "order": order,
+                "position_key": position_key,
+                "on_result": on_result,
+                "metadata": metadata or {},
+                "is_submitted": False,
+            }
+            self.requests.append(request)
+            self.requests_by_position_key.setdefault(position_key, {})[action] = request
+            return True
+
+    def after_execute(self, callback):
+        """
+        'callback(batch)' is called once all requests are executed (ex.: to apply results collected by 'on_result')
+        Its DB writes are queued on the same 'batch' as the results, so they are committed together
+        """
+        self.after_execute_callbacks.append(callback)
+
+    def _group_requests(self, requests: list):
+        """
+        Ex.: {("create_sl", (("sl_ratio", 0.1),)): [request, ...], ...}
+        """
+        grouped_requests = {}
+        for request in requests:
+            group_key = (request["action"], tuple(sorted(request["metadata"].items())))
+            grouped_requests.setdefault(group_key, []).append(request)
+        return grouped_requests
+
+    def submit(self, priority: int):
+        """
+        Sends not yet submitted requests of 'priority' to the lane without waiting for the results
+        """
+        with self.lock:
+            requests = [request for request in self.requests if ACTIONS[request["action"]][2] == priority]
+            if not requests:
+                return
+            self.requests = [request for request in self.requests if ACTIONS[request["action"]][2] != priority]
+            for request in requests:
+                request["is_submitted"] = True
+            self.submitted_count += len(requests)
+
+        phases = sorted(set([ACTIONS[request["action"]][3] for request in requests]))
+        phases = [
+            self._group_requests([request for request in requests if ACTIONS[request["action"]][3] == phase])
+            for phase in phases
+        ]
+        logger.info(f"Submitting {len(requests)} exchange orders of priority {priority}")
+        future = self.lane.submit(priority=priority, phases=phases, trading_api_factory=self.trading_api_factory)
+        self.submissions.append((phases, future))
+
+    def _handle_results(self, phases: list, phases_results: list, batch):
+        for grouped_requests, results in zip(phases, phases_results):
+            for ((action, _), group_requests), group_results in zip(grouped_requests.items(), results):
+                if isinstance(group_results, Exception):
+                    logger.error(f"Failed to execute '{action}' of {len(group_requests)} orders: {group_results}")
+                    continue
+                # TradingAPI returns results in the same order as the orders
+                for request, (status, result) in zip(group_requests, group_results):
+                    if request["on_result"] is None:
+                        continue
+                    try:
+                        request["on_result"](status, result, batch)
+                    except Exception as e:
+                        # The order is already sent - other results must still be written
+                        logger.error(f"Failed to handle '{action}' result of position {request['position_key']}: {e}")
+
+    def execute(self, batch=None, submit_pending: bool = True):
+        """
+        Submits the remaining requests (by priority), waits for all of them and passes the results to the callbacks
+        'batch' (BatchWriter) is passed to the callbacks, so their DB updates are written at once
+        'submit_pending' = False only collects results of already submitted requests (ex.: after a crashed stage)
+        """
+        if submit_pending:
+            for priority in sorted(set([ACTIONS[request["action"]][2] for request in self.requests])):
+                self.submit(priority=priority)
+        elif self.requests:
+            logger.warning(f"Dropping {len(self.requests)} not submitted exchange orders")
+        logger.info(
+            f"Executing exchange action plan: {self.submitted_count} of {self.requested_count} requested orders"
+        )
+
+        self.requests = []
+        self.requests_by_position_key = {}
+        self.collect_submitted(batch=batch)
+        self.requested_count = 0
+        self.submitted_count = 0
+
+    def collect_submitted(self, batch=None):
+        """
+        Waits for the already submitted requests and passes their results to the callbacks,
+        then calls the 'after_execute' callbacks added so far
+        Not yet submitted requests stay in the plan (and reconciliation keeps seeing the collected ones)
+        """
+        with self.lock:
+            submissions = self.submissions
+            after_execute_callbacks = self.after_execute_callbacks
+            self.submissions = []
+            self.after_execute_callbacks = []
+        for phases, future in submissions:
+            try:
+                phases_results = future.result()
+            except Exception as e:
+                logger.error(f"Failed to execute exchange actions: {e}")
+                continue
+            self._handle_results(phases=phases, phases_results=phases_results, batch=batch)
+
+        for callback in after_execute_callbacks:
+            callback(batch)
@@ -1,13 +1,14 @@
+import asyncio
 import datetime
 import json
 import math
 import os
 import time
 import psutil
-import yaml
-from loguru import logger
 from telethon.sync import TelegramClient
 
+from config_service import get_config_service
+
 
 def imitate_get_users_api(resp_fn: str, time_param: str):
     valid_time_params = ["daily", "weekly", "monthly", "total"]
@@ -46,6 +47,20 @@ def round_to_same_format(from_num, to_num):
 
     return rounded_from_num
 
+def get_current_timestamp_in_ms():
+    return int(time.time() * 1000)
+
+def get_month_start_timestamp_in_ms(month_offset: int = 0):
+    """
+    Returns the timestamp (ms) of the first day (00:00 UTC) of the current month shifted by 'month_offset' months
+    Ex.: (now is 2024-03-15) month_offset=1 -> 1711929600000 (2024-04-01)
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    month_index = now.year * 12 + now.month - 1 + month_offset
+    month_start = datetime.datetime(month_index // 12, month_index % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+    return int(month_start.timestamp() * 1000)
+
+
 def calc_timestamp_diff_in_s(timestamp: int):
     current_timestamp = int(str(time.time()).replace(".", "")[:13])
     timestamp_diff = current_timestamp - timestamp
@@ -75,22 +90,13 @@ def convert_amount(user_amount, min_qty: float, step_size: float, entry_price: f
 def load_config_from_yaml():
     """
     Load configuration data from a YAML file.
+    The file is parsed only when it changes (see config_service.ConfigService).
 
     Returns:
-        dict: The loaded configuration data as a dictionary.
-              If the file does not exist or is empty, an empty dictionary will be returned.
+        Mapping: Read-only snapshot of the configuration data (nested dicts are read-only, lists are tuples).
+                 If the file does not exist or is empty, an empty mapping will be returned.
     """
-    file_path = "config.yml"
-    try:
-        with open(file_path, "r") as file:
-            config_data = yaml.safe_load(file)
-    except FileNotFoundError:
-        config_data = {}
-    except Exception as e:
-        logger.error(f"Error occurred while loading the YAML file: {e}")
-        config_data = {}
-
-    return config_data
+    return get_config_service().get()
 
 def is_command_running(command_to_find: str):
     for q in psutil.process_iter():
@@ -119,4 +125,28 @@ def is_valid_time_to_update_top_traders():
 def calc_perc_diff_between_x_y(x: float, y: float):
     abs_diff = abs(x - y)
     abs_diff_in_perc = (abs_diff / max([x, y])) * 100
-    return abs_diff_in_perc
\ No newline at end of file
+    return abs_diff_in_perc
+
+def calc_percentile(values: list, percentile: float):
+    """
+    Returns the value at 'percentile' (0-100) using linear interpolation between the closest ranks.
+    Returns None if 'values' is empty.
+    """
+    if not values:
+        return None
+
+    sorted_values = sorted(values)
+    rank = (len(sorted_values) - 1) * (percentile / 100)
+    lower_idx = math.floor(rank)
+    upper_idx = math.ceil(rank)
+    if lower_idx == upper_idx:
+        return sorted_values[lower_idx]
+
+    lower_value = sorted_values[lower_idx] * (upper_idx - rank)
+    upper_value = sorted_values[upper_idx] * (rank - lower_idx)
+    return lower_value + upper_value
+
+
+def init_worker_event_loop():
+    # TradingAPI runs its requests on the current thread's event loop, worker threads don't have one by default
+    asyncio.set_event_loop(asyncio.new_event_loop())
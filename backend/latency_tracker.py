@@ -0,0 +1,117 @@
+import sys
+from loguru import logger
+import helpers
+from db_manager import DatabaseManager
+
+config = helpers.load_config_from_yaml()
+db_host = config["db_host"]
+db_user = config["db_user"]
+db_password = config["db_password"]
+database = config["database"]
+position_latency_retention_hours = config.get("position_latency_retention_hours", 24)
+
+# Ordered hops a position passes from the lead trader opening it to the Binance order acknowledgement
+LATENCY_STAGES = [
+    "trader_open",          # 'open_time' of the API payload
+    "scraper_poll",         # RapidAPI response received (rapidapi.py)
+    "temp_write",           # position committed to 'position_temp' (rapidapi.py)
+    "leaderboard_pickup",   # position read from 'position_temp' (leaderboard.py)
+    "order_submit",         # limit order sent to Binance (leaderboard.py)
+    "exchange_ack",         # Binance order response received (leaderboard.py)
+]
+
+# Stages written by rapidapi.py are shared between all instances (x1, x2, ...)
+SHARED_LATENCY_STAGES = ["trader_open", "scraper_poll", "temp_write"]
+
+
+class LatencyTracker:
+    def __init__(self, db, position_table: str = ""):
+        self.db = db
+        self.position_table = position_table
+        self.pending_rows = []
+
+    def tag(self, stage: str, positions: list, timestamp: int = None, timestamp_key: str = None):
+        """
+        Buffers 'stage' timestamps of positions (identified by 'trade_item_id')
+        If 'timestamp_key' is provided - the timestamp is taken from the position itself (ex.: 'open_time')
+        """
+        if stage not in LATENCY_STAGES:
+            logger.error(f"Invalid latency stage: {stage}")
+            return
+
+        if timestamp is None and timestamp_key is None:
+            timestamp = helpers.get_current_timestamp_in_ms()
+
+        position_table = "" if stage in SHARED_LATENCY_STAGES else self.position_table
+        for position in positions:
+            trade_item_id = position.get("trade_item_id")
+            stage_ts = position.get(timestamp_key) if timestamp_key else timestamp
+            if trade_item_id is None or stage_ts is None:
+                continue
+            self.pending_rows.append((int(trade_item_id), position_table, stage, int(stage_ts)))
+
+    def tag_orders(self, orders: list):
+        """
+        Buffers 'order_submit' and 'exchange_ack' timestamps of opened orders (TradingAPI.open_multi_orders results)
+        """
+        opened_orders = [result for status, result in orders if status]
+        self.tag(stage="order_submit", positions=opened_orders, timestamp_key="submitted_on_ts")
+        self.tag(stage="exchange_ack", positions=opened_orders, timestamp_key="acked_on_ts")
+
+    def flush(self):
+        if not self.pending_rows:
+            return
+        rows = self.pending_rows
+        self.pending_rows = []
+        try:
+            self.db.insert_position_latencies(rows=rows)
+        except Exception as e:
+            # Latency tracing must never break trading
+            logger.error(f"Unable to save position latencies: {e}")
+
+    def get_stage_percentiles(self, since_hours: int = 24, percentiles: tuple = (50, 90, 99)):
+        """
+        Returns latency percentiles (in ms) of every hop between consecutive stages and of the whole path
+        Ex.: {
+            "trader_open -> scraper_poll": {"count": 120, "p50": 14210, "p90": 29034, "p99": 31750},
+            ...
+            "trader_open -> exchange_ack": {...},
+        }
+        """
+        since_ts = helpers.get_current_timestamp_in_ms() - since_hours * 60 * 60 * 1000
+        position_latencies = self.db.fetch_position_latencies(position_table=self.position_table, since_ts=since_ts)
+
+        hops = list(zip(LATENCY_STAGES[:-1], LATENCY_STAGES[1:])) + [(LATENCY_STAGES[0], LATENCY_STAGES[-1])]
+        hop_durations = {f"{from_stage} -> {to_stage}": [] for from_stage, to_stage in hops}
+        for stages in position_latencies.values():
+            for from_stage, to_stage in hops:
+                if from_stage in stages and to_stage in stages:
+                    hop_durations[f"{from_stage} -> {to_stage}"].append(stages[to_stage] - stages[from_stage])
+
+        results = {}
+        for hop, durations in hop_durations.items():
+            results[hop] = {"count": len(durations)}
+            for percentile in percentiles:
+                results[hop][f"p{percentile}"] = helpers.calc_percentile(values=durations, percentile=percentile)
+
+        return results
+
+
+if __name__ == "__main__":
+    """
+    Usage: python latency_tracker.py x1 [since_hours]
+    """
+    valid_instance_args = ["x1", "x2", "x3"]
+    if not (2 <= len(sys.argv) <= 3) or sys.argv[1] not in valid_instance_args:
+        logger.error("Usage: python latency_tracker.py <instance> [since_hours]")
+        sys.exit(1)
+
+    # Older timestamps are deleted by archiver.py
+    since_hours_arg = int(sys.argv[2]) if len(sys.argv) == 3 else position_latency_retention_hours
+
+    db = DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database)
+    tracker = LatencyTracker(db=db, position_table=f"position_{sys.argv[1]}")
+    stage_percentiles = tracker.get_stage_percentiles(since_hours=since_hours_arg)
+    for hop, stats in stage_percentiles.items():
+        stats_as_str = ", ".join([f"{key}: {val}" for key, val in stats.items()])
+        logger.info(f"{hop} (ms) - {stats_as_str}")
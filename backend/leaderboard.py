@@ -1,8 +1,10 @@
+import asyncio
 import math
 import os
 import sys
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from decimal import Decimal
 from typing import Union
@@ -12,9 +14,20 @@ from loguru import logger
 
 import helpers
 import telegram_bot
+from allocation import AllocationEngine
+from config_service import get_config_service
+from db_async import AsyncDatabaseManager
 from db_manager import DatabaseManager
-from helpers import calc_timestamp_diff_in_s, convert_amount, calc_perc_diff_between_x_y
+from db_pool import db_pool_size, is_connection_lost_error
+from exchange_actions import ExchangeActionLane, ExchangeActionPlan, PRIORITY_EXIT
+from helpers import calc_timestamp_diff_in_s, convert_amount, calc_perc_diff_between_x_y, init_worker_event_loop
+from latency_tracker import LatencyTracker
 from rapidapi import LeaderboardScraper
+from stage_graph import Stage, StageGraph
+from position_conflicts import PositionConflictResolver
+from position_matcher import PositionMatcher
+from position_store import PositionStateStore
+from trader_cache import TraderMetadataCache
 from trading_api import TradingAPI
 
 config = helpers.load_config_from_yaml()
@@ -39,26 +52,171 @@ COPY_TRADER_BY = config["copy_trader_by"]
 
 COPYING_TYPE = "multi"
 
+# Max. number of independent stages of a single iteration running at the same time (see StageGraph)
+MAX_CONCURRENT_STAGES = config.get("max_concurrent_stages", 3)
+
 db_host = config["db_host"]
 db_user = config["db_user"]
 db_password = config["db_password"]
 database = config["database"]
 
 
+def get_required_db_pool_size(instances_count: int = 1):
+    """
+    Every instance borrows a DB connection per running stage plus one for its iteration thread
+    (+1 for the orchestrator's shared stages), otherwise stages wait for connections ('db_pool_timeout')
+    """
+    return instances_count * (MAX_CONCURRENT_STAGES + 1) + 1
+
+
+def check_db_pool_size(db, instances_count: int = 1):
+    pool_size = getattr(db.pool, "pool_size", None)  # an embedded database (SQLite) has no pool limit
+    required_pool_size = get_required_db_pool_size(instances_count=instances_count)
+    if pool_size is not None and pool_size < required_pool_size:
+        raise Exception(
+            f"'db_pool_size' ({pool_size}) is too small for {instances_count} instance(s) with "
+            f"'max_concurrent_stages' {MAX_CONCURRENT_STAGES}, it has to be at least {required_pool_size}"
+        )
+
+
 class Leaderboard:
     replicatable_tables = ["position", "kc_stats"]
 
-    def __init__(self, instance: str, instance_to_replicate: str = None):
+    def __init__(self, instance: str, instance_to_replicate: str = None, api_key: str = None, api_secret: str = None):
         self.instance = instance
         self.instance_to_replicate = instance_to_replicate
+        # Every instance trades with its own Binance account
+        self.api_key = api_key or config[f"binance_api_key_{self.instance}"]
+        self.api_secret = api_secret or config[f"binance_api_secret_{self.instance}"]
+        self.markets = None  # shared Binance markets (set by the orchestrator)
         self.position_table_name = f"position_{self.instance}"
         self.kc_stats_table_name = f"kc_stats_{self.instance}"
         self.config = None
-        self.db = DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database)
+        self.db = DatabaseManager(
+            db_host=db_host, db_user=db_user, db_password=db_password, database=database,
+            pool_size=max(db_pool_size, get_required_db_pool_size())
+        )
+        # Reads that can overlap with exchange requests of the same event loop (see 'read_copy_inputs')
+        self.async_db = AsyncDatabaseManager(
+            db_host=db_host, db_user=db_user, db_password=db_password, database=database
+        )
         self.scraper = LeaderboardScraper(db=self.db)
+        self.latency_tracker = LatencyTracker(db=self.db, position_table=self.position_table_name)
+        self.trader_cache = TraderMetadataCache(db=self.db)
+        self.positions = PositionStateStore(db=self.db, position_table=self.position_table_name)
+        self.position_matchers = {}
+        self.failed_stages = set()  # stages that failed in the previous iteration
+        # Stage worker threads are kept between iterations (with their event loops and async DB pools)
+        self.stage_executor = ThreadPoolExecutor(
+            max_workers=MAX_CONCURRENT_STAGES, initializer=init_worker_event_loop, thread_name_prefix="stage"
+        )
+        # Exchange actions are sent by their own worker thread (urgent exits first)
+        self.action_lane = ExchangeActionLane()
+        self.action_plan = ExchangeActionPlan(trading_api_factory=self.get_trading_api, lane=self.action_lane)
+        # Instance toggles are applied as soon as a new version of config.yml is published
+        config_service = get_config_service()
+        config_service.subscribe(self.apply_config)
+        self.apply_config(config_service.get())
         if self.instance_to_replicate:
             self.replicate_instance()
 
+    def apply_config(self, config):
+        self.should_copy_positions = config[f"{self.instance}_copy_positions"]
+
+    def get_trading_api(self):
+        return TradingAPI(api_key=self.api_key, api_secret=self.api_secret, markets=self.markets)
+
+    def execute_action_plan(self, submit_pending: bool = True):
+        """
+        Sends all exchange orders requested by this iteration's stages (see ExchangeActionPlan)
+        and writes their results
+        """
+        with self.positions.batch() as batch:
+            self.action_plan.execute(batch=batch, submit_pending=submit_pending)
+
+    def apply_exit_results(self):
+        """
+        Writes results of the already submitted exits (the store is updated once they are committed),
+        so entry stages don't see exited positions as active (ex.: opposite positions, sizing of new ones)
+        """
+        with self.positions.batch() as batch:
+            self.action_plan.collect_submitted(batch=batch)
+
+    # Exchange action results shared by the copy stages (on_result(status, result, batch))
+
+    def on_rebalance_partially_closed(self, status, result, batch):  # result == order
+        if not status:
+            # logger.error(f"Failed order. {result}")
+            return
+        position_table_id = result.get("position_table_id")
+        if position_table_id:
+            # original user amount - amount that was reduced
+            new_amount_user = result.get("amount_user") - result.get("amount")
+            position = {
+                "amount_user": new_amount_user,  # update amount_user of partially closed
+            }
+            batch.update_data(
+                table=self.position_table_name,
+                data=position,
+                condition_column="id",
+                condition_value=position_table_id
+            )
+
+    def on_rebalance_canceled(self, status, result, batch):
+        if not status:
+            # logger.error(f"Failed order. {result}")
+            return
+        position_table_id = result.get("position_table_id")
+        if position_table_id:
+            position = {
+                "is_canceled": 1
+            }
+            logger.debug(f"Successfully canceled (and soon will try to reopen) table position ID: {position_table_id}")
+            batch.update_data(
+                table=self.position_table_name,
+                data=position,
+                condition_column="id",
+                condition_value=position_table_id
+            )
+
+    def on_reopened(self, status, result, batch):
+        self.latency_tracker.tag_orders(orders=[(status, result)])
+        if not status:
+            logger.error(f"Failed order. {result}")
+            return
+        position_table_id = result.get("position_table_id")
+        if position_table_id:
+            position = {
+                "is_copied": 1,
+                "is_canceled": 0,
+                "position_id": result["info"]["orderId"],  # update previous position with the new position ID
+            }
+            batch.update_data(
+                table=self.position_table_name,
+                data=position,
+                condition_column="id",
+                condition_value=position_table_id
+            )
+
+    def on_opened(self, status, result, batch):
+        self.latency_tracker.tag_orders(orders=[(status, result)])
+        if not status:
+            logger.error(f"Failed order. {result}")
+            return
+        position_table_id = result.get("position_table_id")
+        if position_table_id:
+            position = {
+                "is_copied": 1,
+                "position_id": result["info"]["orderId"],
+                # TO-DO: you might also need to update user_amount
+            }
+            batch.update_data(
+                table=self.position_table_name,
+                data=position,
+                condition_column="id",
+                condition_value=position_table_id
+            )
+
     def replicate_instance(self):
         logger.debug(f"Trying to replicate an instance {self.instance_to_replicate}")
         from_instance = self.instance_to_replicate.split("_")[-1]
@@ -91,7 +249,7 @@ class Leaderboard:
         
         # get all filled orders
         all_filled_orders = {}
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
+        trader = self.get_trading_api()
         metadata = {"symbols": db_position_unique_symbols}
         filled_orders = trader.get_filled_orders_for_multi_symbols(metadata=metadata)
 
@@ -100,50 +258,51 @@ class Leaderboard:
             all_filled_orders[order_id] = order_dict
 
         # Update positions that were filled
-        for trader_id in db_positions:
-            positions = db_positions[trader_id]
-            for position in positions:
-                okx_position_id = position["okx_pos_id"]  # primary key
-                is_filled_db = position["is_filled"]
-                if not is_filled_db:
-                    is_order_filled = all_filled_orders.get(position["bin_pos_id"])
-                    if is_order_filled:
-                        position["is_filled"] = 1
-                        self.db.update_data(
-                            table=self.position_table_name,
-                            data=position,
-                            condition_column="id",
-                            condition_value=okx_position_id
-                        )
-                        logger.debug(f"Position got filled, okx_pos_id: {okx_position_id}")
+        with self.positions.batch() as batch:
+            for trader_id in db_positions:
+                positions = db_positions[trader_id]
+                for position in positions:
+                    okx_position_id = position["okx_pos_id"]  # primary key
+                    is_filled_db = position["is_filled"]
+                    if not is_filled_db:
+                        is_order_filled = all_filled_orders.get(position["bin_pos_id"])
+                        if is_order_filled:
+                            position["is_filled"] = 1
+                            batch.update_data(
+                                table=self.position_table_name,
+                                data=position,
+                                condition_column="id",
+                                condition_value=okx_position_id
+                            )
+                            logger.debug(f"Position got filled, okx_pos_id: {okx_position_id}")
 
     def update_db_positions_pnl_and_roe(self, trader_ids_w_api_positions: dict, trader_ids_w_db_positions: dict):
         logger.info("Updating PNL and ROE of matched DB -> API positions")
                
-        for db_trader_id in trader_ids_w_db_positions:
-            db_positions = trader_ids_w_db_positions[db_trader_id]
-            for db_position in db_positions:
-                okx_pos_id = db_position["okx_pos_id"]  # primary key
-
-                if db_trader_id in trader_ids_w_api_positions:
-                    api_positions = trader_ids_w_api_positions[db_trader_id]
-                    same_position_result = self.try_to_find_same_position(
-                        single_position=db_position, versus_positions=api_positions, single_position_type="db"
-                    )
-                    is_same_position = same_position_result["same_position"]
-                    # if it's the same position, then we need to update PNL and ROE of matched position
-                    if is_same_position:
-                        api_position = same_position_result["position"]
-                        position = {
-                            "pnl": api_position["pnl"],
-                            "roe": api_position["roe"],
-                        }
-                        self.db.update_data(
-                            table=self.position_table_name,
-                            data=position,
-                            condition_column="id",
-                            condition_value=okx_pos_id
-                        )
+        with self.positions.batch() as batch:
+            for db_trader_id in trader_ids_w_db_positions:
+                db_positions = trader_ids_w_db_positions[db_trader_id]
+                for db_position in db_positions:
+                    okx_pos_id = db_position["okx_pos_id"]  # primary key
+
+                    if db_trader_id in trader_ids_w_api_positions:
+                        same_position_result = self.get_position_matcher(
+                            trader_ids_w_positions=trader_ids_w_api_positions
+                        ).find_same_position(single_position=db_position, single_position_type="db")
+                        is_same_position = same_position_result["same_position"]
+                        # if it's the same position, then we need to update PNL and ROE of matched position
+                        if is_same_position:
+                            api_position = same_position_result["position"]
+                            position = {
+                                "pnl": api_position["pnl"],
+                                "roe": api_position["roe"],
+                            }
+                            batch.update_data(
+                                table=self.position_table_name,
+                                data=position,
+                                condition_column="id",
+                                condition_value=okx_pos_id
+                            )
 
     def close_or_cancel_no_longer_valid_db_positions(
         self,
@@ -155,134 +314,118 @@ class Leaderboard:
         # Go over all DB positions and try to identify no longer relevant DB positions and new API positions
         db_positions_to_close = []
         db_positions_to_cancel = []
+        # (trader_id, position_table, is_win) of deactivated positions, applied at once at the end
+        success_stats_outcomes = []
         
-        for db_trader_id in trader_ids_w_db_positions:
-            db_positions = trader_ids_w_db_positions[db_trader_id]
-            for db_position in db_positions:
-                table_position_id = db_position["id"]  # primary key
-                db_position_id = db_position["position_id"]
-                is_filled = db_position["is_filled"]
-                is_canceled = db_position["is_canceled"]
-                is_closed = db_position["is_closed"]
-                db_position_roe = db_position["roe"]
-
-                # if any([is_canceled, is_closed]):
-                #     continue
+        with self.positions.batch() as batch:
+            # Applied in the batch's transaction when it's flushed (the list is complete by then, even if
+            # the loop crashes), so deactivations are never committed without their outcomes
+            batch.call(
+                lambda cursor: self.db.apply_success_stats_outcomes(outcomes=success_stats_outcomes, cursor=cursor)
+            )
+            for db_trader_id in trader_ids_w_db_positions:
+                db_positions = trader_ids_w_db_positions[db_trader_id]
+                for db_position in db_positions:
+                    table_position_id = db_position["id"]  # primary key
+                    db_position_id = db_position["position_id"]
+                    is_filled = db_position["is_filled"]
+                    is_canceled = db_position["is_canceled"]
+                    is_closed = db_position["is_closed"]
+                    db_position_roe = db_position["roe"]
+
+                    # if any([is_canceled, is_closed]):
+                    #     continue
                 
-                if db_trader_id in trader_ids_w_api_positions:
-                    api_positions = trader_ids_w_api_positions[db_trader_id]
-                    same_position_result = self.try_to_find_same_position(
-                        single_position=db_position, versus_positions=api_positions, single_position_type="db"
-                    )
-                    is_same_position = same_position_result["same_position"]
-
-                    # check if it needs to set as ignored if it's still not filled in X amount of time
-                    if is_same_position:
-                        if not is_filled:
-                            insert_timestamp = db_position["insert_timestamp"]
-                            timestamp_diff_in_s = calc_timestamp_diff_in_s(timestamp=insert_timestamp)
-                            if timestamp_diff_in_s >= MAX_TIME_TO_FILL:
-                                db_position["is_ignored"] = 1
-                                db_position["is_ignored_reason"] = "expired"
-                                if db_position_id:  # it means it was copied (but not filled)
+                    if db_trader_id in trader_ids_w_api_positions:
+                        same_position_result = self.get_position_matcher(
+                            trader_ids_w_positions=trader_ids_w_api_positions
+                        ).find_same_position(single_position=db_position, single_position_type="db")
+                        is_same_position = same_position_result["same_position"]
+
+                        # check if it needs to set as ignored if it's still not filled in X amount of time
+                        if is_same_position:
+                            if not is_filled:
+                                insert_timestamp = db_position["insert_timestamp"]
+                                timestamp_diff_in_s = calc_timestamp_diff_in_s(timestamp=insert_timestamp)
+                                if timestamp_diff_in_s >= MAX_TIME_TO_FILL:
+                                    db_position["is_ignored"] = 1
+                                    db_position["is_ignored_reason"] = "expired"
+                                    if db_position_id:  # it means it was copied (but not filled)
+                                        if not is_canceled:
+                                            db_positions_to_cancel.append(db_position)
+                        else:
+                            if is_filled:
+                                if not is_closed:
+                                    db_positions_to_close.append(db_position)
+                            else:  # not filled
+                                if db_position_id:  # we will need to cancel it
                                     if not is_canceled:
                                         db_positions_to_cancel.append(db_position)
-                    else:
-                        if is_filled:
+                                else:  # no need to cancel or close as this position wasn't even copied
+                                    position = {
+                                        "is_active": 0
+                                    }
+                                    logger.debug(f"Deactivating table position ID (x1): {table_position_id}")
+                                    batch.update_data(
+                                        table=self.position_table_name,
+                                        data=position,
+                                        condition_column="id",
+                                        condition_value=table_position_id
+                                    )
+                                
+                                    # Update innactive position success result (win or lose) for the trader
+                                    if db_position_roe != 0:
+                                        success_stats_outcomes.append((db_trader_id, self.position_table_name, db_position_roe > 0))
+
+                    else:  # The position of a trader that doesn't exist anymore inside API traders
+                        if any([is_canceled, is_closed]):
+                            position = {
+                                "is_active": 0
+                            }
+                            logger.debug(f"Deactivating table position ID (x2): {table_position_id}")
+                            batch.update_data(
+                                table=self.position_table_name,
+                                data=position,
+                                condition_column="id",
+                                condition_value=table_position_id
+                            )
+
+                            # Update innactive position success result (win or lose) for the trader
+                            if db_position_roe != 0:
+                                success_stats_outcomes.append((db_trader_id, self.position_table_name, db_position_roe > 0))
+
+                            continue
+
+                        if is_filled:  # we will need to close it
                             if not is_closed:
                                 db_positions_to_close.append(db_position)
-                        else:  # not filled
+                        else:
                             if db_position_id:  # we will need to cancel it
                                 if not is_canceled:
                                     db_positions_to_cancel.append(db_position)
-                            else:  # no need to cancel or close as this position wasn't even copied
+                            else:  # we won't need to cancel it because this position was never copied
                                 position = {
                                     "is_active": 0
                                 }
-                                logger.debug(f"Deactivating table position ID (x1): {table_position_id}")
-                                self.db.update_data(
+                                logger.debug(f"Deactivating table position ID (x3): {table_position_id}")
+                                batch.update_data(
                                     table=self.position_table_name,
                                     data=position,
                                     condition_column="id",
                                     condition_value=table_position_id
                                 )
-                                
-                                # Update innactive position success result (win or lose) for the trader
-                                if db_position_roe > 0:
-                                    self.db.insert_or_update_success_stats(
-                                        trader_id=db_trader_id,
-                                        position_table_name=self.position_table_name,
-                                        is_win=True
-                                    )
-                                elif db_position_roe < 0:
-                                    self.db.insert_or_update_success_stats(
-                                        trader_id=db_trader_id,
-                                        position_table_name=self.position_table_name,
-                                        is_win=False
-                                    )
-
-                else:  # The position of a trader that doesn't exist anymore inside API traders
-                    if any([is_canceled, is_closed]):
-                        position = {
-                            "is_active": 0
-                        }
-                        logger.debug(f"Deactivating table position ID (x2): {table_position_id}")
-                        self.db.update_data(
-                            table=self.position_table_name,
-                            data=position,
-                            condition_column="id",
-                            condition_value=table_position_id
-                        )
-
-                        # Update innactive position success result (win or lose) for the trader
-                        if db_position_roe > 0:
-                            self.db.insert_or_update_success_stats(
-                                trader_id=db_trader_id, position_table_name=self.position_table_name, is_win=True
-                            )
-                        elif db_position_roe < 0:
-                            self.db.insert_or_update_success_stats(
-                                trader_id=db_trader_id, position_table_name=self.position_table_name, is_win=False
-                            )
 
-                        continue
-
-                    if is_filled:  # we will need to close it
-                        if not is_closed:
-                            db_positions_to_close.append(db_position)
-                    else:
-                        if db_position_id:  # we will need to cancel it
-                            if not is_canceled:
-                                db_positions_to_cancel.append(db_position)
-                        else:  # we won't need to cancel it because this position was never copied
-                            position = {
-                                "is_active": 0
-                            }
-                            logger.debug(f"Deactivating table position ID (x3): {table_position_id}")
-                            self.db.update_data(
-                                table=self.position_table_name,
-                                data=position,
-                                condition_column="id",
-                                condition_value=table_position_id
-                            )
+                                # Update innactive position success result (win or lose) for the trader
+                                if db_position_roe != 0:
+                                    success_stats_outcomes.append((db_trader_id, self.position_table_name, db_position_roe > 0))
 
-                            # Update innactive position success result (win or lose) for the trader
-                            if db_position_roe > 0:
-                                self.db.insert_or_update_success_stats(
-                                    trader_id=db_trader_id, position_table_name=self.position_table_name, is_win=True
-                                )
-                            elif db_position_roe < 0:
-                                self.db.insert_or_update_success_stats(
-                                    trader_id=db_trader_id, position_table_name=self.position_table_name, is_win=False
-                                )
+        # Outcomes of canceled/closed positions are known once the exits are executed (see 'apply_exit_results')
+        exchange_success_stats_outcomes = []
 
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
-        metadata = {"orders": db_positions_to_cancel}
-        canceled_orders = trader.cancel_multi_orders_v2(metadata=metadata)
-        for canceled_order_res in canceled_orders:
-            status, result = canceled_order_res
+        def on_canceled(status, result, batch):
             if not status:
                 # logger.error(f"Failed order. {result}")
-                continue
+                return
             position_table_id = result.get("position_table_id")
             if position_table_id:
                 position = {
@@ -294,7 +437,7 @@ class Leaderboard:
                 if position["is_ignored_reason"] == "expired":  # it's just expired but still active
                     del position["is_active"]
                 logger.debug(f"Successfully canceled table position ID: {position_table_id}")
-                self.db.update_data(
+                batch.update_data(
                     table=self.position_table_name,
                     data=position,
                     condition_column="id",
@@ -305,23 +448,15 @@ class Leaderboard:
                     db_trader_id = result["trader_id"]
                     db_position_roe = result["db_position_roe"]
                     # Update innactive position success result (win or lose) for the trader
-                    if db_position_roe > 0:
-                        self.db.insert_or_update_success_stats(
-                            trader_id=db_trader_id, position_table_name=self.position_table_name, is_win=True
-                        )
-                    elif db_position_roe < 0:
-                        self.db.insert_or_update_success_stats(
-                            trader_id=db_trader_id, position_table_name=self.position_table_name, is_win=False
+                    if db_position_roe != 0:
+                        exchange_success_stats_outcomes.append(
+                            (db_trader_id, self.position_table_name, db_position_roe > 0)
                         )
 
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
-        metadata = {"orders": db_positions_to_close}
-        closed_orders = trader.close_multi_orders_v2(metadata=metadata)
-        for closed_order_res in closed_orders:
-            status, result = closed_order_res
+        def on_closed(status, result, batch):
             if not status:
                 # logger.error(f"Failed order. {result}")
-                continue
+                return
             position_table_id = result.get("position_table_id")
             if position_table_id:
                 new_amount_user = (
@@ -333,7 +468,7 @@ class Leaderboard:
                     "is_closed": 1
                 }
                 # logger.debug(f"Successfully closed table position ID: {position_table_id}")
-                self.db.update_data(
+                batch.update_data(
                     table=self.position_table_name,
                     data=position,
                     condition_column="id",
@@ -343,15 +478,27 @@ class Leaderboard:
                 db_trader_id = result["trader_id"]
                 db_position_roe = result["db_position_roe"]
                 # Update innactive position success result (win or lose) for the trader
-                if db_position_roe > 0:
-                    self.db.insert_or_update_success_stats(
-                        trader_id=db_trader_id, position_table_name=self.position_table_name, is_win=True
-                    )
-                elif db_position_roe < 0:
-                    self.db.insert_or_update_success_stats(
-                        trader_id=db_trader_id, position_table_name=self.position_table_name, is_win=False
+                if db_position_roe != 0:
+                    exchange_success_stats_outcomes.append(
+                        (db_trader_id, self.position_table_name, db_position_roe > 0)
                     )
 
+        for db_position in db_positions_to_cancel:
+            self.action_plan.add(
+                action="cancel", order=db_position, position_key=db_position["id"], on_result=on_canceled
+            )
+        for db_position in db_positions_to_close:
+            self.action_plan.add(
+                action="close", order=db_position, position_key=db_position["id"], on_result=on_closed
+            )
+        self.action_plan.after_execute(
+            lambda batch: batch.call(
+                lambda cursor: self.db.apply_success_stats_outcomes(
+                    outcomes=exchange_success_stats_outcomes, cursor=cursor
+                )
+            )
+        )
+
     def insert_new_api_positions(
         self,
         trader_ids_w_api_positions: dict,
@@ -368,11 +515,9 @@ class Leaderboard:
             for api_position in api_positions:
                 api_position_trader_id = api_position["trader_id"]
                 if api_position_trader_id in trader_ids_w_db_positions:
-                    same_position_result = self.try_to_find_same_position(
-                        single_position=api_position,
-                        versus_positions=trader_ids_w_db_positions[api_position_trader_id],
-                        single_position_type="api"
-                    )
+                    same_position_result = self.get_position_matcher(
+                        trader_ids_w_positions=trader_ids_w_db_positions
+                    ).find_same_position(single_position=api_position, single_position_type="api")
                     is_same_position = same_position_result["same_position"]
                     if is_same_position:
                         continue
@@ -390,7 +535,7 @@ class Leaderboard:
         if not [pos for api_trader_id in api_positions_to_insert for pos in api_positions_to_insert[api_trader_id]]:
             return True
 
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
+        trader = self.get_trading_api()
 
         all_traders_stats = self.db.get_all_traders_success_stats(position_table_name=self.position_table_name)
 
@@ -461,6 +606,11 @@ class Leaderboard:
                     dict_i["amount_user"] = None
 
         unique_trader_ids = list(set([trader_id for trader_id in api_positions_to_insert]))
+        # Loaded once per stage (not per position)
+        self.trader_cache.refresh()
+        trader_ids_w_roi = self.trader_cache.get_trader_ids_with_roi(trader_ids=unique_trader_ids)
+        kc_stats = self.db.get_all_traders_kc_stats(kc_stats_table_name=self.kc_stats_table_name)
+        traders_trades_counts = self.db.get_all_traders_trades_counts(top_x_table_name=self.position_table_name)
         # Insert new API positions but set as still not copied
         for api_trader_id in api_positions_to_insert:
             api_positions = api_positions_to_insert[api_trader_id]
@@ -477,20 +627,17 @@ class Leaderboard:
                     #     api_position["is_ignored_reason"] = "negative win-lose count" # uncomment later
 
                     if not api_position["is_ignored"]:  # if the position is still not ignored - check ROIs
-                        trader_ids_w_roi = self.db.fetch_trader_ids_with_roi(trader_ids=unique_trader_ids)  # FIX
                         if trader_ids_w_roi.get(api_position['trader_id']) is None:
                             logger.warning(f"Missing ROIs data of trader ID: {api_position['trader_id']}")
                             continue
 
-                        kc_stats = self.db.get_all_traders_kc_stats(kc_stats_table_name=self.kc_stats_table_name)
-                        
                         roi_data_dict = trader_ids_w_roi.get(api_position['trader_id'])
                         daily_roi = roi_data_dict["daily_roi"]
                         weekly_roi = roi_data_dict["weekly_roi"]
                         monthly_roi = roi_data_dict["monthly_roi"]
                         total_roi = roi_data_dict["total_roi"]
 
-                        trader_type = self.db.detect_trader_type(trader_id=api_position['trader_id'])
+                        trader_type = self.trader_cache.get_trader_type(trader_id=api_position['trader_id'])
 
                         if IGNORE_OBSERVED_TRADERS and trader_type == "observed":
                             api_position["is_ignored"] = 1
@@ -528,9 +675,6 @@ class Leaderboard:
                                 api_position["is_ignored_reason"] = "negative total ROI"
                         
                         if not api_position["is_ignored"]:  # if the position is still not ignored - check trades count
-                            traders_trades_counts = self.db.get_all_traders_trades_counts(
-                                top_x_table_name=self.position_table_name
-                            )
                             min_trades_count = 30
                             if traders_trades_counts.get(api_trader_id, 0) < min_trades_count:
                                 api_position["is_ignored"] = 1
@@ -556,95 +700,30 @@ class Leaderboard:
                 except mysql.connector.IntegrityError as e:
                     logger.warning(e)
 
+        # New positions get their default values (is_active, inserted_on, ...) from DB
+        self.positions.invalidate()
+
     def ignore_and_or_close_or_cancel_opposite_and_same_positions(self):
         logger.info("Ignoring and/or canceling or closing opposite, same symbol DB positions.")
 
-        trader_ids_w_db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)
-        unique_trader_ids = list(set([trader_id for trader_id in trader_ids_w_db_positions]))
+        trader_ids_w_db_positions = self.positions.get_active_positions()
+        unique_trader_ids = list(trader_ids_w_db_positions)
 
-        trader_ids_w_roi = self.db.fetch_trader_ids_with_roi(trader_ids=unique_trader_ids)
+        self.trader_cache.refresh()
+        trader_ids_w_roi = self.trader_cache.get_trader_ids_with_roi(trader_ids=unique_trader_ids)
 
         # Find opposite positions and decide which ones should be ignored
         logger.info("Searching for opposite positions")
 
         all_traders_stats = self.db.get_all_traders_success_stats(position_table_name=self.position_table_name)
-        
-        db_positions_w_same_symbols_to_ignore_ids = []  # used to set appropriate ingore reason
-        db_positions_to_ignore_because_of_hedged_status = []  # used to set appropriate ingore reason
-        db_positions_to_ignore_because_of_lower_win_lose_res = []  # used to set appropriate ingore reason
-        db_positions_to_ignore_because_of_lower_roi = []  # used to set appropriate ingore reason
 
-        db_positions_to_ignore_and_cancel_or_close_ids = []  # position table IDs - ignored and canceled or closed
-        db_positions_flattened = [
-            position
-            for trader_id in trader_ids_w_db_positions
-            for position in trader_ids_w_db_positions[trader_id]
-        ]
-        for current_idx, current_pos in enumerate(db_positions_flattened):
-            current_pos_table_id = current_pos["id"]
-            current_pos_trader_id = current_pos["trader_id"]
-            current_pos_is_ignored = current_pos["is_ignored"]
-            current_pos_symbol, current_pos_side = current_pos["symbol"], current_pos["side"]
-            current_pos_symbol_w_side = f"{current_pos_symbol}_{current_pos_side}"
-
-            if current_idx < (len(db_positions_flattened) - 1):  # if not the last position
-                for next_idx, next_pos in enumerate(db_positions_flattened[current_idx + 1:]):
-                    next_pos_table_id = next_pos["id"]
-                    next_pos_trader_id = next_pos["trader_id"]
-                    next_pos_is_ignored = next_pos["is_ignored"]
-                    next_pos_symbol = next_pos["symbol"]
-                    next_pos_symbol_w_side = f"{next_pos_symbol}_{next_pos['side']}"
-                    next_pos_opposite_side = "buy" if next_pos["side"] == "sell" else "sell"
-                    next_pos_symbol_w_opposite_side = (
-                        f"{next_pos_symbol}_{next_pos_opposite_side}"
-                    )   # flip the side to find out if this is an opposite position
-
-                    # if the curent/next position is ignored - we don't need to compare as it doesn't matter
-                    if current_pos_is_ignored or next_pos_is_ignored:
-                        continue
-                    if current_pos_symbol_w_side == next_pos_symbol_w_opposite_side:  # found opposite position
-                        if current_pos_trader_id == next_pos_trader_id:  # hedged positions?
-                            logger.debug(f"Detected hedged position. {current_pos_table_id}, {next_pos_table_id}")
-                            current_pos_update_timestamp = current_pos["update_timestamp"]
-                            next_pos_update_timestamp = next_pos["update_timestamp"]
-                            # logic for ignoring the earlier position (not the latest)
-                            if next_pos_update_timestamp >= current_pos_update_timestamp:
-                                db_positions_to_ignore_and_cancel_or_close_ids.append(current_pos_table_id)
-                                db_positions_to_ignore_because_of_hedged_status.append(current_pos_table_id)
-                            else:
-                                db_positions_to_ignore_and_cancel_or_close_ids.append(next_pos_table_id)
-                                db_positions_to_ignore_because_of_hedged_status.append(next_pos_table_id)
-
-                        current_pos_trader_win_lose_res = all_traders_stats[current_pos_trader_id]["win_lose_count_res"]
-                        next_pos_trader_win_lose_res = all_traders_stats[next_pos_trader_id]["win_lose_count_res"]
-
-                        if current_pos_trader_win_lose_res != next_pos_trader_win_lose_res:
-                            compare_by = "win_lose_res"
-                        else:
-                            compare_by = "roi"
-
-                        if compare_by == "win_lose_res":  # comparing by win lose res
-                            if current_pos_trader_win_lose_res > next_pos_trader_win_lose_res:
-                                db_positions_to_ignore_and_cancel_or_close_ids.append(next_pos_table_id)
-                                db_positions_to_ignore_because_of_lower_win_lose_res.append(next_pos_table_id)
-                            else:
-                                db_positions_to_ignore_and_cancel_or_close_ids.append(current_pos_table_id)
-                                db_positions_to_ignore_because_of_lower_win_lose_res.append(current_pos_table_id)
-                        else:  # comparing by total ROI
-                            if (
-                                trader_ids_w_roi[current_pos['trader_id']]['total_roi']
-                                > trader_ids_w_roi[next_pos['trader_id']]['total_roi']
-                            ):
-                                db_positions_to_ignore_and_cancel_or_close_ids.append(next_pos_table_id)
-                                db_positions_to_ignore_because_of_lower_roi.append(next_pos_table_id)
-                            else:  # next position total ROI is better
-                                db_positions_to_ignore_and_cancel_or_close_ids.append(current_pos_table_id)
-                                db_positions_to_ignore_because_of_lower_roi.append(current_pos_table_id)
-
-                    elif current_pos_symbol_w_side == next_pos_symbol_w_side:  # found same symbol and side position
-                        # we leave the first position as active and ignore the next position 
-                        db_positions_to_ignore_and_cancel_or_close_ids.append(next_pos_table_id)
-                        db_positions_w_same_symbols_to_ignore_ids.append(next_pos_table_id)
+        conflict_resolver = PositionConflictResolver(
+            trader_ids_w_positions=trader_ids_w_db_positions,
+            all_traders_stats=all_traders_stats,
+            trader_ids_w_roi=trader_ids_w_roi,
+        )
+        conflict_resolver.resolve()
+        db_positions_to_ignore_and_cancel_or_close_ids = conflict_resolver.get_ignored_ids()  # position table IDs
 
         # ignore and cancel/close opposite positions
         opposite_positions_to_cancel = []
@@ -662,33 +741,13 @@ class Leaderboard:
                 if current_pos_table_id in db_positions_to_ignore_and_cancel_or_close_ids:
                     current_pos["is_ignored"] = 1
                     if not current_pos_is_copied:
-                        position = None
-                        if current_pos_table_id in db_positions_w_same_symbols_to_ignore_ids:
-                            position = {
-                                "is_ignored": 1,
-                                "is_ignored_reason": 'same symbol and side',
-                            }
-                        elif current_pos_table_id in db_positions_to_ignore_because_of_hedged_status:
-                            position = {
-                                "is_ignored": 1,
-                                "is_ignored_reason": "hedged",
-                            }
-                        elif current_pos_table_id in db_positions_to_ignore_because_of_lower_roi:
-                            # it means this is recently received API position that needs to be ignored
-                            position = {
-                                "is_ignored": 1,
-                                "is_ignored_reason": "lower roi",
-                            }
-                        elif current_pos_table_id in db_positions_to_ignore_because_of_lower_win_lose_res:
-                            # it means this is recently received API position that needs to be ignored
+                        is_ignored_reason = conflict_resolver.get_ignore_reason(current_pos_table_id)
+                        if is_ignored_reason is not None:
                             position = {
                                 "is_ignored": 1,
-                                "is_ignored_reason": "lower win lose res",
+                                "is_ignored_reason": is_ignored_reason,
                             }
-
-                        if position is not None:
-                            self.db.update_data(
-                                table=self.position_table_name,
+                            self.positions.update_data(
                                 data=position,
                                 condition_column="id",
                                 condition_value=current_pos_table_id
@@ -702,58 +761,32 @@ class Leaderboard:
                         if not current_pos_is_canceled:
                             opposite_positions_to_cancel.append(current_pos)
 
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
-        metadata = {"orders": opposite_positions_to_cancel}
-        canceled_orders = trader.cancel_multi_orders_v2(metadata=metadata)
-        for canceled_order_res in canceled_orders:
-            status, result = canceled_order_res
+        def on_canceled(status, result, batch):
             if not status:
                 # logger.error(f"Failed order. {result}")
-                continue
+                return
             position_table_id = result.get("position_table_id")
             if position_table_id:
-                if position_table_id in db_positions_w_same_symbols_to_ignore_ids:
-                    is_ignored_reason = "same symbol and side"
-                elif position_table_id in db_positions_to_ignore_because_of_hedged_status:
-                    is_ignored_reason = "hedged"
-                elif position_table_id in db_positions_to_ignore_because_of_lower_roi:
-                    is_ignored_reason = "lower roi"
-                elif position_table_id in db_positions_to_ignore_because_of_lower_win_lose_res:
-                    is_ignored_reason = "lower win lose res"
-                else:
-                    is_ignored_reason = "unknown"
+                is_ignored_reason = conflict_resolver.get_ignore_reason(position_table_id) or "unknown"
                 position = {
                     "is_ignored": 1,
                     "is_ignored_reason": is_ignored_reason,
                     "is_canceled": 1
                 }
-                self.db.update_data(
+                batch.update_data(
                     table=self.position_table_name,
                     data=position,
                     condition_column="id",
                     condition_value=position_table_id
                 )
 
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
-        metadata = {"orders": opposite_positions_to_close}
-        closed_orders = trader.close_multi_orders_v2(metadata=metadata)
-        for closed_order_res in closed_orders:
-            status, result = closed_order_res
+        def on_closed(status, result, batch):
             if not status:
                 # logger.error(f"Failed order. {result}")
-                continue
+                return
             position_table_id = result.get("position_table_id")
             if position_table_id:
-                if position_table_id in db_positions_w_same_symbols_to_ignore_ids:
-                    is_ignored_reason = "same symbol and side"
-                elif position_table_id in db_positions_to_ignore_because_of_hedged_status:
-                    is_ignored_reason = "hedged"
-                elif position_table_id in db_positions_to_ignore_because_of_lower_roi:
-                    is_ignored_reason = "lower roi"
-                elif position_table_id in db_positions_to_ignore_because_of_lower_win_lose_res:
-                    is_ignored_reason = "lower win lose res"
-                else:
-                    is_ignored_reason = "unknown"
+                is_ignored_reason = conflict_resolver.get_ignore_reason(position_table_id) or "unknown"
             
                 new_amount_user = (
                     float(result.get("amount_user")) - float(result.get("amount"))
@@ -764,77 +797,81 @@ class Leaderboard:
                     "amount_user": new_amount_user,
                     "is_closed": 1
                 }
-                self.db.update_data(
+                batch.update_data(
                     table=self.position_table_name,
                     data=position,
                     condition_column="id",
                     condition_value=position_table_id
                 )
 
+        for current_pos in opposite_positions_to_cancel:
+            self.action_plan.add(
+                action="cancel", order=current_pos, position_key=current_pos["id"], on_result=on_canceled
+            )
+        for current_pos in opposite_positions_to_close:
+            self.action_plan.add(
+                action="close", order=current_pos, position_key=current_pos["id"], on_result=on_closed
+            )
+
     def update_db_positions_amounts(self, trader_ids_w_db_positions: dict, trader_ids_w_api_positions: dict):
         # update previous DB positions (if they are not ignored)
         logger.info("Partially closing DB positions")
         db_positions_to_partially_close = []
 
-        for db_trader_id in trader_ids_w_db_positions:
-            db_positions = trader_ids_w_db_positions[db_trader_id]
-            for db_position in db_positions:
-                table_position_id = db_position["id"]  # primary key
-                is_filled = db_position["is_filled"]
-                is_ignored = db_position["is_ignored"]
-                api_positions = (
-                    trader_ids_w_api_positions[db_trader_id]
-                    if trader_ids_w_api_positions.get(db_trader_id)
-                    else []
-                )   # position_temp might not have any records for the trader_id that exists inside position_top_x table
-                same_position_result = self.try_to_find_same_position(
-                    single_position=db_position,
-                    versus_positions=api_positions,
-                    single_position_type="db"
-                )
-                is_same_position = same_position_result["same_position"]
-                is_need_to_update_amount = same_position_result["need_to_update_amount"]
-                api_position = same_position_result["position"]
-                if is_same_position:
-                    if is_need_to_update_amount:
-                        current_pos_amount = db_position["amount"]  # ex.: 100
-                        api_position_amount = api_position["amount"]  # ex.: 60 
-                        amount_diff_ratio = api_position_amount / current_pos_amount  # ex.: 60 / 100 = 0.6
-
-                        new_amount_user = db_position["amount_user"] * amount_diff_ratio
-                        quantity_to_close = db_position["amount_user"] - new_amount_user
-
-                        db_position["amount"] = api_position_amount
-                        db_position["quantity_to_close"] = quantity_to_close
+        with self.positions.batch() as batch:
+            for db_trader_id in trader_ids_w_db_positions:
+                db_positions = trader_ids_w_db_positions[db_trader_id]
+                for db_position in db_positions:
+                    table_position_id = db_position["id"]  # primary key
+                    is_filled = db_position["is_filled"]
+                    is_ignored = db_position["is_ignored"]
+                    # position_temp might not have any records for the trader_id that exists inside position_top_x table
+                    same_position_result = self.get_position_matcher(
+                        trader_ids_w_positions=trader_ids_w_api_positions
+                    ).find_same_position(single_position=db_position, single_position_type="db")
+                    is_same_position = same_position_result["same_position"]
+                    is_need_to_update_amount = same_position_result["need_to_update_amount"]
+                    api_position = same_position_result["position"]
+                    if is_same_position:
+                        if is_need_to_update_amount:
+                            current_pos_amount = db_position["amount"]  # ex.: 100
+                            api_position_amount = api_position["amount"]  # ex.: 60 
+                            amount_diff_ratio = api_position_amount / current_pos_amount  # ex.: 60 / 100 = 0.6
+
+                            new_amount_user = db_position["amount_user"] * amount_diff_ratio
+                            quantity_to_close = db_position["amount_user"] - new_amount_user
+
+                            db_position["amount"] = api_position_amount
+                            db_position["quantity_to_close"] = quantity_to_close
                         
-                        if not is_ignored and is_filled:
-                            db_positions_to_partially_close.append(db_position)
-
-                        # data = {
-                        #     "amount": api_position["amount"],
-                        #     "update_timestamp": api_position["update_timestamp"]
-                        # }
-                        # self.db.update_data(
-                        #     table="position",
-                        #     data=data,
-                        #     condition_column="id",
-                        #     condition_value=table_position_id
-                        # )
-                    else:
-                        # trader probably increased his position but we won't
-                        if db_position["amount"] < api_position["amount"]:
-                            data = {"amount": api_position["amount"]}
-                            self.db.update_data(
-                                table=self.position_table_name,
-                                data=data,
-                                condition_column="id",
-                                condition_value=table_position_id
-                            )
+                            if not is_ignored and is_filled:
+                                db_positions_to_partially_close.append(db_position)
+
+                            # data = {
+                            #     "amount": api_position["amount"],
+                            #     "update_timestamp": api_position["update_timestamp"]
+                            # }
+                            # batch.update_data(
+                            #     table="position",
+                            #     data=data,
+                            #     condition_column="id",
+                            #     condition_value=table_position_id
+                            # )
+                        else:
+                            # trader probably increased his position but we won't
+                            if db_position["amount"] < api_position["amount"]:
+                                data = {"amount": api_position["amount"]}
+                                batch.update_data(
+                                    table=self.position_table_name,
+                                    data=data,
+                                    condition_column="id",
+                                    condition_value=table_position_id
+                                )
         
         if not db_positions_to_partially_close:
             return True
 
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
+        trader = self.get_trading_api()
 
         # Round quantity_to_close by symbol precisions
         unique_symbols = list(set([i["symbol"] for i in db_positions_to_partially_close]))
@@ -857,13 +894,10 @@ class Leaderboard:
             else:
                 logger.warning(f"Missing min_qty, step_size of {pos_symbol} symbol")
 
-        metadata = {"orders": db_positions_to_partially_close}
-        partialy_closed_orders = trader.partially_close_multi_orders_v2(metadata=metadata)
-        for partially_closed_order_res in partialy_closed_orders:
-            status, result = partially_closed_order_res  # result == order
+        def on_partially_closed(status, result, batch):  # result == order
             if not status:
                 # logger.error(f"Failed order. {result}")
-                continue
+                return
             position_table_id = result.get("position_table_id")
             if position_table_id:
                 new_amount_user = (
@@ -874,19 +908,24 @@ class Leaderboard:
                     "amount": result.get("amount_original"),
                     "amount_user": new_amount_user,  # update amount_user of partially closed
                 }
-                self.db.update_data(
+                batch.update_data(
                     table=self.position_table_name,
                     data=position,
                     condition_column="id",
                     condition_value=position_table_id
                 )
+
+        for dict_i in db_positions_to_partially_close:
+            self.action_plan.add(
+                action="partially_close", order=dict_i, position_key=dict_i["id"], on_result=on_partially_closed
+            )
     
     def copy_new_positions(self):
         logger.info("Copying new API positions")
 
         # check all DB positions thats still not copied (basically open positions for API positions that were inserted)
         positions_to_open = []
-        db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)
+        db_positions = self.positions.get_active_positions()
         for trader_id in db_positions:
             for current_pos in db_positions[trader_id]:
                 current_pos_is_ignored = current_pos["is_ignored"]
@@ -899,7 +938,7 @@ class Leaderboard:
         if not positions_to_open:
             return True
 
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
+        trader = self.get_trading_api()
 
         metadata = {
             "allocation_of_total_balance": ALLOCATION_OF_TOTAL_BALANCE_PERC,
@@ -939,8 +978,7 @@ class Leaderboard:
                     "is_ignored_reason": "expired",
                 }
                 logger.debug(f"Ignoring position ID ({current_pos_table_id}) because of MAX_TIME_TO_FILL.")
-                self.db.update_data(
-                    table=self.position_table_name,
+                self.positions.update_data(
                     data=position,
                     condition_column="id",
                     condition_value=current_pos_table_id
@@ -963,8 +1001,7 @@ class Leaderboard:
                     "is_ignored_reason": "insufficient funds",
                 }
                 logger.debug(f"Ignoring position ID ({current_pos_table_id}) because of insufficient funds.")
-                self.db.update_data(
-                    table=self.position_table_name,
+                self.positions.update_data(
                     data=position,
                     condition_column="id",
                     condition_value=current_pos_table_id
@@ -973,31 +1010,12 @@ class Leaderboard:
 
         positions_to_open = [pos for idx, pos in enumerate(positions_to_open) if idx not in ignore_pos_idxs]
 
-        metadata = {"orders": positions_to_open}
-        opened_orders = trader.open_multi_orders(metadata=metadata)
-        for opened_order_res in opened_orders:
-            status, result = opened_order_res
-            if not status:
-                logger.error(f"Failed order. {result}")
-                continue
-            position_table_id = result.get("position_table_id")
-            if position_table_id:
-                position = {
-                    "is_copied": 1,
-                    "position_id": result["info"]["orderId"],
-                    # TO-DO: you might also need to update user_amount
-                }
-                self.db.update_data(
-                    table=self.position_table_name,
-                    data=position,
-                    condition_column="id",
-                    condition_value=position_table_id
-                )
-                # logger.success(f"Successfully placed limit order. Position table ID: {position_table_id}")
+        for pos in positions_to_open:
+            self.action_plan.add(action="open", order=pos, position_key=pos["id"], on_result=self.on_opened)
 
     def find_largest_kc_trader_id(self) -> Union[str, None]:
         possible_positions_to_open = []
-        db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)
+        db_positions = self.positions.get_active_positions()
         for trader_id in db_positions:
             for current_pos in db_positions[trader_id]:
                 current_pos_is_ignored = current_pos["is_ignored"]
@@ -1020,7 +1038,7 @@ class Leaderboard:
     
     def find_largest_tc_trader_id(self) -> Union[str, None]:
         possible_positions_to_open = []
-        db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)
+        db_positions = self.positions.get_active_positions()
         for trader_id in db_positions:
             for current_pos in db_positions[trader_id]:
                 current_pos_is_ignored = current_pos["is_ignored"]
@@ -1043,7 +1061,7 @@ class Leaderboard:
 
     def find_currently_copied_trader_id(self):
         currently_copied_traders = []
-        db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)
+        db_positions = self.positions.get_active_positions()
         for trader_id in db_positions:
             for current_pos in db_positions[trader_id]:
                 current_pos_is_copied = current_pos["is_copied"]
@@ -1066,29 +1084,30 @@ class Leaderboard:
                 return False
             
     def ignore_all_traders_except_these(self, except_trader_ids: list):
-        db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)
-        for trader_id in db_positions:
-            if trader_id in except_trader_ids:
-                continue
-            for current_pos in db_positions[trader_id]:
-                table_position_id = current_pos["id"]  # primary key
-                current_pos_is_ignored = current_pos["is_ignored"]
-                if not current_pos_is_ignored:
-                    logger.debug(f"Ignoring trader ID's {trader_id} position table ID {table_position_id}")
-                    data = {"is_ignored": 1, "is_ignored_reason": "lower kc"}
-                    self.db.update_data(
-                        table=self.position_table_name,
-                        data=data,
-                        condition_column="id",
-                        condition_value=table_position_id
-                    )
+        db_positions = self.positions.get_active_positions()
+        with self.positions.batch() as batch:
+            for trader_id in db_positions:
+                if trader_id in except_trader_ids:
+                    continue
+                for current_pos in db_positions[trader_id]:
+                    table_position_id = current_pos["id"]  # primary key
+                    current_pos_is_ignored = current_pos["is_ignored"]
+                    if not current_pos_is_ignored:
+                        logger.debug(f"Ignoring trader ID's {trader_id} position table ID {table_position_id}")
+                        data = {"is_ignored": 1, "is_ignored_reason": "lower kc"}
+                        batch.update_data(
+                            table=self.position_table_name,
+                            data=data,
+                            condition_column="id",
+                            condition_value=table_position_id
+                        )
 
     def close_cancel_ignore_trader_id(self, trader_id: str):
         db_positions_to_close = []
         db_positions_to_cancel = []
         db_positions_to_ignore = []
 
-        db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)
+        db_positions = self.positions.get_active_positions()
         for current_pos in db_positions[trader_id]:
             current_pos_id = current_pos["position_id"]
             current_pos_is_filled = current_pos["is_filled"]
@@ -1103,14 +1122,10 @@ class Leaderboard:
             else:
                 db_positions_to_ignore.append(current_pos)
 
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
-        metadata = {"orders": db_positions_to_cancel}
-        canceled_orders = trader.cancel_multi_orders_v2(metadata=metadata)
-        for canceled_order_res in canceled_orders:
-            status, result = canceled_order_res
+        def on_canceled(status, result, batch):
             if not status:
                 # logger.error(f"Failed order. {result}")
-                continue
+                return
             position_table_id = result.get("position_table_id")
             if position_table_id:
                 position = {
@@ -1119,21 +1134,17 @@ class Leaderboard:
                     "is_canceled": 1
                 }
                 logger.debug(f"Successfully canceled table position ID: {position_table_id}")
-                self.db.update_data(
-                    table=self.position_table_name, 
+                batch.update_data(
+                    table=self.position_table_name,
                     data=position, 
                     condition_column="id", 
                     condition_value=position_table_id
                 )
 
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
-        metadata = {"orders": db_positions_to_close}
-        closed_orders = trader.close_multi_orders_v2(metadata=metadata)
-        for closed_order_res in closed_orders:
-            status, result = closed_order_res
+        def on_closed(status, result, batch):
             if not status:
                 # logger.error(f"Failed order. {result}")
-                continue
+                return
             position_table_id = result.get("position_table_id")
             if position_table_id:
                 new_amount_user = (
@@ -1146,29 +1157,54 @@ class Leaderboard:
                     "is_closed": 1
                 }
                 # logger.debug(f"Successfully closed table position ID: {position_table_id}")
-                self.db.update_data(
-                    table=self.position_table_name, 
+                batch.update_data(
+                    table=self.position_table_name,
                     data=position, 
                     condition_column="id", 
                     condition_value=position_table_id
                 )
 
+        for pos in db_positions_to_cancel:
+            self.action_plan.add(action="cancel", order=pos, position_key=pos["id"], on_result=on_canceled)
+        for pos in db_positions_to_close:
+            self.action_plan.add(action="close", order=pos, position_key=pos["id"], on_result=on_closed)
+
         for position in db_positions_to_ignore:
             position_table_id = position["id"]
-            self.db.update_data(
-                table=self.position_table_name,
+            self.positions.update_data(
                 data=position,
                 condition_column="id",
                 condition_value=position_table_id
             )
 
-    def copy_trader_id(self, trader_id: str):
-        kc_stats = self.db.get_all_traders_kc_stats(kc_stats_table_name=self.kc_stats_table_name)
+    async def read_copy_inputs(self, symbols: list):
+        """
+        Inputs of 'copy_trader_id' - DB reads and exchange requests run concurrently
+        Returns: (KC stats, penalties, balance availability, last prices, min. quantities and step sizes)
+        """
+        # allocate balance that will be used (100 KC = 100% of total balance)
+        metadata = {
+            "allocation_of_total_balance": ALLOCATION_OF_TOTAL_BALANCE_PERC,
+            "allocation_per_single_position": ALLOCATION_PER_SINGLE_POSITION_PERC,
+        }
+        # Every exchange request needs its own TradingAPI (the exchange session is kept as an attribute)
+        return await asyncio.gather(
+            self.async_db.get_all_traders_kc_stats(kc_stats_table_name=self.kc_stats_table_name),
+            self.async_db.get_all_traders_penalties(top_x_table_name=self.position_table_name),
+            self.get_trading_api().fetch_api_urls(bound_task="calc_balance_availability", metadata=metadata),
+            self.get_trading_api().fetch_api_urls(
+                bound_task="get_last_prices_for_symbols", metadata={"symbols": symbols}
+            ),
+            self.get_trading_api().fetch_api_urls(
+                bound_task="get_min_qty_and_step_size_for_symbols", metadata={"symbols": symbols}
+            ),
+        )
 
+    def copy_trader_id(self, trader_id: str):
         already_existing_positions = []
         positions_to_open = []
 
-        db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)
+        db_positions = self.positions.get_active_positions()
         for current_pos in db_positions[trader_id]:
             current_pos_is_canceled = current_pos["is_canceled"]
             current_pos_is_closed = current_pos["is_closed"]
@@ -1187,19 +1223,19 @@ class Leaderboard:
             logger.debug("No positions to open.")
             return True
 
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
-
-        metadata = {
-            "allocation_of_total_balance": ALLOCATION_OF_TOTAL_BALANCE_PERC,
-            "allocation_per_single_position": ALLOCATION_PER_SINGLE_POSITION_PERC,
-        }
-        res = trader.calc_balance_availability(metadata=metadata)
+        unique_symbols = list(set([i["symbol"] for i in positions_to_open + already_existing_positions]))
+        loop = asyncio.get_event_loop()
+        kc_stats, penalties, res, last_prices_res, min_qty_and_step_sizes = loop.run_until_complete(
+            self.read_copy_inputs(symbols=unique_symbols)
+        )
         status, result = res[0]
         if not status:
             logger.error(result)
             return None
-        
-        penalties = self.db.get_all_traders_penalties(top_x_table_name=self.position_table_name)
+
+        # {"BTCUSDT": 26157, "BNBUSDT": 258, ...} (same as TradingAPI.get_last_prices_for_symbols)
+        last_prices = {i[1]["symbol"]: i[1]["last_price"] for i in last_prices_res if i[0] is True}
+
         penalty_value = penalties.get(trader_id)
 
         trader_kc_val = kc_stats[trader_id] if kc_stats[trader_id] <= 1 else 1
@@ -1216,192 +1252,74 @@ class Leaderboard:
         #     )
         #     return None
 
-        usdt_per_single_position = (
-                balance_to_use_for_trading_in_usdt_kc // (len(positions_to_open) + len(already_existing_positions))
+        # Target sizes of all positions (rebalancing and new ones) in a single pass
+        # (the balance is already the trader's KC share, it's split equally between the trader's positions)
+        allocation_engine = AllocationEngine(
+            balance_in_usdt=balance_to_use_for_trading_in_usdt_kc,
+            trader_kcs={trader_id: 1},
+            trader_positions_counts={trader_id: len(positions_to_open) + len(already_existing_positions)},
+            last_prices=last_prices,
+            min_qty_and_step_sizes=min_qty_and_step_sizes,
         )
-
-        unique_symbols = list(set([i["symbol"] for i in positions_to_open + already_existing_positions]))
-        metadata = {
-            "symbols": unique_symbols
-        }
-
-        last_prices = trader.get_last_prices_for_symbols(metadata=metadata)  # {"BTCUSDT": 26157, "BNBUSDT": 258, ...}
-        min_qty_and_step_sizes = trader.get_min_qty_and_step_size_for_symbols(metadata=metadata)
+        allocation_plan = allocation_engine.plan(
+            positions_to_open=positions_to_open, already_existing_positions=already_existing_positions
+        )
+        positions_by_id = {pos["id"]: pos for pos in positions_to_open + already_existing_positions}
 
         # Rebalancing existing positions
 
         # then it means we need to rebalance (cancel and reopen or/and partially close existing positions)
-        if already_existing_positions and positions_to_open:
+        if allocation_plan["partially_close"] or allocation_plan["cancel_and_reopen"]:
             db_positions_to_cancel_and_reopen = []
             db_positions_to_partially_close = []
-            for pos in already_existing_positions:
-                pos_symbol = pos["symbol"]
-                pos_is_filled = pos["is_filled"]
-                if pos_is_filled:
-                    pos_value_in_usdt = (pos["amount_user"] * last_prices[pos["symbol"]]) / pos["leverage"]
-                    usdt_value_to_close = pos_value_in_usdt - usdt_per_single_position
-                    if usdt_value_to_close > 0:
-                        pos["quantity_to_close"] = (usdt_value_to_close * pos["leverage"]) / last_prices[pos["symbol"]]
-                        step_size = min_qty_and_step_sizes[pos_symbol]["step_size"]
-                        quantity_to_close = pos["quantity_to_close"]
-                        quantity_to_close_fixed = math.floor(quantity_to_close / step_size) * step_size
-                        if quantity_to_close_fixed > pos["amount_user"]:
-                            quantity_to_close_fixed = pos["amount_user"]
-                        pos["quantity_to_close"] = quantity_to_close_fixed
-                        db_positions_to_partially_close.append(pos)
-
-                else:  # not filled
-
-                    # using old price because psition is still not filled and get original usdt value of the position
-                    pos_value_in_usdt = pos["amount_user"] * pos["entry_price"]
-
-                    # then we need to close the current position and open with a lower amount
-                    if pos_value_in_usdt > usdt_per_single_position:
-                        pos_symbol = pos["symbol"]
-                        amount_user = usdt_per_single_position / pos["entry_price"]
-                        min_qty = min_qty_and_step_sizes[pos_symbol]["min_qty"]
-                        step_size = min_qty_and_step_sizes[pos_symbol]["step_size"]
-                        amount_user_fixed = convert_amount(
-                            user_amount=amount_user,
-                            min_qty=min_qty,
-                            step_size=step_size,
-                            entry_price=pos["entry_price"]
-                        )
-                        pos["amount_user"] = amount_user_fixed
-                        db_positions_to_cancel_and_reopen.append(pos)
-            
-            # Partially closing positions ### HERE
-            metadata = {"orders": db_positions_to_partially_close}
-            logger.warning("XXX TESTING")  # Remove later
-            for pos in db_positions_to_partially_close:  # Remove later
-                logger.debug(f"This position will be partially closed: {pos}")  # Remove later
-            logger.warning("XXX TESTING")  # Remove later
-            partialy_closed_orders = trader.partially_close_multi_orders_v2(metadata=metadata)
-            for partially_closed_order_res in partialy_closed_orders:
-                status, result = partially_closed_order_res  # result == order
-                if not status:
-                    # logger.error(f"Failed order. {result}")
-                    continue
-                position_table_id = result.get("position_table_id")
-                if position_table_id:
-                    # original user amount - amount that was reduced
-                    new_amount_user = result.get("amount_user") - result.get("amount")
-
-                    position = {
-                        "amount_user": new_amount_user,  # update amount_user of partially closed
-                    }
-                    self.db.update_data(
-                        table=self.position_table_name,
-                        data=position,
-                        condition_column="id",
-                        condition_value=position_table_id
-                    )
+            for action in allocation_plan["partially_close"]:
+                pos = positions_by_id[action["id"]]
+                pos["quantity_to_close"] = action["quantity_to_close"]
+                db_positions_to_partially_close.append(pos)
+            for action in allocation_plan["cancel_and_reopen"]:
+                pos = positions_by_id[action["id"]]
+                pos["amount_user"] = action["amount_user"]
+                db_positions_to_cancel_and_reopen.append(pos)
+
+            # Partially closing positions
+            for pos in db_positions_to_partially_close:
+                self.action_plan.add(
+                    action="partially_close",
+                    order=pos,
+                    position_key=pos["id"],
+                    on_result=self.on_rebalance_partially_closed
+                )
 
             # Canceling still not filled positions and reopening again with adjusted quantity
-            metadata = {"orders": db_positions_to_cancel_and_reopen}
-            canceled_orders = trader.cancel_multi_orders_v2(metadata=metadata)
-            for canceled_order_res in canceled_orders:
-                status, result = canceled_order_res
-                if not status:
-                    # logger.error(f"Failed order. {result}")
-                    continue
-                position_table_id = result.get("position_table_id")
-                if position_table_id:
-                    position = {
-                        "is_canceled": 1
-                    }
-                    logger.debug(
-                        f"Successfully canceled (and soon will try to reopen) table position ID: {position_table_id}"
-                    )
-                    self.db.update_data(
-                        table=self.position_table_name,
-                        data=position,
-                        condition_column="id",
-                        condition_value=position_table_id
-                    )
-            
-            # After canceling still not filled positions - we try to reopen it with adjusted quantity
-            metadata = {"orders": db_positions_to_cancel_and_reopen}
-            opened_orders = trader.open_multi_orders(metadata=metadata)
-            for opened_order_res in opened_orders:
-                status, result = opened_order_res
-                if not status:
-                    logger.error(f"Failed order. {result}")
-                    continue
-                position_table_id = result.get("position_table_id")
-                if position_table_id:
-                    position = {
-                        "is_copied": 1,
-                        "is_canceled": 0,
-                        "position_id": result["info"]["orderId"],  # update previous position with the new position ID
-                    }
-                    self.db.update_data(
-                        table=self.position_table_name,
-                        data=position,
-                        condition_column="id",
-                        condition_value=position_table_id
-                    )
-        
-        # Opening new positions
-        if positions_to_open:
-            # update entry prices
-            for dict_i in positions_to_open:
-                dict_i["entry_price"] = (
-                    last_prices[dict_i["symbol"]]
-                    if last_prices.get(dict_i["symbol"])
-                    else dict_i["entry_price"]
+            # (the plan sends all cancels before opens)
+            for pos in db_positions_to_cancel_and_reopen:
+                self.action_plan.add(
+                    action="cancel", order=pos, position_key=pos["id"], on_result=self.on_rebalance_canceled
                 )
+                self.action_plan.add(action="open", order=pos, position_key=pos["id"], on_result=self.on_reopened)
 
-            # update amount_user
-            for dict_i in positions_to_open:
-                position_table_id = dict_i["id"]
-                if min_qty_and_step_sizes:
-                    pos_symbol = dict_i["symbol"]
-                    amount_user = (usdt_per_single_position / dict_i["entry_price"]) * dict_i["leverage"]
-                    min_qty = min_qty_and_step_sizes[pos_symbol]["min_qty"]
-                    step_size = min_qty_and_step_sizes[pos_symbol]["step_size"]
-                    amount_user_fixed = convert_amount(
-                        user_amount=amount_user,
-                        min_qty=min_qty,
-                        step_size=step_size,
-                        entry_price=dict_i["entry_price"]
-                    )
-                else:
-                    amount_user_fixed = (usdt_per_single_position / dict_i["entry_price"]) * dict_i["leverage"]
-                dict_i["amount_user"] = amount_user_fixed
-                self.db.update_data(
-                    table=self.position_table_name,
+
+        # Opening new positions
+        if positions_to_open:
+            # update entry prices and amount_user
+            for action in allocation_plan["open"]:
+                dict_i = positions_by_id[action["id"]]
+                dict_i["entry_price"] = action["entry_price"]
+                dict_i["amount_user"] = action["amount_user"]
+                self.positions.update_data(
                     data=dict_i,
                     condition_column="id",
-                    condition_value=position_table_id
+                    condition_value=action["id"]
                 )
-                
-            metadata = {"orders": positions_to_open}
-            opened_orders = trader.open_multi_orders(metadata=metadata)
-            for opened_order_res in opened_orders:
-                status, result = opened_order_res
-                if not status:
-                    logger.error(f"Failed order. {result}")
-                    continue
-                position_table_id = result.get("position_table_id")
-                if position_table_id:
-                    position = {
-                        "is_copied": 1,
-                        "position_id": result["info"]["orderId"],
-                        # TO-DO: you might also need to update user_amount
-                    }
-                    self.db.update_data(
-                        table=self.position_table_name,
-                        data=position,
-                        condition_column="id",
-                        condition_value=position_table_id
-                    )
+
+            for pos in positions_to_open:
+                self.action_plan.add(action="open", order=pos, position_key=pos["id"], on_result=self.on_opened)
 
     def update_liquidation_prices(self):  
         logger.debug("Updating liquidation prices")
 
         symbols = []
-        all_db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)
+        all_db_positions = self.positions.get_active_positions()
         for db_trader_id in all_db_positions:
             db_positions = all_db_positions[db_trader_id]
             for db_position in db_positions:
@@ -1410,7 +1328,7 @@ class Leaderboard:
                     symbols.append(db_position["inst_id"].split("-")[0])
 
         symbols = list(set(symbols))
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
+        trader = self.get_trading_api()
 
         metadata = {"symbols": symbols}
         res = trader.get_liquidation_prices(metadata=metadata)
@@ -1419,37 +1337,38 @@ class Leaderboard:
             logger.error(result)
             return None
         
-        for db_trader_id in all_db_positions:
-            db_positions = all_db_positions[db_trader_id]
-            for db_position in db_positions:
-                okx_pos_table_id = db_position["okx_pos_id"]
-                bin_pos_id = db_position["bin_pos_id"]
-                symbol = db_position["inst_id"].split("-")[0]
-                is_filled = db_position["is_filled"]
-                pos_liquidation_price = db_position["user_liquidation_price"]
-                if not is_filled:
-                    continue
-                current_liquidation_price = result.get(symbol)
-                if pos_liquidation_price == current_liquidation_price:  # then no need to update
-                    continue
-                logger.debug(
-                    f"Updating liquidation price for position ID: {bin_pos_id}. "
-                    f"From: {pos_liquidation_price}, "
-                    f"to: {current_liquidation_price}"
-                )
-                data_to_update = {"user_liquidation_price": current_liquidation_price}
-                self.db.update_data(
-                    table=self.position_table_name,
-                    data=data_to_update,
-                    condition_column="okx_pos_id",
-                    condition_value=okx_pos_table_id
-                )
+        with self.positions.batch() as batch:
+            for db_trader_id in all_db_positions:
+                db_positions = all_db_positions[db_trader_id]
+                for db_position in db_positions:
+                    okx_pos_table_id = db_position["okx_pos_id"]
+                    bin_pos_id = db_position["bin_pos_id"]
+                    symbol = db_position["inst_id"].split("-")[0]
+                    is_filled = db_position["is_filled"]
+                    pos_liquidation_price = db_position["user_liquidation_price"]
+                    if not is_filled:
+                        continue
+                    current_liquidation_price = result.get(symbol)
+                    if pos_liquidation_price == current_liquidation_price:  # then no need to update
+                        continue
+                    logger.debug(
+                        f"Updating liquidation price for position ID: {bin_pos_id}. "
+                        f"From: {pos_liquidation_price}, "
+                        f"to: {current_liquidation_price}"
+                    )
+                    data_to_update = {"user_liquidation_price": current_liquidation_price}
+                    batch.update_data(
+                        table=self.position_table_name,
+                        data=data_to_update,
+                        condition_column="okx_pos_id",
+                        condition_value=okx_pos_table_id
+                    )
 
     def insert_or_update_stop_losses(self):  
         logger.debug("Inserting/updating stop losses")
 
         positions_that_needs_sl = {}
-        all_db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)
+        all_db_positions = self.positions.get_active_positions()
         for db_trader_id in all_db_positions:
             db_positions = all_db_positions[db_trader_id]
             for db_position in db_positions:
@@ -1471,24 +1390,27 @@ class Leaderboard:
                 sls_to_cancel.append(stop_loss_pos)
 
         # cancel all stop-losses that are not relevant anymore
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
-        metadata = {"positions": sls_to_cancel}
-        canceled_sls = trader.cancel_sls(metadata=metadata)
-
-        for canceled_sl_res in canceled_sls:
-            status, result = canceled_sl_res
+        def on_irrelevant_sl_canceled(status, result, batch):
             if not status:
-                continue
+                return
             if result.get("status") == "canceled" or result.get("status") == "OrderNotFound":
                 sl_table_id = result.get("sl_table_id")
                 position = {
                     "is_active": 0,
                 }
-                self.db.update_data(
+                batch.update_data(
                     table="stop_losses", data=position, condition_column="id", condition_value=sl_table_id
                 )
                 logger.debug(f"Successfully canceled (not relevant anymore) stop-loss ID: {sl_table_id}")
 
+        for stop_loss_pos in sls_to_cancel:
+            self.action_plan.add(
+                action="cancel_sl",
+                order=stop_loss_pos,
+                position_key=("sl", stop_loss_pos["id"]),
+                on_result=on_irrelevant_sl_canceled
+            )
+
         # retrieve all active SL positions
 
         # REMOVE LATER
@@ -1543,29 +1465,32 @@ class Leaderboard:
                 sls_pos_to_open.append(position)
         
         # cancel all stop-losses that needs to be updated (reopened)
-        metadata = {"positions": sls_to_cancel}
-        canceled_sls = trader.cancel_sls(metadata=metadata)
-        for canceled_sl_res in canceled_sls:
-            status, result = canceled_sl_res
+        def on_sl_canceled(status, result, batch):
             if not status:
-                continue
+                return
             sl_table_id = result.get("sl_table_id")
             if sl_table_id:
                 position = {
                     "is_active": 0,
                 }
-                self.db.update_data(
+                batch.update_data(
                     table="stop_losses", data=position, condition_column="id", condition_value=sl_table_id
                 )
                 logger.debug(f"Successfully canceled stop-loss ID: {sl_table_id}")
 
+        for stop_loss_pos in sls_to_cancel:
+            self.action_plan.add(
+                action="cancel_sl",
+                order=stop_loss_pos,
+                position_key=("sl", stop_loss_pos["id"]),
+                on_result=on_sl_canceled
+            )
+
         # reopen (update) previously canceled (or innactive) stop-losses
-        metadata = {"positions": sls_pos_to_update, "sl_ratio": SL_RATIO}
-        created_sls = trader.create_sls(metadata=metadata)
-        for created_sl_res in created_sls:
-            status, result = created_sl_res
+        # (the plan creates stop-losses after all cancels, unless the position itself is closed in the meantime)
+        def on_sl_reopened(status, result, batch):
             if not status:
-                continue
+                return
             orig_position_id = result.get("orig_position_id")
             if orig_position_id:  # then it means we need to update existing stop-loss
                 sl_position = {
@@ -1577,18 +1502,24 @@ class Leaderboard:
                     "price": result["stopPrice"],
                 }
                 sl_table_id = all_active_pos_stop_losses[orig_position_id]["id"]
-                self.db.update_data(
+                batch.update_data(
                     table="stop_losses", data=sl_position, condition_column="id", condition_value=sl_table_id
                 )
                 logger.debug(f"Successfully created (reopened) stop-loss ID: {sl_table_id}")
+
+        for position in sls_pos_to_update:
+            self.action_plan.add(
+                action="create_sl",
+                order=position,
+                position_key=position["id"],
+                on_result=on_sl_reopened,
+                metadata={"sl_ratio": SL_RATIO}
+            )
         
         # insert new stop-losses
-        metadata = {"positions": sls_pos_to_open, "sl_ratio": SL_RATIO}
-        created_sls = trader.create_sls(metadata=metadata)
-        for created_sl_res in created_sls:
-            status, result = created_sl_res
+        def on_sl_created(status, result, batch):
             if not status:
-                continue
+                return
             orig_position_id = result.get("orig_position_id")
             if orig_position_id:  # then it means we need to insert a new stop-loss
                 sl_position = {
@@ -1601,9 +1532,17 @@ class Leaderboard:
                     "price": result["stopPrice"],
                     "amount": result["amount"],
                 }
-                sl_table_id = self.db.insert_data(table="stop_losses", data=sl_position)
-                if sl_table_id:
-                    logger.debug(f"Successfully created a new stop-loss ID: {sl_table_id}")
+                batch.insert_data(table="stop_losses", data=sl_position)
+                logger.debug(f"Successfully created a new stop-loss of position ID: {orig_position_id}")
+
+        for position in sls_pos_to_open:
+            self.action_plan.add(
+                action="create_sl",
+                order=position,
+                position_key=position["id"],
+                on_result=on_sl_created,
+                metadata={"sl_ratio": SL_RATIO}
+            )
 
     def check_and_update_filled_sls(self):  
         logger.debug("Checking if any stop-losses got triggered")
@@ -1614,7 +1553,7 @@ class Leaderboard:
         sls_ids = [all_active_pos_stop_losses[orig_pos_id]["position_id"] for orig_pos_id in all_active_pos_stop_losses]
 
         metadata = {"symbols": symbols, "sls_ids": sls_ids}
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
+        trader = self.get_trading_api()
         triggered_sls_ids = trader.get_triggered_sls_for_multi_symbols(metadata=metadata)
 
         for sl_pos_id in triggered_sls_ids:
@@ -1639,8 +1578,7 @@ class Leaderboard:
                 "is_closed": 1,
                 "amount_user": 0 
             }
-            self.db.update_data(
-                table=self.position_table_name,
+            self.positions.update_data(
                 data=trading_position,
                 condition_column="bin_pos_id",
                 condition_value=bin_pos_id
@@ -1670,7 +1608,7 @@ class Leaderboard:
         ]
 
         metadata = {"symbols": symbols, "tps_ids": tps_ids}
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
+        trader = self.get_trading_api()
         triggered_tps_ids = trader.get_triggered_tps_for_multi_symbols(metadata=metadata)
 
         for tp_pos_id in triggered_tps_ids:
@@ -1696,8 +1634,7 @@ class Leaderboard:
                 "is_closed": 1,
                 "amount_user": 0 
             }
-            self.db.update_data(
-                table=self.position_table_name,
+            self.positions.update_data(
                 data=trading_position,
                 condition_column="bin_pos_id",
                 condition_value=bin_pos_id
@@ -1707,7 +1644,7 @@ class Leaderboard:
         logger.debug("Inserting/updating take profits")
 
         positions_that_needs_tp = {}
-        all_db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)
+        all_db_positions = self.positions.get_active_positions()
         for db_trader_id in all_db_positions:
             db_positions = all_db_positions[db_trader_id]
             for db_position in db_positions:
@@ -1728,24 +1665,27 @@ class Leaderboard:
                 tps_to_cancel.append(take_profit_pos)
 
         # cancel all take-profits that are not relevant anymore
-        trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
-        metadata = {"positions": tps_to_cancel}
-        canceled_tps = trader.cancel_tps(metadata=metadata)
-
-        for canceled_tp_res in canceled_tps:
-            status, result = canceled_tp_res
+        def on_irrelevant_tp_canceled(status, result, batch):
             if not status:
-                continue
+                return
             if result.get("status") == "canceled" or result.get("status") == "OrderNotFound":
                 tp_table_id = result.get("tp_table_id")
                 position = {
                     "is_active": 0,
                 }
-                self.db.update_data(
+                batch.update_data(
                     table="take_profits", data=position, condition_column="id", condition_value=tp_table_id
                 )
                 logger.debug(f"Successfully canceled (not relevant anymore) take-profit ID: {tp_table_id}")
 
+        for take_profit_pos in tps_to_cancel:
+            self.action_plan.add(
+                action="cancel_tp",
+                order=take_profit_pos,
+                position_key=("tp", take_profit_pos["id"]),
+                on_result=on_irrelevant_tp_canceled
+            )
+
         # retrieve all active TP positions
         all_active_take_profits = self.db.get_all_active_take_profits(position_table=self.position_table_name)
         
@@ -1793,29 +1733,32 @@ class Leaderboard:
                 tps_pos_to_open.append(position)
         
         # cancel all take-profits that needs to be updated (reopened)
-        metadata = {"positions": tps_to_cancel}
-        canceled_tps = trader.cancel_tps(metadata=metadata)
-        for canceled_tp_res in canceled_tps:
-            status, result = canceled_tp_res
+        def on_tp_canceled(status, result, batch):
             if not status:
-                continue
+                return
             tp_table_id = result.get("tp_table_id")
             if tp_table_id:
                 position = {
                     "is_active": 0,
                 }
-                self.db.update_data(
+                batch.update_data(
                     table="take_profits", data=position, condition_column="id", condition_value=tp_table_id
                 )
                 logger.debug(f"Successfully canceled take-profit ID: {tp_table_id}")
 
+        for take_profit_pos in tps_to_cancel:
+            self.action_plan.add(
+                action="cancel_tp",
+                order=take_profit_pos,
+                position_key=("tp", take_profit_pos["id"]),
+                on_result=on_tp_canceled
+            )
+
         # reopen (update) previously canceled take-profits
-        metadata = {"positions": tps_pos_to_update}
-        created_tps = trader.create_tps(metadata=metadata)
-        for created_tp_res in created_tps:
-            status, result = created_tp_res
+        # (the plan creates take-profits after all cancels, unless the position itself is closed in the meantime)
+        def on_tp_reopened(status, result, batch):
             if not status:
-                continue
+                return
             orig_position_id = result.get("orig_position_id")
             if orig_position_id:  # then it means we need to update existing take-profit
                 tp_position = {
@@ -1827,18 +1770,20 @@ class Leaderboard:
                     "price": result["stopPrice"],
                 }
                 tp_table_id = all_active_take_profits[orig_position_id]["id"]
-                self.db.update_data(
+                batch.update_data(
                     table="take_profits", data=tp_position, condition_column="id", condition_value=tp_table_id
                 )
                 logger.debug(f"Successfully created (reopened) take-profit ID: {tp_table_id}")
+
+        for position in tps_pos_to_update:
+            self.action_plan.add(
+                action="create_tp", order=position, position_key=position["id"], on_result=on_tp_reopened
+            )
         
         # insert new take-profits
-        metadata = {"positions": tps_pos_to_open}
-        created_tps = trader.create_tps(metadata=metadata)
-        for created_tp_res in created_tps:
-            status, result = created_tp_res
+        def on_tp_created(status, result, batch):
             if not status:
-                continue
+                return
             orig_position_id = result.get("orig_position_id")
             if orig_position_id:  # then it means we need to insert a new take-profit
                 tp_position = {
@@ -1851,364 +1796,26 @@ class Leaderboard:
                     "price": result["stopPrice"],
                     "amount": result["amount"],
                 }
-                tp_table_id = self.db.insert_data(table="take_profits", data=tp_position)
-                if tp_table_id:
-                    logger.debug(f"Successfully created a new take-profit ID: {tp_table_id}")
-    
-    def try_to_find_same_position(self, single_position: dict, versus_positions: list, single_position_type: str):
-        valid_single_position_types = ["api", "db"]
-        if single_position_type not in valid_single_position_types:
-            raise Exception(f"Invalid single_position_type: {single_position_type}")
-        
-        result = {
-            "same_position": False,
-            "need_to_update_amount": False,
-            "position": None,
-        }
+                batch.insert_data(table="take_profits", data=tp_position)
+                logger.debug(f"Successfully created a new take-profit of position ID: {orig_position_id}")
 
-        for versus_position in versus_positions:
-            # get API position data
-            single_position_trader_id = single_position["trader_id"]
-            single_position_symbol = single_position["symbol"]
-            single_position_side = single_position["side"]
-            single_position_leverage = single_position["leverage"]
-            single_position_entry_price = single_position["entry_price"]
-            single_position_amount = single_position["amount"]
-            single_position_update_timestamp = single_position["update_timestamp"]
-            # get DB position date
-            versus_position_trader_id = versus_position["trader_id"]
-            versus_position_symbol = versus_position["symbol"]
-            versus_position_side = versus_position["side"]
-            versus_position_leverage = versus_position["leverage"]
-            versus_position_entry_price = versus_position["entry_price"]
-            versus_position_amount = versus_position["amount"]
-            versus_position_update_timestamp = versus_position["update_timestamp"]
-
-            if single_position_type == "api":
-                amount_comparing_logic = single_position_amount < versus_position_amount
-            else:  # db
-                amount_comparing_logic = single_position_amount > versus_position_amount
-
-            if (
-                single_position_trader_id == versus_position_trader_id
-                and single_position_symbol == versus_position_symbol
-                and single_position_side == versus_position_side
-                # and single_position_leverage == versus_position_leverage # leverage can be changed
-                and single_position_entry_price == versus_position_entry_price
-                and amount_comparing_logic
-            ):  # It means the trader partially closed his position
-                result["same_position"] = True
-                result["need_to_update_amount"] = True  # decrese quantity
-                result["position"] = versus_position
-                return result
-            elif (
-                single_position_trader_id == versus_position_trader_id
-                and single_position_symbol == versus_position_symbol
-                and single_position_side == versus_position_side
-                # and single_position_leverage == versus_position_leverage # leverage can be changed
-                and single_position_entry_price == versus_position_entry_price
-                and single_position_amount == versus_position_amount
-                and single_position_update_timestamp == versus_position_update_timestamp
-            ):  # It means nothing has happened
-                result["same_position"] = True
-                result["position"] = versus_position
-                return result
-            elif (
-                single_position_trader_id == versus_position_trader_id
-                and single_position_symbol == versus_position_symbol
-                and single_position_side == versus_position_side
-                and single_position_leverage == versus_position_leverage
-                # and single_position_entry_price != versus_position_entry_price # different entry price
-
-                # different amount (probably the trader increased his position)
-                # and single_position_amount != versus_position_amount
-                # and single_position_update_timestamp != versus_position_update_timestamp # different entry price
-            ):  # Something has happened but we asume it's the same position
-                result["same_position"] = True
-                result["position"] = versus_position
-                return result
-            elif (
-                single_position_trader_id == versus_position_trader_id
-                and single_position_symbol == versus_position_symbol
-                and single_position_side == versus_position_side
-                # and single_position_leverage == versus_position_leverage
-                # and single_position_entry_price != versus_position_entry_price # different entry price
-
-                # different amount (probably the trader increased his position)
-                # and single_position_amount != versus_position_amount
-                and single_position_update_timestamp == versus_position_update_timestamp
-            ):  # Something has happened but we asume it's the same position
-                result["same_position"] = True
-                result["position"] = versus_position
-                return result
-        
-        # not the same position
-        return result
-    
-    def handle_copy_multi_trader_positions(self):
-        if self.should_copy_positions:
-            # get all traders you might be start copying
-            trader_ids_that_will_be_copied = self.db.fetch_active_non_ignored_trader_ids_to_copy(
-                table=self.position_table_name
+        for position in tps_pos_to_open:
+            self.action_plan.add(
+                action="create_tp", order=position, position_key=position["id"], on_result=on_tp_created
             )
-
-            # calculate total kelly criteria for those traders
-            total_kc = self.db.calculate_total_kc(
-                top_x_table_name=self.position_table_name, trader_ids=trader_ids_that_will_be_copied
+    
+    def get_position_matcher(self, trader_ids_w_positions: dict):
+        """
+        Returns PositionMatcher of 'trader_ids_w_positions' (built once per iteration for the same positions dict)
+        """
+        matcher_key = id(trader_ids_w_positions)
+        if matcher_key not in self.position_matchers:
+            # The positions dict is kept so its ID can't be reused by another object during the iteration
+            self.position_matchers[matcher_key] = (
+                trader_ids_w_positions, PositionMatcher(trader_ids_w_positions=trader_ids_w_positions)
             )
-            total_kc = total_kc if total_kc <= 1 else 1
-
-            # allocate balance that will be used (100 KC = 100% of total balance)
-            trader = TradingAPI(api_key=binance_api_key, api_secret=binance_api_secret)
-            metadata = {
-                "allocation_of_total_balance": ALLOCATION_OF_TOTAL_BALANCE_PERC,
-                "allocation_per_single_position": ALLOCATION_PER_SINGLE_POSITION_PERC,
-            }
-            res = trader.calc_balance_availability(metadata=metadata)
-            status, result = res[0]
-            if not status:
-                logger.error(result)
-                return None
-            
-            balance_to_use_for_trading_in_usdt_kc = int(result["balance_to_use_for_trading_in_usdt"] * float(total_kc))
-
-            # get every traders' (which we will be copying) KC
-            kc_stats = self.db.get_all_traders_kc_stats(kc_stats_table_name=self.kc_stats_table_name)
-            # kc_stats = {trader_id: kc_val if kc_val <= 1 else 1 for trader_id, kc_val in kc_stats.items()}
-
-            # allocate balance by every trader KC value
-            # (if the sum of all traders' KC value exceeds the total KC - use proportions)
-            all_traders_kc_sum = sum([kc_stats[trader_id] for trader_id in trader_ids_that_will_be_copied])
-            weighted_allocation = False
-            if all_traders_kc_sum > 1:
-                weighted_allocation = True
-
-            for trader_id in trader_ids_that_will_be_copied:
-                trader_kc_val = kc_stats[trader_id]
-                if weighted_allocation:
-                    logger.debug("Using weighted balance allocation")
-                    trader_weighted_kc_val = trader_kc_val / all_traders_kc_sum
-                    kc_stats[trader_id] = trader_weighted_kc_val
-
-            # divide individual KCs by positions counts
-            db_positions = self.db.fetch_active_non_ignored_positions(table=self.position_table_name)  # FIX THAT
-
-            already_existing_positions = []
-            positions_to_open = []
-
-            for current_pos in db_positions[trader_id]:
-                current_pos_is_canceled = current_pos["is_canceled"]
-                current_pos_is_closed = current_pos["is_closed"]
-                current_pos_id = current_pos["position_id"]
-                current_pos_is_ignored = current_pos["is_ignored"]
-
-                # it means this position is still not copied and not ignored
-                if not current_pos_id and not current_pos_is_ignored:
-                    positions_to_open.append(current_pos)
+        return self.position_matchers[matcher_key][1]
 
-                # it means this position is already copied
-                elif current_pos_id and not current_pos_is_canceled and not current_pos_is_closed:
-                    already_existing_positions.append(current_pos)
-
-            unique_symbols = list(set([i["symbol"] for i in positions_to_open + already_existing_positions]))
-            metadata = {
-                "symbols": unique_symbols
-            }
-
-            # {"BTCUSDT": 26157, "BNBUSDT": 258, ...}
-            last_prices = trader.get_last_prices_for_symbols(metadata=metadata)
-
-            min_qty_and_step_sizes = trader.get_min_qty_and_step_size_for_symbols(metadata=metadata)
-
-            # Rebalancing existing positions
-
-            # then it means we need to rebalance (cancel and reopen or/and partially close existing positions)
-            if already_existing_positions and positions_to_open:
-                db_positions_to_cancel_and_reopen = []
-                db_positions_to_partially_close = []
-                for pos in already_existing_positions:
-                    trader_id = pos["trader_id"]
-                    trader_kc_val = kc_stats[trader_id]
-                    pos_symbol = pos["symbol"]
-                    pos_is_filled = pos["is_filled"]
-                    if pos_is_filled:
-                        pos_count_of_a_trader = len(db_positions[trader_id])
-                        max_pos_value_in_usdt = (
-                            balance_to_use_for_trading_in_usdt_kc * (trader_kc_val / pos_count_of_a_trader)
-                        )
-                        current_pos_value_in_usdt = (pos["amount_user"] * last_prices[pos["symbol"]]) / pos["leverage"]
-                        usdt_value_to_close = current_pos_value_in_usdt - max_pos_value_in_usdt
-                        if usdt_value_to_close > 0:
-                            pos["quantity_to_close"] = (
-                                (usdt_value_to_close * pos["leverage"]) / last_prices[pos["symbol"]]
-                            )
-                            step_size = min_qty_and_step_sizes[pos_symbol]["step_size"]
-                            quantity_to_close = pos["quantity_to_close"]
-                            quantity_to_close_fixed = math.floor(quantity_to_close / step_size) * step_size
-                            if quantity_to_close_fixed > pos["amount_user"]:
-                                quantity_to_close_fixed = pos["amount_user"]
-                            pos["quantity_to_close"] = quantity_to_close_fixed
-                            db_positions_to_partially_close.append(pos)
-                    else:  # not filled
-                        max_pos_value_in_usdt = balance_to_use_for_trading_in_usdt_kc * trader_kc_val
-
-                        # using old price because position is not filled and get original usdt value of the position
-                        pos_value_in_usdt = pos["amount_user"] * pos["entry_price"]
-
-                        # then we need to close the current position and open with a lower amount
-                        if pos_value_in_usdt > max_pos_value_in_usdt:
-                            pos_symbol = pos["symbol"]
-                            amount_user = max_pos_value_in_usdt / pos["entry_price"]
-                            min_qty = min_qty_and_step_sizes[pos_symbol]["min_qty"]
-                            step_size = min_qty_and_step_sizes[pos_symbol]["step_size"]
-                            amount_user_fixed = convert_amount(
-                                user_amount=amount_user,
-                                min_qty=min_qty,
-                                step_size=step_size,
-                                entry_price=pos["entry_price"]
-                            )
-                            pos["amount_user"] = amount_user_fixed
-                            db_positions_to_cancel_and_reopen.append(pos)
-                
-                # Partially closing positions ### HERE
-                metadata = {"orders": db_positions_to_partially_close}
-                logger.warning("XXX TESTING")  # Remove later
-                for pos in db_positions_to_partially_close:  # Remove later
-                    logger.debug(f"This position will be partially closed: {pos}")  # Remove later
-                logger.warning("XXX TESTING")  # Remove later
-                partialy_closed_orders = trader.partially_close_multi_orders_v2(metadata=metadata)
-                for partially_closed_order_res in partialy_closed_orders:
-                    status, result = partially_closed_order_res  # result == order
-                    if not status:
-                        # logger.error(f"Failed order. {result}")
-                        continue
-                    position_table_id = result.get("position_table_id")
-                    if position_table_id:
-                        # original user amount - amount that was reduced
-                        new_amount_user = result.get("amount_user") - result.get("amount")
-
-                        position = {
-                            "amount_user": new_amount_user,  # update amount_user of partially closed
-                        }
-                        self.db.update_data(
-                            table=self.position_table_name,
-                            data=position,
-                            condition_column="id",
-                            condition_value=position_table_id
-                        )
-
-                # Canceling still not filled positions and reopening again with adjusted quantity
-                metadata = {"orders": db_positions_to_cancel_and_reopen}
-                canceled_orders = trader.cancel_multi_orders_v2(metadata=metadata)
-                for canceled_order_res in canceled_orders:
-                    status, result = canceled_order_res
-                    if not status:
-                        # logger.error(f"Failed order. {result}")
-                        continue
-                    position_table_id = result.get("position_table_id")
-                    if position_table_id:
-                        position = {
-                            "is_canceled": 1
-                        }
-                        logger.debug(
-                            f"Successfully canceled (and soon will try to reopen) table position ID: "
-                            f"{position_table_id}"
-                        )
-                        self.db.update_data(
-                            table=self.position_table_name,
-                            data=position,
-                            condition_column="id",
-                            condition_value=position_table_id
-                        )
-                
-                # After canceling still not filled positions - we try to reopen it with adjusted quantity
-                metadata = {"orders": db_positions_to_cancel_and_reopen}
-                opened_orders = trader.open_multi_orders(metadata=metadata)
-                for opened_order_res in opened_orders:
-                    status, result = opened_order_res
-                    if not status:
-                        logger.error(f"Failed order. {result}")
-                        continue
-                    position_table_id = result.get("position_table_id")
-                    if position_table_id:
-                        position = {
-                            "is_copied": 1,
-                            "is_canceled": 0,
-
-                            # update previous position with the new position ID
-                            "position_id": result["info"]["orderId"],
-                        }
-                        self.db.update_data(
-                            table=self.position_table_name,
-                            data=position,
-                            condition_column="id",
-                            condition_value=position_table_id
-                        )
-
-            # Opening new positions
-            if positions_to_open:
-                # update entry prices
-                for dict_i in positions_to_open:
-                    dict_i["entry_price"] = (
-                        last_prices[dict_i["symbol"]]
-                        if last_prices.get(dict_i["symbol"])
-                        else dict_i["entry_price"]
-                    )
-
-                # update amount_user
-                for dict_i in positions_to_open:
-                    trader_id = dict_i["trader_id"]
-                    trader_kc_val = kc_stats[trader_id]
-                    position_table_id = dict_i["id"]
-                    pos_count_of_a_trader = len(db_positions[trader_id])
-                    max_pos_value_in_usdt = (
-                            balance_to_use_for_trading_in_usdt_kc * (trader_kc_val / pos_count_of_a_trader)
-                    )
-                    if min_qty_and_step_sizes:
-                        pos_symbol = dict_i["symbol"]
-                        amount_user = (max_pos_value_in_usdt / dict_i["entry_price"]) * dict_i["leverage"]
-                        min_qty = min_qty_and_step_sizes[pos_symbol]["min_qty"]
-                        step_size = min_qty_and_step_sizes[pos_symbol]["step_size"]
-                        amount_user_fixed = convert_amount(
-                            user_amount=amount_user,
-                            min_qty=min_qty,
-                            step_size=step_size,
-                            entry_price=dict_i["entry_price"]
-                        )
-                    else:
-                        amount_user_fixed = (max_pos_value_in_usdt / dict_i["entry_price"]) * dict_i["leverage"]
-                    dict_i["amount_user"] = amount_user_fixed
-                    self.db.update_data(
-                        table=self.position_table_name,
-                        data=dict_i,
-                        condition_column="id",
-                        condition_value=position_table_id
-                    )
-                    
-                metadata = {"orders": positions_to_open}
-                opened_orders = trader.open_multi_orders(metadata=metadata)
-                for opened_order_res in opened_orders:
-                    status, result = opened_order_res
-                    if not status:
-                        logger.error(f"Failed order. {result}")
-                        continue
-                    position_table_id = result.get("position_table_id")
-                    if position_table_id:
-                        position = {
-                            "is_copied": 1,
-                            "position_id": result["info"]["orderId"],
-                            # TO-DO: you might also need to update user_amount
-                        }
-                        self.db.update_data(
-                            table=self.position_table_name,
-                            data=position,
-                            condition_column="id",
-                            condition_value=position_table_id
-                        )
-
-            # partially close positions if a new position needs to be opened
-            # if a new trader appears - you might need to partially close multiple positions of multiple traders
-    
     def handle_copy_positions(self):
         if self.should_copy_positions:
             if COPY_TRADER_BY == "TC":  # TC = 'trades_count'
@@ -2270,64 +1877,228 @@ class Leaderboard:
                         else:
                             self.copy_trader_id(trader_id=currenty_copied_trader_id)
 
+    def run_once(self, api_positions: dict = None, first_time_run: bool = False):
+        """
+        A single iteration of all stages
+        'api_positions' can be passed if they were already read from 'position_temp' (ex.: by the orchestrator)
+        """
+        # Publishes config.yml if it has changed (subscribers, ex.: 'apply_config', are called)
+        get_config_service().refresh()
+
+        # Active positions are read once per iteration and kept up to date by every stage
+        self.positions.load()
+        # The iteration thread's connection isn't kept while the stages (worker threads) borrow theirs
+        self.db.close()
+        self.position_matchers = {}
+        # Stages only request exchange orders, they are reconciled and sent by 'execute_action_plan'
+        # (exits of positions the lead traders have exited are submitted as soon as they are known)
+        self.action_plan = ExchangeActionPlan(trading_api_factory=self.get_trading_api, lane=self.action_lane)
+        try:
+            try:
+                self.run_stages(api_positions=api_positions, first_time_run=first_time_run)
+            except Exception:
+                # Submitted exits might already be executed on Binance - their results still have to be written
+                self.execute_action_plan(submit_pending=False)
+                raise
+            self.execute_action_plan()
+
+            self.latency_tracker.flush()
+        finally:
+            self.db.close()
+
+    def read_api_positions(self):
+        api_positions = self.db.get_temp_positions_from_db(ignore_observed_traders=IGNORE_OBSERVED_TRADERS)
+        return {"api_positions": api_positions}
+
+    def close_or_cancel_exited_positions(self, api_positions: dict):
+        self.latency_tracker.tag(
+            stage="leaderboard_pickup",
+            positions=[pos for trader_id in api_positions for pos in api_positions[trader_id]]
+        )
+        db_positions = self.positions.get_active_positions()
+        self.close_or_cancel_no_longer_valid_db_positions(
+            trader_ids_w_api_positions=api_positions, trader_ids_w_db_positions=db_positions
+        )
+        # Exits don't wait for the rest of the iteration
+        self.action_plan.submit(priority=PRIORITY_EXIT)
+
+    def update_kc_stats(self, api_positions: dict, **_):
+        logger.debug("Updating Kelly Criteria stats table")
+        self.db.update_kc_stats(
+            kc_stats_table_name=self.kc_stats_table_name, top_x_table_name=self.position_table_name
+        )
+
+        api_positions_count = (len([pos for trader_id in api_positions for pos in api_positions[trader_id]]))
+        logger.debug(f"api_positions_count: {api_positions_count}")
+
+    def build_stage_graph(self):
+        """
+        Stages of a single iteration with their dependencies (stages without a dependency between them
+        run concurrently). Outputs without a value only mean that the stage's changes are done
+        Stages writing 'position_xN' in a batch are chained (filled orders -> PnL/ROE -> exits -> exit results ->
+        liquidation prices), so their transactions never update the same rows at the same time
+        Entry stages run after the exit results are written (exited positions aren't active for them anymore)
+        """
+        return StageGraph(
+            stages=[
+                # Urgent: closing/canceling positions the lead traders have exited
+                # (only the fill state is needed to choose between closing and canceling)
+                Stage(
+                    "check_filled_orders",
+                    func=lambda: self.check_and_update_filled_db_orders(
+                        db_positions=self.positions.get_active_positions()
+                    ),
+                    outputs=["filled_orders"],
+                ),
+                Stage("read_api_positions", func=self.read_api_positions, outputs=["api_positions"]),
+                # Before the exits - win/lose outcomes of exited positions are based on their refreshed ROE
+                Stage(
+                    "update_db_positions_pnl_and_roe",
+                    func=lambda api_positions, **_: self.update_db_positions_pnl_and_roe(
+                        trader_ids_w_api_positions=api_positions,
+                        trader_ids_w_db_positions=self.positions.get_active_positions()
+                    ),
+                    inputs=["api_positions", "filled_orders"],
+                    outputs=["pnl_and_roe"],
+                ),
+                Stage(
+                    "close_or_cancel_exited_positions",
+                    func=lambda api_positions, **_: self.close_or_cancel_exited_positions(api_positions=api_positions),
+                    inputs=["api_positions", "pnl_and_roe"],
+                    outputs=["exits"],
+                ),
+                Stage(
+                    "apply_exit_results",
+                    func=lambda **_: self.apply_exit_results(),
+                    inputs=["exits"],
+                    outputs=["exit_results"],
+                ),
+
+                # Not urgent: stop-losses/take-profits maintenance and stats
+                Stage(
+                    "update_liquidation_prices",
+                    func=lambda **_: self.update_liquidation_prices(),
+                    inputs=["exit_results"],
+                    outputs=["liquidation_prices"],
+                ),
+                Stage(
+                    "insert_or_update_stop_losses",
+                    func=lambda **_: self.insert_or_update_stop_losses(),
+                    inputs=["liquidation_prices"],
+                    outputs=["stop_losses"],
+                ),
+                Stage(
+                    "insert_or_update_take_profits",
+                    func=lambda **_: self.insert_or_update_take_profits(),
+                    inputs=["filled_orders"],
+                    outputs=["take_profits"],
+                ),
+                Stage(
+                    "check_filled_sls",
+                    func=lambda **_: self.check_and_update_filled_sls(),
+                    inputs=["stop_losses"],
+                    outputs=["filled_sls"],
+                ),
+                Stage(
+                    "check_filled_tps",
+                    func=lambda **_: self.check_and_update_filled_tps(),
+                    inputs=["take_profits"],
+                    outputs=["filled_tps"],
+                ),
+                Stage(
+                    "sync_success_stats_traders",
+                    func=lambda: self.db.sync_success_stats_traders(position_table_name=self.position_table_name),
+                    outputs=["success_stats_traders"],
+                ),
+                Stage(
+                    "update_kc_stats",
+                    func=self.update_kc_stats,
+                    inputs=[
+                        "api_positions", "exit_results", "success_stats_traders", "pnl_and_roe",
+                        "filled_sls", "filled_tps",
+                    ],
+                    outputs=["kc_stats"],
+                ),
+
+                # Entries
+                Stage(
+                    "insert_new_api_positions",
+                    func=lambda api_positions, first_time_run, **_: self.insert_new_api_positions(
+                        trader_ids_w_api_positions=api_positions,
+                        trader_ids_w_db_positions=self.positions.get_active_positions(),
+                        first_time_run=first_time_run
+                    ),
+                    inputs=["api_positions", "first_time_run", "kc_stats"],
+                    outputs=["new_positions"],
+                ),
+                Stage(
+                    "ignore_and_or_close_or_cancel_opposite_and_same_positions",
+                    func=lambda **_: self.ignore_and_or_close_or_cancel_opposite_and_same_positions(),
+                    inputs=["new_positions"],
+                    outputs=["position_conflicts"],
+                ),
+                Stage(
+                    "update_db_positions_amounts",
+                    func=lambda api_positions, **_: self.update_db_positions_amounts(
+                        trader_ids_w_db_positions=self.positions.get_active_positions(),
+                        trader_ids_w_api_positions=api_positions
+                    ),
+                    inputs=["api_positions", "position_conflicts"],
+                    outputs=["positions_amounts"],
+                ),
+                Stage(
+                    "handle_copy_positions",
+                    func=lambda **_: self.handle_copy_positions(),
+                    inputs=["positions_amounts"],
+                    outputs=["copied_positions"],
+                ),
+            ],
+            max_workers=MAX_CONCURRENT_STAGES,
+            on_stage_done=self.on_stage_done,
+            executor=self.stage_executor,
+        )
+
+    def stop(self):
+        """
+        Releases what the instance keeps between iterations (exchange action lane, stage workers and their async DB pools)
+        """
+        self.action_lane.stop()
+        self.stage_executor.shutdown()
+        self.async_db.close_all()
+
+    def on_stage_done(self, stage: Stage):
+        # Every stage's worker thread returns its DB connection to the pool
+        self.db.close()
+
+    def run_stages(self, api_positions: dict = None, first_time_run: bool = False):
+        """
+        A failed stage doesn't stop the iteration - only the stages that depend on it are skipped
+        """
+        initial_values = {"first_time_run": first_time_run}
+        if api_positions is not None:
+            initial_values["api_positions"] = api_positions
+        res = self.build_stage_graph().run(initial_values=initial_values)
+
+        failed_stages = set(res["failed"])
+        for stage_name in failed_stages - self.failed_stages:
+            msg = (
+                f"Binance leaderboard script '{self.instance}' stage '{stage_name}' failed. "
+                f"Error:\n{res['failed'][stage_name]}\nStages that depend on it were skipped: {res['skipped']}"
+            )
+            telegram_bot.send_telegram_message(msg=msg)
+        for stage_name in self.failed_stages - failed_stages:
+            msg = f"Binance leaderboard script '{self.instance}' stage '{stage_name}' has been successfully recovered."
+            telegram_bot.send_telegram_message(msg=msg)
+        self.failed_stages = failed_stages
+
     def run(self, delay: int = 5):
+        check_db_pool_size(db=self.db)
         max_consec_crash_count = 3
         consec_crash_count = 0
         first_time_run = True
         while True:
             try:
-                config = helpers.load_config_from_yaml()
-                self.should_copy_positions = config[f"{self.instance}_copy_positions"]  
-
-                db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)  
-                self.check_and_update_filled_db_orders(db_positions=db_positions)  
-
-                self.update_liquidation_prices()  
-
-                self.insert_or_update_stop_losses()  
-                self.insert_or_update_take_profits()  
-
-                self.check_and_update_filled_sls()  
-                self.check_and_update_filled_tps()  
-
-                api_positions = self.db.get_temp_positions_from_db(ignore_observed_traders=IGNORE_OBSERVED_TRADERS)  
-
-                self.db.deactivate_trader_ids_of_success_stats_table(position_table_name=self.position_table_name)  
-                self.db.insert_trader_ids_to_success_stats_table(position_table_name=self.position_table_name)  
-
-                db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)  
-                self.update_db_positions_pnl_and_roe(
-                    trader_ids_w_api_positions=api_positions, trader_ids_w_db_positions=db_positions
-                )
-                        
-                db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)  
-                self.close_or_cancel_no_longer_valid_db_positions(
-                    trader_ids_w_api_positions=api_positions, trader_ids_w_db_positions=db_positions
-                )
-
-                logger.debug("Updating Kelly Criteria stats table")
-                self.db.insert_or_update_kc(
-                    kc_stats_table_name=self.kc_stats_table_name, top_x_table_name=self.position_table_name
-                )
-
-                api_positions_count = (len([pos for trader_id in api_positions for pos in api_positions[trader_id]]))
-                logger.debug(f"api_positions_count: {api_positions_count}")
-
-                db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)  
-                self.insert_new_api_positions(
-                    trader_ids_w_api_positions=api_positions,
-                    trader_ids_w_db_positions=db_positions,
-                    first_time_run=first_time_run
-                )
-
-                self.ignore_and_or_close_or_cancel_opposite_and_same_positions()  
-                
-                db_positions = self.db.fetch_active_db_positions(table=self.position_table_name)  
-                self.update_db_positions_amounts(
-                    trader_ids_w_db_positions=db_positions, trader_ids_w_api_positions=api_positions
-                )
-
-                self.handle_copy_positions()  
+                self.run_once(first_time_run=first_time_run)
 
                 first_time_run = False
                 if consec_crash_count > 0:  # it means the script crashed at some point previously
@@ -2346,6 +2117,9 @@ class Leaderboard:
                 full_error_msg = traceback.format_exc()
                 logger.error(full_error_msg)
 
+                if is_connection_lost_error(e):
+                    self.db.reconnect()
+
                 if consec_crash_count < max_consec_crash_count:
                     crash_delay = consec_crash_count * delay * 4
                     msg = (
@@ -2360,6 +2134,7 @@ class Leaderboard:
                         f"after {consec_crash_count} retry/retries. Stopping."
                     )
                     telegram_bot.send_telegram_message(msg=msg)
+                    self.stop()
                     return
         
 
@@ -2402,5 +2177,10 @@ if __name__ == "__main__":
         sys.exit()
 
     logger.add(f"{logging_fp}"+"{time:YYYY-MM-DD}.log", rotation="00:00", retention="1 day")
-    leaderboard = Leaderboard(instance=instance_arg, instance_to_replicate=instance_to_replicate_arg)
+    leaderboard = Leaderboard(
+        instance=instance_arg,
+        instance_to_replicate=instance_to_replicate_arg,
+        api_key=binance_api_key,
+        api_secret=binance_api_secret,
+    )
     leaderboard.run()
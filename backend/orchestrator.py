@@ -0,0 +1,172 @@
+import copy
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+import helpers
+import telegram_bot
+from db_manager import DatabaseManager
+from db_pool import db_pool_size, is_connection_lost_error
+from helpers import init_worker_event_loop
+from leaderboard import Leaderboard, IGNORE_OBSERVED_TRADERS, check_db_pool_size, get_required_db_pool_size
+from trader_cache import TraderMetadataCache
+from trading_api import TradingAPI
+
+config = helpers.load_config_from_yaml()
+db_host = config["db_host"]
+db_user = config["db_user"]
+db_password = config["db_password"]
+database = config["database"]
+
+VALID_INSTANCES = ["x1", "x2", "x3"]
+MAX_CONSEC_CRASH_COUNT = 3
+
+
+class Orchestrator:
+    """
+    Runs multiple instances (Binance accounts) in a single process
+    Stages that are the same for every account (reading 'position_temp', trader metadata, Binance markets)
+    run once per tick, then every account's Leaderboard.run_once (sizing, order execution and its own
+    'position_xN' table) runs concurrently in its own worker thread
+    """
+    def __init__(self, instances: list):
+        # The pool is shared by every instance (see 'check_db_pool_size')
+        self.db = DatabaseManager(
+            db_host=db_host, db_user=db_user, db_password=db_password, database=database,
+            pool_size=max(db_pool_size, get_required_db_pool_size(instances_count=len(instances)))
+        )
+        self.trader_cache = TraderMetadataCache(db=self.db)
+        self.leaderboards = {}
+        for instance in instances:
+            api_key = config[f"binance_api_key_{instance}"]
+            api_secret = config[f"binance_api_secret_{instance}"]
+            if not any([api_key, api_secret]):
+                logger.error(f"No Binance api_key and/or api_secret for '{instance}' instance inside config.yml")
+                continue
+            self.leaderboards[instance] = Leaderboard(instance=instance, api_key=api_key, api_secret=api_secret)
+        check_db_pool_size(db=self.db, instances_count=len(self.leaderboards))
+        # {instance: consecutive crash count, ...}
+        self.consec_crash_counts = {instance: 0 for instance in self.leaderboards}
+        self.first_time_runs = {instance: True for instance in self.leaderboards}
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(len(self.leaderboards), 1), initializer=init_worker_event_loop
+        )
+
+    def run_shared_stages(self):
+        """
+        Ex.: {"api_positions": {"trader_xyz_id": [pos1, pos2, ...]}, "trader_cache": ..., "markets": {...}}
+        """
+        api_positions = self.db.get_temp_positions_from_db(ignore_observed_traders=IGNORE_OBSERVED_TRADERS)
+
+        self.trader_cache.refresh()
+        trader_cache = self.trader_cache.snapshot()
+
+        # Markets are public - no account credentials are needed
+        markets = TradingAPI(api_key=None, api_secret=None).load_markets()
+
+        return {"api_positions": api_positions, "trader_cache": trader_cache, "markets": markets}
+
+    def run_instance(self, instance: str, shared: dict):
+        leaderboard = self.leaderboards[instance]
+        leaderboard.trader_cache = shared["trader_cache"]
+        leaderboard.markets = shared["markets"]
+        # Stages change API positions in place, every account gets its own copy
+        leaderboard.run_once(
+            api_positions=copy.deepcopy(shared["api_positions"]),
+            first_time_run=self.first_time_runs[instance],
+        )
+        self.first_time_runs[instance] = False
+
+    def handle_instance_result(self, instance: str, error: Exception = None):
+        """
+        Same recovery policy as Leaderboard.run, but per instance - other instances keep trading
+        """
+        if error is None:
+            if self.consec_crash_counts[instance] > 0:
+                self.consec_crash_counts[instance] = 0
+                msg = f"Orchestrator instance '{instance}' has been successfully recovered."
+                telegram_bot.send_telegram_message(msg=msg)
+            return
+
+        self.consec_crash_counts[instance] += 1
+        if is_connection_lost_error(error):
+            self.leaderboards[instance].db.reconnect()
+
+        if self.consec_crash_counts[instance] < MAX_CONSEC_CRASH_COUNT:
+            msg = (
+                f"Orchestrator instance '{instance}' crashed. "
+                f"Error:\n{error}\nWill be trying to recover on the next tick."
+            )
+        else:
+            msg = (
+                f"Warning! Unable to recover orchestrator instance '{instance}' "
+                f"after {self.consec_crash_counts[instance]} retry/retries. Stopping it."
+            )
+            self.leaderboards.pop(instance).stop()
+        telegram_bot.send_telegram_message(msg=msg)
+
+    def run_tick(self):
+        shared = self.run_shared_stages()
+
+        futures = {
+            instance: self.executor.submit(self.run_instance, instance, shared)
+            for instance in self.leaderboards
+        }
+        for instance, future in futures.items():
+            try:
+                future.result()
+                self.handle_instance_result(instance=instance)
+            except Exception as e:
+                logger.error(f"Instance '{instance}' crashed.\n{traceback.format_exc()}")
+                self.handle_instance_result(instance=instance, error=e)
+
+    def run(self, delay: int = 5):
+        consec_crash_count = 0
+        while self.leaderboards:
+            try:
+                self.run_tick()
+                consec_crash_count = 0
+                time.sleep(delay)
+            except Exception as e:  # shared stages crashed
+                consec_crash_count += 1
+                logger.error(traceback.format_exc())
+
+                if is_connection_lost_error(e):
+                    self.db.reconnect()
+
+                if consec_crash_count < MAX_CONSEC_CRASH_COUNT:
+                    crash_delay = consec_crash_count * delay * 4
+                    msg = (
+                        f"Orchestrator crashed. Error:\n{e}\nWill be trying to recover in {crash_delay} seconds."
+                    )
+                    telegram_bot.send_telegram_message(msg=msg)
+                    time.sleep(crash_delay)
+                else:
+                    msg = f"Warning! Unable to recover orchestrator after {consec_crash_count} retry/retries. Stopping."
+                    telegram_bot.send_telegram_message(msg=msg)
+                    break
+
+        self.executor.shutdown()
+        for leaderboard in self.leaderboards.values():
+            leaderboard.stop()
+
+
+if __name__ == "__main__":
+    """
+    Usage: python orchestrator.py x1 x2 x3
+    (replaces running 'python leaderboard.py x1', 'python leaderboard.py x2', ... as separate processes)
+    """
+    instances_arg = sys.argv[1:]
+    if not instances_arg or any([instance not in VALID_INSTANCES for instance in instances_arg]):
+        logger.error(f"Usage: python orchestrator.py <instance> [<instance> ...] (instances: {VALID_INSTANCES})")
+        sys.exit(1)
+
+    logging_fp = "./logs/orchestrator/"
+    if not os.path.exists(logging_fp):
+        os.makedirs(logging_fp)
+    logger.add(f"{logging_fp}"+"{time:YYYY-MM-DD}.log", rotation="00:00", retention="1 day")
+
+    orchestrator = Orchestrator(instances=instances_arg)
+    orchestrator.run()
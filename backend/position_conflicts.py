@@ -0,0 +1,145 @@
+IGNORE_REASON_SAME_SYMBOL = "same symbol and side"
+IGNORE_REASON_HEDGED = "hedged"
+IGNORE_REASON_LOWER_ROI = "lower roi"
+IGNORE_REASON_LOWER_WIN_LOSE_RES = "lower win lose res"
+
+# If a position is ignored for several reasons, the first one is stored
+IGNORE_REASONS_PRIORITY = [
+    IGNORE_REASON_SAME_SYMBOL,
+    IGNORE_REASON_HEDGED,
+    IGNORE_REASON_LOWER_ROI,
+    IGNORE_REASON_LOWER_WIN_LOSE_RES,
+]
+
+
+class PositionConflictResolver:
+    """
+    Decides which active DB positions of the same symbol have to be ignored (and canceled or closed):
+        - same symbol and side - every position except the first one
+        - hedged (opposite sides of the same trader) - the earlier updated one
+        - opposite sides - the one of the trader with lower win/lose result or, if equal, with lower ROI
+    Positions are bucketed by symbol and every rule is resolved in a single pass per bucket, so it's linear
+    in position count. Decisions are the same as of comparing every position with every later one
+    (positions order is the order of 'trader_ids_w_positions', ties are lost by the earlier position)
+    """
+    def __init__(self, trader_ids_w_positions: dict, all_traders_stats: dict, trader_ids_w_roi: dict):
+        self.trader_ids_w_positions = trader_ids_w_positions
+        self.all_traders_stats = all_traders_stats
+        self.trader_ids_w_roi = trader_ids_w_roi
+        # {reason: {position table ID, ...}, ...}
+        self.ignored_ids = {reason: set() for reason in IGNORE_REASONS_PRIORITY}
+
+    def resolve(self):
+        """
+        Ex.: {"same symbol and side": {12, 15}, "hedged": {3}, "lower roi": set(), "lower win lose res": {7}}
+        """
+        # {symbol: [position, ...], ...} - already ignored positions are not compared
+        positions_by_symbol = {}
+        for trader_id in self.trader_ids_w_positions:
+            for position in self.trader_ids_w_positions[trader_id]:
+                if not position["is_ignored"]:
+                    positions_by_symbol.setdefault(position["symbol"], []).append(position)
+
+        for positions in positions_by_symbol.values():
+            self._resolve_same_side(positions=positions)
+            if len({position["side"] for position in positions}) > 1:
+                self._resolve_opposite_sides(positions=positions)
+        return self.ignored_ids
+
+    def get_ignored_ids(self):
+        ignored_ids = set()
+        for ids in self.ignored_ids.values():
+            ignored_ids |= ids
+        return ignored_ids
+
+    def get_ignore_reason(self, position_table_id):
+        for reason in IGNORE_REASONS_PRIORITY:
+            if position_table_id in self.ignored_ids[reason]:
+                return reason
+        return None
+
+    def _resolve_same_side(self, positions: list):
+        # The first position of every side is left active
+        first_position_sides = set()
+        for position in positions:
+            if position["side"] in first_position_sides:
+                self.ignored_ids[IGNORE_REASON_SAME_SYMBOL].add(position["id"])
+            else:
+                first_position_sides.add(position["side"])
+
+    def _resolve_opposite_sides(self, positions: list):
+        # Precomputed once per trader instead of per compared pair
+        trader_ranks = {}
+        for position in positions:
+            trader_id = position["trader_id"]
+            if trader_id not in trader_ranks:
+                trader_ranks[trader_id] = (
+                    self.all_traders_stats[trader_id]["win_lose_count_res"],
+                    self.trader_ids_w_roi[trader_id],
+                )
+
+        # Traders with a lower win/lose result than the best one of the opposite side
+        best_win_lose_res_by_side = {}
+        for position in positions:
+            win_lose_res = trader_ranks[position["trader_id"]][0]
+            side = position["side"]
+            if side not in best_win_lose_res_by_side or win_lose_res > best_win_lose_res_by_side[side]:
+                best_win_lose_res_by_side[side] = win_lose_res
+        for position in positions:
+            win_lose_res = trader_ranks[position["trader_id"]][0]
+            opposite_win_lose_res = best_win_lose_res_by_side.get(self._get_opposite_side(position["side"]))
+            if opposite_win_lose_res is not None and opposite_win_lose_res > win_lose_res:
+                self.ignored_ids[IGNORE_REASON_LOWER_WIN_LOSE_RES].add(position["id"])
+
+        # Same win/lose result - compared by ROI
+        positions_by_win_lose_res = {}
+        for position in positions:
+            positions_by_win_lose_res.setdefault(trader_ranks[position["trader_id"]][0], []).append(position)
+        for same_win_lose_res_positions in positions_by_win_lose_res.values():
+            self.ignored_ids[IGNORE_REASON_LOWER_ROI] |= self._get_opposite_side_losers(
+                positions=same_win_lose_res_positions,
+                key=lambda position: trader_ranks[position["trader_id"]][1],
+            )
+
+        # Hedged - opposite positions of the same trader, the earlier updated one is ignored
+        positions_by_trader_id = {}
+        for position in positions:
+            positions_by_trader_id.setdefault(position["trader_id"], []).append(position)
+        for trader_positions in positions_by_trader_id.values():
+            self.ignored_ids[IGNORE_REASON_HEDGED] |= self._get_opposite_side_losers(
+                positions=trader_positions,
+                key=lambda position: position["update_timestamp"],
+            )
+
+    @staticmethod
+    def _get_opposite_side(side: str):
+        return "buy" if side == "sell" else "sell"
+
+    def _get_opposite_side_losers(self, positions: list, key):
+        """
+        A position loses to an opposite side position that comes later with the same or higher key
+        or that comes earlier with a higher key
+        Checked with running maximums of every side (forwards and backwards) instead of comparing all pairs
+        """
+        losers = set()
+        if len({position["side"] for position in positions}) < 2:
+            return losers
+
+        earlier_max_keys = {}  # {side: max key of positions so far, ...}
+        for position in positions:
+            opposite_max_key = earlier_max_keys.get(self._get_opposite_side(position["side"]))
+            position_key = key(position)
+            if opposite_max_key is not None and opposite_max_key > position_key:
+                losers.add(position["id"])
+            if position["side"] not in earlier_max_keys or position_key > earlier_max_keys[position["side"]]:
+                earlier_max_keys[position["side"]] = position_key
+
+        later_max_keys = {}
+        for position in reversed(positions):
+            opposite_max_key = later_max_keys.get(self._get_opposite_side(position["side"]))
+            position_key = key(position)
+            if opposite_max_key is not None and opposite_max_key >= position_key:
+                losers.add(position["id"])
+            if position["side"] not in later_max_keys or position_key > later_max_keys[position["side"]]:
+                later_max_keys[position["side"]] = position_key
+        return losers
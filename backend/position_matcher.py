@@ -0,0 +1,95 @@
+class PositionMatcher:
+    """
+    Finds the same position (API <-> DB) with hash lookups instead of scanning all positions of the trader
+    Positions are indexed by (trader_id, symbol, side) and, inside of it, by leverage, update timestamp and entry price
+    Results are the same as of the linear scan (the first position, in the original order, that matches any tier)
+    and are memoized, so stages of the same iteration share them
+    """
+    valid_single_position_types = ["api", "db"]
+
+    def __init__(self, trader_ids_w_positions: dict):
+        # {(trader_id, symbol, side): {"positions": [...], "by_leverage": {...}, ...}, ...}
+        self.buckets = {}
+        for trader_id in trader_ids_w_positions:
+            for position in trader_ids_w_positions[trader_id]:
+                bucket_key = (position["trader_id"], position["symbol"], position["side"])
+                bucket = self.buckets.setdefault(bucket_key, {
+                    "positions": [],
+                    "by_leverage": {},  # {leverage: first position index, ...}
+                    "by_update_timestamp": {},  # {update_timestamp: first position index, ...}
+                    "by_entry_price": {},  # {entry_price: [position index, ...], ...}
+                })
+                position_index = len(bucket["positions"])
+                bucket["positions"].append(position)
+                bucket["by_leverage"].setdefault(position["leverage"], position_index)
+                bucket["by_update_timestamp"].setdefault(position["update_timestamp"], position_index)
+                bucket["by_entry_price"].setdefault(position["entry_price"], []).append(position_index)
+        self.matches = {}
+
+    def find_same_position(self, single_position: dict, single_position_type: str):
+        """
+        The same position of the trader (if any) and whether its amount has to be updated
+        Ex.: {"same_position": True, "need_to_update_amount": False, "position": {...}}
+        """
+        if single_position_type not in self.valid_single_position_types:
+            raise Exception(f"Invalid single_position_type: {single_position_type}")
+
+        match_key = (
+            single_position_type,
+            single_position["trader_id"],
+            single_position["symbol"],
+            single_position["side"],
+            single_position["leverage"],
+            single_position["entry_price"],
+            single_position["amount"],
+            single_position["update_timestamp"],
+        )
+        if match_key not in self.matches:
+            self.matches[match_key] = self._match(single_position, single_position_type)
+        return dict(self.matches[match_key])
+
+    def _is_amount_decreased(self, single_position: dict, versus_position: dict, single_position_type: str):
+        if single_position_type == "api":
+            return single_position["amount"] < versus_position["amount"]
+        return single_position["amount"] > versus_position["amount"]  # db
+
+    def _match(self, single_position: dict, single_position_type: str):
+        result = {
+            "same_position": False,
+            "need_to_update_amount": False,
+            "position": None,
+        }
+
+        bucket_key = (single_position["trader_id"], single_position["symbol"], single_position["side"])
+        bucket = self.buckets.get(bucket_key)
+        if not bucket:
+            return result  # not the same position
+
+        # Earliest position matching any tier (same trader ID, symbol and side is required by all of them)
+        candidate_indexes = []
+        for position_index in bucket["by_entry_price"].get(single_position["entry_price"], []):
+            versus_position = bucket["positions"][position_index]
+            if self._is_amount_decreased(single_position, versus_position, single_position_type) or (
+                single_position["amount"] == versus_position["amount"]
+                and single_position["update_timestamp"] == versus_position["update_timestamp"]
+            ):
+                candidate_indexes.append(position_index)
+                break
+        if single_position["leverage"] in bucket["by_leverage"]:
+            candidate_indexes.append(bucket["by_leverage"][single_position["leverage"]])
+        if single_position["update_timestamp"] in bucket["by_update_timestamp"]:
+            candidate_indexes.append(bucket["by_update_timestamp"][single_position["update_timestamp"]])
+        if not candidate_indexes:
+            return result  # not the same position
+
+        versus_position = bucket["positions"][min(candidate_indexes)]
+        result["same_position"] = True
+        result["position"] = versus_position
+        if (
+            single_position["entry_price"] == versus_position["entry_price"]
+            and self._is_amount_decreased(single_position, versus_position, single_position_type)
+        ):  # It means the trader partially closed his position
+            result["need_to_update_amount"] = True  # decrese quantity
+        # Otherwise nothing has happened (same entry price, amount and update timestamp)
+        # or something has happened but we asume it's the same position (same leverage or update timestamp)
+        return result
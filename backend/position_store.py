@@ -0,0 +1,100 @@
+import threading
+from db_batch import BatchWriter
+
+
+class PositionStateStore:
+    """
+    Iteration-scoped in-memory state of active positions of a single 'position_xN' table
+    It's loaded once per Leaderboard.run iteration instead of every stage re-reading the whole table
+    Position updates are written through (immediately or at the end of a stage batch) and then applied to the state,
+    so SQL readers of the table (ex.: stop-loss/take-profit joins, Kelly Criteria stats) stay up to date
+    """
+    def __init__(self, db, position_table: str):
+        self.db = db
+        self.position_table = position_table
+        self.positions = None  # active positions
+        self.indexes = {}  # {column: {value: [position, ...]}, ...}
+        # Independent stages can run concurrently (see StageGraph)
+        self.lock = threading.RLock()
+
+    def load(self):
+        db_positions = self.db.fetch_active_db_positions(table=self.position_table)
+        with self.lock:
+            # Grouping by trader is kept ('inserted_on' order of traders and of positions of every trader)
+            self.positions = [position for trader_id in db_positions for position in db_positions[trader_id]]
+            self.indexes = {}
+
+    def invalidate(self):
+        """
+        Forces a reload on the next read (ex.: after new positions were inserted - their default values come from DB)
+        """
+        with self.lock:
+            self.positions = None
+            self.indexes = {}
+
+    def get_active_positions(self):
+        """
+        Same as DatabaseManager.fetch_active_db_positions
+        Returns copies - stages can change them freely without persisting the changes
+        Ex.: {'trader_xyz_id': [pos1, pos2, ...]}
+        """
+        with self.lock:
+            if self.positions is None:
+                self.load()
+
+            active_positions = {}
+            for position in self.positions:
+                if not position["is_active"]:
+                    continue
+                trader_id = position["trader_id"]
+                if trader_id not in active_positions:
+                    active_positions[trader_id] = []
+                active_positions[trader_id].append(dict(position))
+            return active_positions
+
+    def _get_index(self, column: str):
+        if column not in self.indexes:
+            index = {}
+            for position in self.positions:
+                index.setdefault(position.get(column), []).append(position)
+            self.indexes[column] = index
+        return self.indexes[column]
+
+    def apply_update(self, data: dict, condition_column: str, condition_value):
+        with self.lock:
+            if self.positions is None:
+                return
+            for position in self._get_index(column=condition_column).get(condition_value, []):
+                position.update(data)
+            # Indexes of updated columns are outdated now
+            for column in data:
+                self.indexes.pop(column, None)
+
+    def update_data(self, data: dict, condition_column: str, condition_value):
+        self.db.update_data(
+            table=self.position_table, data=data, condition_column=condition_column, condition_value=condition_value
+        )
+        self.apply_update(data=data, condition_column=condition_column, condition_value=condition_value)
+
+    def batch(self):
+        return PositionStateBatchWriter(db=self.db, position_store=self)
+
+
+class PositionStateBatchWriter(BatchWriter):
+    """
+    BatchWriter that also applies updates of the store's table to the in-memory position state
+    Updates are applied once they are committed, so a failed flush doesn't leave the state ahead of the DB
+    """
+    def __init__(self, db, position_store: PositionStateStore):
+        super().__init__(db=db)
+        self.position_store = position_store
+
+    def update_data(self, table, data, condition_column, condition_value):
+        super().update_data(
+            table=table, data=data, condition_column=condition_column, condition_value=condition_value
+        )
+        if table == self.position_store.position_table:
+            data = dict(data)
+            self.after_flush(lambda: self.position_store.apply_update(
+                data=data, condition_column=condition_column, condition_value=condition_value
+            ))
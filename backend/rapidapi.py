@@ -11,7 +11,9 @@ from aiolimiter import AsyncLimiter
 from loguru import logger
 import helpers
 import telegram_bot
-from db_manager import DatabaseManager
+from db_manager import DatabaseManager, TRADER_METADATA_DATA_VERSION
+from latency_tracker import LatencyTracker
+from records import get_normalizer
 import mysql.connector
 
 config = helpers.load_config_from_yaml()
@@ -22,8 +24,9 @@ database = config["database"]
 rapid_api_key = config["rapidapi_api_key"]
 
 class LeaderboardScraper:
-    def __init__(self, db):
+    def __init__(self, db, latency_tracker: Optional[LatencyTracker] = None):
         self.db = db
+        self.latency_tracker = latency_tracker
         self.base_url = "https://okx-copy-trading1.p.rapidapi.com"
         self.headers = {
             "X-RapidAPI-Key": rapid_api_key,
@@ -46,7 +49,8 @@ class LeaderboardScraper:
                         logger.error(f"JSON decoding failed for URL: {url}")
                         response_data = "Invalid JSON response"
                     
-                    return {"response": response_data, "trader_id": trader_id}
+                    received_on_ts = helpers.get_current_timestamp_in_ms()
+                    return {"response": response_data, "trader_id": trader_id, "received_on_ts": received_on_ts}
         except asyncio.TimeoutError:
             logger.error(f"Timeout occurred for trader ID: {trader_id}")
             return {"response": "Timeout occurred", "trader_id": trader_id}
@@ -149,6 +153,7 @@ class LeaderboardScraper:
         results = loop.run_until_complete(future)
         
         trader_ids_w_positions = {}
+        positions_normalizer = get_normalizer("positions")
         for dict_i in results:
             response = dict_i["response"]
             if isinstance(response, str):
@@ -161,44 +166,14 @@ class LeaderboardScraper:
             
             positions = response.get("data", [])
 
-            # Used for matching API returned keys to 'position' table column keys
-            api_key_to_db_key_matcher = {
-                "availSubPos": "avail_sub_pos",
-                "ccy": "ccy",
-                "instId": "inst_id",
-                "instType": "inst_type",
-                "last": "last",
-                "lever": "lever",
-                "margin": "margin",
-                "markPx": "mark_px",
-                "mgnMode": "mgn_mode",
-                "notionalUsd": "notional_usd",
-                "openAvgPx": "open_avg_px",
-                "openTime": "open_time",
-                "pnl": "pnl",
-                "pnlRatio": "pnl_ratio",
-                "posSide": "pos_side",
-                "slTriggerPx": "sl_trigger_px",
-                "slTriggerType": "sl_trigger_type",
-                "subPos": "sub_pos",
-                "tpTriggerPx": "tp_trigger_px",
-                "tpTriggerType": "tp_trigger_type",
-                "tradeItemId": "trade_item_id",
-                "uTime": "u_time",
-                "traderId": "trader_id",
-            }
-            
-            # Fix received positions from API
-            positions_fixed = []
-            for position_dict in positions:
-                position_dict_fixed = {
-                    api_key_to_db_key_matcher.get(key): val
-                    for key, val in position_dict.items()
-                    if api_key_to_db_key_matcher.get(key)
-                }
-                position_dict_fixed = {key: val if val != "" else None for key, val in position_dict_fixed.items()}
-                position_dict_fixed["trader_id"] = trader_id  # Assign trader_id
-                positions_fixed.append(position_dict_fixed)
+            # Re-keyed to 'position_temp' columns and typed once (the whole page at once)
+            positions_fixed = positions_normalizer.normalize_many(positions, trader_id=trader_id)
+
+            if self.latency_tracker:
+                self.latency_tracker.tag(stage="trader_open", positions=positions_fixed, timestamp_key="open_time")
+                self.latency_tracker.tag(
+                    stage="scraper_poll", positions=positions_fixed, timestamp=dict_i["received_on_ts"]
+                )
 
             trader_ids_w_positions[trader_id] = positions_fixed
         
@@ -295,6 +270,7 @@ class LeaderboardScraper:
         get_trade_stats_config = config["get_trade_stats"]
         multiple_date_ranges = get_trade_stats_config["date_ranges"]
         traders_stats = []
+        stats_normalizer = get_normalizer("user_statistics")
         for date_range in multiple_date_ranges:
             urls = self.generate_user_statistics_api_endpoint_urls(
                 querystring={"dateRange": str(date_range)}, trader_ids=trader_ids, ignore_trader_ids=ignore_trader_ids
@@ -303,19 +279,6 @@ class LeaderboardScraper:
             future = asyncio.ensure_future(self.fetch_api_urls(urls))
             results = loop.run_until_complete(future)
 
-            # Used for matching API returned keys to 'position' table column keys
-            api_key_to_db_key_matcher = {
-                "followerNum": "follower_num",
-                "currentFollowPnl": "current_follow_pnl",
-                "aum": "aum",
-                "avgPositionValue": "avg_position_value",
-                "costVal": "cost_val",
-                "winRatio": "win_ratio",
-                "lossDays": "loss_days",
-                "profitDays": "profit_days",
-                "yieldRatio": "yield_ratio",
-            }
-            
             for dict_i in results:
                 response = dict_i["response"]
                 if isinstance(response, str):
@@ -327,14 +290,9 @@ class LeaderboardScraper:
                     logger.warning(f"{response.get('message', 'No message provided')}")
                 else:
                     data = dict_i["response"].get("data", {})
-                    trader_stats_fixed = {
-                        api_key_to_db_key_matcher.get(key): val
-                        for key, val in data.items()
-                        if api_key_to_db_key_matcher.get(key)
-                    }
-                    trader_stats_fixed = {key: val if val != "" else None for key, val in trader_stats_fixed.items()}
-                    trader_stats_fixed["trader_id"] = trader_id
-                    trader_stats_fixed["date_range"] = int(date_range)
+                    trader_stats_fixed = stats_normalizer.normalize(
+                        data, trader_id=trader_id, date_range=int(date_range)
+                    )
                     traders_stats.append(trader_stats_fixed)
 
         return traders_stats
@@ -349,16 +307,12 @@ class LeaderboardScraper:
         }
         """
         trader_ids_w_pnl = {}
+        yield_ratio_normalizer = get_normalizer("user_yield_ratio")
         urls = self.generate_user_api_endpoint_urls(trader_ids=trader_ids, ignore_trader_ids=ignore_trader_ids)
         loop = asyncio.get_event_loop()
         future = asyncio.ensure_future(self.fetch_api_urls(urls))
         results = loop.run_until_complete(future)
 
-        # Used for matching API returned keys to 'position' table column keys
-        api_key_to_db_key_matcher = {
-            "yieldRatio": "yield_ratio"
-        }
-        
         for dict_i in results:
             response = dict_i["response"]
             if isinstance(response, str):
@@ -371,17 +325,7 @@ class LeaderboardScraper:
                 logger.warning(f"{response.get('message', 'No message provided')}")
             else:
                 data = dict_i["response"].get("data", {})
-                trader_yield_ratio_fixed = {
-                    api_key_to_db_key_matcher.get(key): val
-                    for key, val in data.items()
-                    if api_key_to_db_key_matcher.get(key)
-                }
-                trader_yield_ratio_fixed = {
-                    key: val if val != "" else None
-                    for key, val in trader_yield_ratio_fixed.items()
-                }
-                trader_yield_ratio_fixed["trader_id"] = trader_id
-                trader_ids_w_pnl[trader_id] = trader_yield_ratio_fixed
+                trader_ids_w_pnl[trader_id] = yield_ratio_normalizer.normalize(data, trader_id=trader_id)
 
         return trader_ids_w_pnl
 
@@ -463,99 +407,102 @@ class LeaderboardScraper:
 
 
 def get_and_update_init_traders():
-    db = DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database)
-    scraper = LeaderboardScraper(db=db)
+    with DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database) as db:
+        scraper = LeaderboardScraper(db=db)
 
-    search_traders_config = config["search_traders_config"]
-    init_traders_data = scraper.get_init_traders(**search_traders_config)
+        search_traders_config = config["search_traders_config"]
+        init_traders_data = scraper.get_init_traders(**search_traders_config)
 
-    if init_traders_data is None or init_traders_data is False:
-        return False  # Indicate failure
+        if init_traders_data is None or init_traders_data is False:
+            return False  # Indicate failure
     
-    logger.debug(f"Got {len(init_traders_data)} init traders.")
-    db.upsert_init_traders(data=init_traders_data)
-    return True  # Indicate success
+        logger.debug(f"Got {len(init_traders_data)} init traders.")
+        db.upsert_init_traders(data=init_traders_data)
+        return True  # Indicate success
 
 
 def update_trader_rois(retry_count: int = 20, include_observed: bool = True):
-    db = DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database)
-    scraper = LeaderboardScraper(db=db)
-    logger.info("Updating yieldRatio of API traders")
+    with DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database) as db:
+        scraper = LeaderboardScraper(db=db)
+        logger.info("Updating yieldRatio of API traders")
     
-    init_trader_ids = list(db.fetch_init_traders().keys()) if db.fetch_init_traders() else []
-    all_trader_ids = list(set(init_trader_ids))
-    if include_observed:
-        observed_trader_ids = db.fetch_observed_trader_ids()
-        all_trader_ids += observed_trader_ids
-
-    trader_ids_w_yield_ratio_from_api = None
-    for retry_num in range(1, retry_count + 1):
-        trader_ids_w_yield_ratio_from_api = scraper.get_user_yield_ratio(trader_ids=all_trader_ids)
-        if trader_ids_w_yield_ratio_from_api:
-            break
+        init_trader_ids = list(db.fetch_init_traders().keys()) if db.fetch_init_traders() else []
+        all_trader_ids = list(set(init_trader_ids))
+        if include_observed:
+            observed_trader_ids = db.fetch_observed_trader_ids()
+            all_trader_ids += observed_trader_ids
+
+        trader_ids_w_yield_ratio_from_api = None
+        for retry_num in range(1, retry_count + 1):
+            trader_ids_w_yield_ratio_from_api = scraper.get_user_yield_ratio(trader_ids=all_trader_ids)
+            if trader_ids_w_yield_ratio_from_api:
+                break
 
-        if retry_num == retry_count:  # last retry
-            break
+            if retry_num == retry_count:  # last retry
+                break
         
-        delay = retry_num * 5
-        logger.debug(f"Delaying {delay} seconds")
-        time.sleep(delay)
+            delay = retry_num * 5
+            logger.debug(f"Delaying {delay} seconds")
+            time.sleep(delay)
     
-    if trader_ids_w_yield_ratio_from_api:
-        for trader_id, rois_dict in trader_ids_w_yield_ratio_from_api.items():
-            yield_ratio = rois_dict["yield_ratio"]
-            data = {
-                "yield_ratio": yield_ratio,
-            }
-            db.update_data(table="trader", data=data, condition_column="trader_id", condition_value=trader_id)
-        return True
-    else:
-        return False
+        if trader_ids_w_yield_ratio_from_api:
+            for trader_id, rois_dict in trader_ids_w_yield_ratio_from_api.items():
+                yield_ratio = rois_dict["yield_ratio"]
+                data = {
+                    "yield_ratio": yield_ratio,
+                }
+                db.update_data(table="trader", data=data, condition_column="trader_id", condition_value=trader_id)
+            db.bump_data_version(name=TRADER_METADATA_DATA_VERSION)
+            return True
+        else:
+            return False
     
 
 def update_trader_stats(retry_count: int = 20, include_observed: bool = True):
-    db = DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database)
-    scraper = LeaderboardScraper(db=db)
-    logger.info("Updating trading stats of init traders")
+    with DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database) as db:
+        scraper = LeaderboardScraper(db=db)
+        logger.info("Updating trading stats of init traders")
     
-    init_trader_ids = list(db.fetch_init_traders().keys()) if db.fetch_init_traders() else []
-    all_trader_ids = list(set(init_trader_ids))
-    if include_observed:
-        observed_trader_ids = db.fetch_observed_trader_ids()
-        all_trader_ids += observed_trader_ids
-
-    traders_stats_from_api = None
-    for retry_num in range(1, retry_count + 1):
-        traders_stats_from_api = scraper.get_user_statistics(trader_ids=all_trader_ids)
-        if traders_stats_from_api:
-            break
+        init_trader_ids = list(db.fetch_init_traders().keys()) if db.fetch_init_traders() else []
+        all_trader_ids = list(set(init_trader_ids))
+        if include_observed:
+            observed_trader_ids = db.fetch_observed_trader_ids()
+            all_trader_ids += observed_trader_ids
 
-        if retry_num == retry_count:  # last retry
-            break
+        traders_stats_from_api = None
+        for retry_num in range(1, retry_count + 1):
+            traders_stats_from_api = scraper.get_user_statistics(trader_ids=all_trader_ids)
+            if traders_stats_from_api:
+                break
+
+            if retry_num == retry_count:  # last retry
+                break
         
-        delay = retry_num * 5
-        logger.debug(f"Delaying {delay} seconds")
-        time.sleep(delay)
+            delay = retry_num * 5
+            logger.debug(f"Delaying {delay} seconds")
+            time.sleep(delay)
     
-    if traders_stats_from_api:
-        for stats_dict in traders_stats_from_api:
-            db.insert_or_update_data(table="trader_stats", data=stats_dict)
-        return True
-    else:
-        return False
+        if traders_stats_from_api:
+            for stats_dict in traders_stats_from_api:
+                db.insert_or_update_data(table="trader_stats", data=stats_dict.to_row())
+            db.bump_data_version(name=TRADER_METADATA_DATA_VERSION)
+            return True
+        else:
+            return False
 
 
 def update_last_pos_datetime_for_all_traders_once():
-    db = DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database)
-    logger.info("Updating last positions datetimes once")
+    with DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database) as db:
+        logger.info("Updating last positions datetimes once")
 
-    # Assuming you have a method to update the last position datetime for all traders
-    db.update_last_pos_datetime_for_all_traders()
+        # Assuming you have a method to update the last position datetime for all traders
+        db.update_last_pos_datetime_for_all_traders()
 
 
 def monitor_positions(retry_count: int = 20, delay: int = 10, include_observed: bool = False):
     db = DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database)
-    scraper = LeaderboardScraper(db=db)
+    latency_tracker = LatencyTracker(db=db)
+    scraper = LeaderboardScraper(db=db, latency_tracker=latency_tracker)
 
     first_time_run = True
     top_traders_update_status = {
@@ -604,9 +551,22 @@ def monitor_positions(retry_count: int = 20, delay: int = 10, include_observed:
                 logger.info(f"Dumped positions data from RapidAPI: {now_fn}")
 
                 with open(fp, "w") as f:
-                    json.dump(api_positions, f, indent=4)
+                    json.dump(
+                        {
+                            trader_id: [position.to_row() for position in positions]
+                            for trader_id, positions in api_positions.items()
+                        },
+                        f,
+                        indent=4
+                    )
 
                 db.insert_temp_positions(traders_ids_and_positions=api_positions)
+                latency_tracker.tag(
+                    stage="temp_write",
+                    positions=[position for trader_id in api_positions for position in api_positions[trader_id]],
+                    timestamp_key="inserted_on_ts"
+                )
+                latency_tracker.flush()
                 break
             if api_positions == {}:
                 break
@@ -641,51 +601,29 @@ def get_hist_positions(instance: str):
     pos_table_name = f"position_{instance}"
     kc_stats_table_name = f"kc_stats_{instance}"
 
-    db = DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database)
-    scraper = LeaderboardScraper(db=db)
-    hist_positions = scraper.get_historical_positions_from_api()
-    inserted_count = 0
-    for pos_dict_i in hist_positions:
-        # Used for matching API returned keys to 'position' table column keys
-        api_key_to_db_key_matcher = {
-            "ccy": "ccy",
-            "closeAvgPx": "close_avg_px",
-            "contractVal": "contract_val",
-            "id": "okx_pos_id",
-            "instId": "inst_id",
-            "instType": "inst_type",
-            "lever": "lever",
-            "margin": "margin",
-            "mgnMode": "mgn_mode",
-            "multiplier": "multiplier",
-            "openAvgPx": "open_avg_px",
-            "openTime": "open_time",
-            "pnl": "pnl",
-            "pnlRatio": "pnl_ratio",
-            "posSide": "pos_side",
-            "subPos": "user_sub_pos",
-            "tradeItemId": "trade_item_id",
-            "traderId": "trader_id",
-            "uTime": "u_time",
-        }
-        
-        position_dict_fixed = {
-            api_key_to_db_key_matcher[key]: val
-            for key, val in pos_dict_i.items()
-            if api_key_to_db_key_matcher.get(key)
-        }
-        position_dict_fixed = {key: val if val != "" else None for key, val in position_dict_fixed.items()}
-        position_dict_fixed["is_active"] = 0
-        position_dict_fixed["is_ignored"] = 1
-        position_dict_fixed["is_ignored_reason"] = "historical"
-        try:
-            db.insert_data(table=pos_table_name, data=position_dict_fixed)
-            inserted_count += 1
-        except mysql.connector.errors.IntegrityError:
-            pass
-
-        db.insert_or_update_kc(kc_stats_table_name=kc_stats_table_name, top_x_table_name=pos_table_name)
-    logger.success(f"Successfully inserted {inserted_count} historical positions.")
+    with DatabaseManager(db_host=db_host, db_user=db_user, db_password=db_password, database=database) as db:
+        scraper = LeaderboardScraper(db=db)
+        hist_positions = scraper.get_historical_positions_from_api()
+        inserted_count = 0
+        hist_positions_fixed = get_normalizer("historical_positions").normalize_many(
+            hist_positions, is_active=0, is_ignored=1, is_ignored_reason="historical"
+        )
+        # Archived positions aren't in 'position_xN' anymore (its unique key doesn't see them)
+        archived_position_ids = db.get_archived_position_ids(
+            position_table=pos_table_name, okx_pos_ids=[position.get("okx_pos_id") for position in hist_positions_fixed]
+        )
+        for position_dict_fixed in hist_positions_fixed:
+            if position_dict_fixed.get("okx_pos_id") in archived_position_ids:
+                continue
+            try:
+                db.insert_data(table=pos_table_name, data=position_dict_fixed.to_row())
+                inserted_count += 1
+            except mysql.connector.errors.IntegrityError:
+                pass
+
+        # Historical positions are added to Kelly Criteria stats at once (not per inserted position)
+        db.update_kc_stats(kc_stats_table_name=kc_stats_table_name, top_x_table_name=pos_table_name)
+        logger.success(f"Successfully inserted {inserted_count} historical positions.")
 
 
 def run():
@@ -0,0 +1,292 @@
+MISSING = object()
+
+
+def to_int(value):
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return round(float(value))  # same as MySQL when a decimal is written into an INT column
+
+
+def to_float(value):
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+def to_str(value):
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+# {field type: converter, ...} - RapidAPI returns numbers as strings and "" instead of null
+CONVERTERS = {int: to_int, float: to_float, str: to_str}
+
+
+def parse_value(value, value_type):
+    """
+    Ex.: parse_value("50", int) -> 50, parse_value("0.0194", float) -> 0.0194, parse_value("", float) -> None
+    """
+    return CONVERTERS[value_type](value)
+
+
+class FieldNormalizer:
+    """
+    API response -> record, compiled once from the record's field schema
+    (API key, field name and converter of every field are resolved up front, not per response)
+    Ex.:
+        normalizer = FieldNormalizer(record_class=PositionRecord)
+        positions = normalizer.normalize_many(response["data"], trader_id="123qwerty123")
+    """
+    def __init__(self, record_class, api_keys: list = None):
+        self.record_class = record_class
+        # ((API key, field name, converter), ...) of the used API keys ('api_keys' - only these, ex.: ["yieldRatio"])
+        self.fields = tuple([
+            (api_key, name, CONVERTERS[value_type])
+            for name, value_type, api_key in record_class.FIELDS
+            if api_key and (api_keys is None or api_key in api_keys)
+        ])
+
+    def normalize(self, data: dict, **values):
+        """
+        'values' are set as they are (ex.: trader_id of the request), unknown API keys are skipped
+        """
+        record = self.record_class()
+        for api_key, name, convert in self.fields:
+            value = data.get(api_key, MISSING)
+            if value is not MISSING:
+                setattr(record, name, convert(value))
+        for name, value in values.items():
+            record[name] = value
+        return record
+
+    def normalize_many(self, data: list, **values):
+        normalize = self.normalize
+        return [normalize(data_i, **values) for data_i in data]
+
+
+class Record:
+    """
+    Typed record with a fixed set of fields ('__slots__', no per-record '__dict__')
+    It can be used wherever a DB row/dict is expected (record["lever"], record.get("pnl"), dict(record), ...),
+    only fields that are set are its keys (same as a dict built from an API response)
+    Subclasses define FIELDS: ((field name, type, API key or None), ...)
+    """
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.FIELD_NAMES = tuple([name for name, _, _ in cls.FIELDS])
+        cls.FIELD_TYPES = {name: value_type for name, value_type, _ in cls.FIELDS}
+        cls.normalizer = FieldNormalizer(record_class=cls)
+
+    def __init__(self, **values):
+        for name, value in values.items():
+            self[name] = value
+
+    @classmethod
+    def from_api(cls, data: dict, **values):
+        """
+        Re-keys and types an API response (unknown API keys are skipped), 'values' are set as they are
+        Ex.: PositionRecord.from_api({"instId": "BTC-USDT-SWAP", "lever": "50", ...}, trader_id="123qwerty123")
+        """
+        return cls.normalizer.normalize(data, **values)
+
+    @classmethod
+    def from_row(cls, row: dict):
+        """
+        DB rows are already typed by the connector (columns that are not fields are skipped)
+        """
+        record = cls()
+        for name in cls.FIELD_NAMES:
+            if name in row:
+                setattr(record, name, row[name])
+        return record
+
+    def to_row(self):
+        """
+        Ex.: {"trader_id": "123qwerty123", "lever": 50, ...} (only set fields)
+        """
+        return {name: getattr(self, name) for name in self.keys()}
+
+    def copy(self):
+        return self.__class__.from_row(self.to_row())
+
+    def keys(self):
+        return [name for name in self.FIELD_NAMES if hasattr(self, name)]
+
+    def values(self):
+        return [getattr(self, name) for name in self.keys()]
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.keys()]
+
+    def get(self, key, default=None):
+        if key not in self.FIELD_TYPES:
+            return default
+        return getattr(self, key, default)
+
+    def __getitem__(self, key):
+        if key not in self.FIELD_TYPES or not hasattr(self, key):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELD_TYPES:
+            raise KeyError(f"{self.__class__.__name__} has no '{key}' field")
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.FIELD_TYPES and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return type(self) is type(other) and self.to_row() == other.to_row()
+        if isinstance(other, dict):
+            return self.to_row() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.to_row()})"
+
+
+class PositionRecord(Record):
+    """
+    Current position of a lead trader ('position_temp' row)
+    """
+    FIELDS = (
+        ("id", int, None),
+        ("trader_id", str, "traderId"),
+        ("avail_sub_pos", int, "availSubPos"),
+        ("ccy", str, "ccy"),
+        ("inst_id", str, "instId"),
+        ("inst_type", str, "instType"),
+        ("last", float, "last"),
+        ("lever", int, "lever"),
+        ("margin", float, "margin"),
+        ("mark_px", float, "markPx"),
+        ("mgn_mode", str, "mgnMode"),
+        ("notional_usd", float, "notionalUsd"),
+        ("open_avg_px", float, "openAvgPx"),
+        ("open_time", int, "openTime"),
+        ("pnl", float, "pnl"),
+        ("pnl_ratio", float, "pnlRatio"),
+        ("pos_side", str, "posSide"),
+        ("sl_trigger_px", float, "slTriggerPx"),
+        ("sl_trigger_type", str, "slTriggerType"),
+        ("sub_pos", int, "subPos"),
+        ("tp_trigger_px", float, "tpTriggerPx"),
+        ("tp_trigger_type", str, "tpTriggerType"),
+        ("trade_item_id", int, "tradeItemId"),
+        ("u_time", int, "uTime"),
+        ("inserted_on_ts", int, None),
+    )
+    __slots__ = tuple([name for name, _, _ in FIELDS])
+
+
+class HistoricalPositionRecord(Record):
+    """
+    Closed position of a lead trader ('position_xN' row inserted by 'get_hist_positions')
+    """
+    FIELDS = (
+        ("okx_pos_id", int, "id"),
+        ("trader_id", str, "traderId"),
+        ("is_active", int, None),
+        ("is_ignored", int, None),
+        ("is_ignored_reason", str, None),
+        ("ccy", str, "ccy"),
+        ("close_avg_px", float, "closeAvgPx"),
+        ("contract_val", float, "contractVal"),
+        ("inst_id", str, "instId"),
+        ("inst_type", str, "instType"),
+        ("lever", int, "lever"),
+        ("margin", float, "margin"),
+        ("mgn_mode", str, "mgnMode"),
+        ("multiplier", int, "multiplier"),
+        ("open_avg_px", float, "openAvgPx"),
+        ("open_time", int, "openTime"),
+        ("pnl", float, "pnl"),
+        ("pnl_ratio", float, "pnlRatio"),
+        ("pos_side", str, "posSide"),
+        ("user_sub_pos", int, "subPos"),
+        ("trade_item_id", int, "tradeItemId"),
+        ("u_time", int, "uTime"),
+    )
+    __slots__ = tuple([name for name, _, _ in FIELDS])
+
+
+class TraderRecord(Record):
+    """
+    Lead trader returned by RapidAPI ('trader' row)
+    """
+    FIELDS = (
+        ("trader_id", str, "id"),
+        ("is_init", int, None),
+        ("is_followed", int, None),
+        ("aum", float, "aum"),
+        ("follow_pnl", float, "followPnl"),
+        ("follower_limit", int, "followerLimit"),
+        ("number_of_followers", int, "numberOfFollowers"),
+        ("total_number_of_followers", int, "totalNumberOfFollowers"),
+        ("initial_day", int, "initialDay"),
+        ("nickname", str, "nickName"),
+        ("pnl", float, "pnl"),
+        ("symbol", str, "symbol"),
+        ("target_id", int, "targetId"),
+        ("win_ratio", float, "winRatio"),
+        ("yield_ratio", float, "yieldRatio"),
+    )
+    __slots__ = tuple([name for name, _, _ in FIELDS])
+
+
+class TraderStatsRecord(Record):
+    """
+    Trading stats of a lead trader for a date range ('trader_stats' row)
+    """
+    FIELDS = (
+        ("trader_id", str, None),
+        ("date_range", int, None),
+        ("follower_num", int, "followerNum"),
+        ("current_follow_pnl", float, "currentFollowPnl"),
+        ("aum", float, "aum"),
+        ("avg_position_value", float, "avgPositionValue"),
+        ("cost_val", float, "costVal"),
+        ("win_ratio", float, "winRatio"),
+        ("loss_days", int, "lossDays"),
+        ("profit_days", int, "profitDays"),
+        ("yield_ratio", float, "yieldRatio"),
+    )
+    __slots__ = tuple([name for name, _, _ in FIELDS])
+
+
+# Field schema of every RapidAPI endpoint: {endpoint: (record class, used API keys or None = all), ...}
+ENDPOINT_SCHEMAS = {
+    "positions": (PositionRecord, None),
+    "historical_positions": (HistoricalPositionRecord, None),
+    "init_traders": (TraderRecord, None),
+    "user_statistics": (TraderStatsRecord, None),
+    "user_yield_ratio": (TraderRecord, ["yieldRatio"]),
+}
+_normalizers = {}
+
+
+def get_normalizer(endpoint: str):
+    """
+    Compiled once per endpoint per process
+    """
+    if endpoint not in _normalizers:
+        if endpoint not in ENDPOINT_SCHEMAS:
+            raise Exception(f"Invalid endpoint: {endpoint}")
+        record_class, api_keys = ENDPOINT_SCHEMAS[endpoint]
+        _normalizers[endpoint] = FieldNormalizer(record_class=record_class, api_keys=api_keys)
+    return _normalizers[endpoint]
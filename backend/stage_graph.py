@@ -0,0 +1,129 @@
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from loguru import logger
+from helpers import init_worker_event_loop
+
+
+class Stage:
+    """
+    A single step of an iteration
+    'func(**inputs)' receives the values of its inputs and returns {output: value, ...}
+    (or None if its outputs are only side effects, ex.: updated DB rows - then they are set to None)
+    """
+    def __init__(self, name: str, func, inputs: list = None, outputs: list = None):
+        self.name = name
+        self.func = func
+        self.inputs = inputs or []
+        self.outputs = outputs or [name]
+
+    def __repr__(self):
+        return f"Stage({self.name})"
+
+
+class StageGraph:
+    """
+    Runs stages by their dependencies instead of strictly one after another
+    A stage starts as soon as all its inputs are produced, so independent stages run concurrently
+    (every worker thread has its own event loop for TradingAPI requests)
+    A failed stage doesn't stop the iteration - only the stages that depend on its outputs are skipped
+    Ex.:
+        graph = StageGraph(stages=[
+            Stage("read_api_positions", func=..., outputs=["api_positions"]),
+            Stage("update_pnl_and_roe", func=..., inputs=["api_positions"]),
+        ])
+        res = graph.run(initial_values={})
+        res = {"values": {"api_positions": {...}, ...}, "failed": {"update_pnl_and_roe": error}, "skipped": []}
+    """
+    def __init__(self, stages: list, max_workers: int = 3, on_stage_done=None, executor: ThreadPoolExecutor = None):
+        self.stages = stages
+        self.max_workers = max_workers
+        # Long-lived worker threads (ex.: to keep their event loops and async DB pools between runs),
+        # otherwise every run creates its own
+        self.executor = executor
+        # 'on_stage_done(stage)' is called by the stage's worker thread (ex.: to release its DB connection)
+        self.on_stage_done = on_stage_done
+        self.validate()
+
+    def validate(self):
+        producers = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in producers:
+                    raise Exception(f"'{output}' is produced by both {producers[output]} and {stage}")
+                producers[output] = stage
+
+        # Every dependency has to be resolvable in order (no cycles)
+        resolved = set()
+        remaining = list(self.stages)
+        while remaining:
+            ready = [
+                stage for stage in remaining
+                if all([input_name in resolved or input_name not in producers for input_name in stage.inputs])
+            ]
+            if not ready:
+                raise Exception(f"Stage dependencies contain a cycle: {remaining}")
+            for stage in ready:
+                resolved.update(stage.outputs)
+                remaining.remove(stage)
+
+    def _run_stage(self, stage: Stage, values: dict):
+        start_ts = time.time()
+        try:
+            outputs = stage.func(**{input_name: values[input_name] for input_name in stage.inputs}) or {}
+            logger.debug(f"Stage '{stage.name}' done in {time.time() - start_ts:.2f}s")
+            return {output: outputs.get(output) for output in stage.outputs}
+        finally:
+            if self.on_stage_done:
+                self.on_stage_done(stage)
+
+    def run(self, initial_values: dict = None):
+        """
+        Stages whose outputs are all in 'initial_values' are not run (ex.: API positions read by the orchestrator)
+        Missing inputs that no stage produces must be in 'initial_values'
+        """
+        if self.executor is not None:
+            return self._run_stages(executor=self.executor, initial_values=initial_values)
+        with ThreadPoolExecutor(max_workers=self.max_workers, initializer=init_worker_event_loop) as executor:
+            return self._run_stages(executor=executor, initial_values=initial_values)
+
+    def _run_stages(self, executor: ThreadPoolExecutor, initial_values: dict = None):
+        values = dict(initial_values or {})
+        failed = {}  # {stage name: exception, ...}
+        skipped = []
+        pending = [stage for stage in self.stages if not all([output in values for output in stage.outputs])]
+        # Outputs that will never be produced (their stage failed or was skipped)
+        unavailable = set()
+
+        running = {}  # {future: stage, ...}
+        while pending or running:
+            for stage in list(pending):
+                if any([input_name in unavailable for input_name in stage.inputs]):
+                    logger.warning(f"Skipping stage '{stage.name}' (its inputs are unavailable)")
+                    skipped.append(stage.name)
+                    unavailable.update(stage.outputs)
+                    pending.remove(stage)
+                elif all([input_name in values for input_name in stage.inputs]):
+                    running[executor.submit(self._run_stage, stage, values)] = stage
+                    pending.remove(stage)
+
+            if not running:
+                if pending:
+                    # Inputs nobody produces and nobody passed
+                    for stage in pending:
+                        logger.error(f"Skipping stage '{stage.name}' (missing inputs: {stage.inputs})")
+                        skipped.append(stage.name)
+                    pending = []
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    values.update(future.result())
+                except Exception as e:
+                    logger.error(f"Stage '{stage.name}' failed.\n{traceback.format_exc()}")
+                    failed[stage.name] = e
+                    unavailable.update(stage.outputs)
+
+        return {"values": values, "failed": failed, "skipped": skipped}
@@ -0,0 +1,103 @@
+import time
+from loguru import logger
+import helpers
+from db_manager import TRADER_METADATA_DATA_VERSION
+
+config = helpers.load_config_from_yaml()
+trader_cache_ttl = config.get("trader_cache_ttl", 300)
+
+
+class TraderMetadataCache:
+    """
+    Process-local read-through cache of small, slowly changing trader data (ROI, followed/observed status)
+    Entries expire after 'trader_cache_ttl' seconds or as soon as the scraper (rapidapi.py) bumps
+    the 'trader_metadata' version ('data_versions' table) after updating 'trader'/'trader_stats' tables
+    """
+    def __init__(self, db, ttl: int = trader_cache_ttl):
+        self.db = db
+        self.ttl = ttl
+        self.data_version = None
+        # {name: (loaded_on, value), ...}
+        self.entries = {}
+
+    def refresh(self):
+        """
+        Drops outdated entries - call it once per stage (a single DB query), not per position
+        """
+        data_version = self.db.get_data_version(name=TRADER_METADATA_DATA_VERSION)
+        if data_version != self.data_version:
+            if self.entries:
+                logger.debug(f"Trader metadata changed (version: {data_version}), clearing the cache")
+            self.invalidate()
+            self.data_version = data_version
+            return
+
+        now = time.time()
+        for name in [name for name, (loaded_on, _) in self.entries.items() if now - loaded_on >= self.ttl]:
+            del self.entries[name]
+
+    def invalidate(self, name: str = None):
+        if name is None:
+            self.entries = {}
+        else:
+            self.entries.pop(name, None)
+
+    def get(self, name: str, loader):
+        if name not in self.entries:
+            self.entries[name] = (time.time(), loader())
+        return self.entries[name][1]
+
+    def _get_all_traders(self):
+        """
+        Ex.: {"123qwerty123": {"trader_id": "123qwerty123", "yield_ratio": 0.34, "is_followed": 1, "is_observed": 0}, ...}
+        """
+        return self.get(name="traders", loader=self.db.fetch_all_traders_metadata)
+
+    def get_trader_ids_with_roi(self, trader_ids: list):
+        """
+        Same as DatabaseManager.fetch_trader_ids_with_roi
+        """
+        all_traders = self._get_all_traders()
+        return {
+            trader_id: all_traders[trader_id]["yield_ratio"] for trader_id in trader_ids if trader_id in all_traders
+        }
+
+    def get_trader_type(self, trader_id: str):
+        """
+        Same as DatabaseManager.detect_trader_type ("followed", "observed" or None)
+        """
+        trader = self._get_all_traders().get(trader_id)
+        trader_type = None
+        if trader:
+            if trader["is_followed"]:
+                trader_type = "followed"
+            if trader["is_observed"]:
+                trader_type = "observed"
+        return trader_type
+
+    def snapshot(self):
+        """
+        Read-only copy of the currently cached data - shared by orchestrator workers of the same tick
+        """
+        self._get_all_traders()
+        return TraderMetadataSnapshot(entries=self.entries, data_version=self.data_version)
+
+
+class TraderMetadataSnapshot(TraderMetadataCache):
+    """
+    TraderMetadataCache that never touches DB, so workers running in other threads can share it
+    The orchestrator refreshes the original cache and takes a new snapshot every tick
+    """
+    def __init__(self, entries: dict, data_version):
+        super().__init__(db=None)
+        self.entries = dict(entries)
+        self.data_version = data_version
+
+    def refresh(self):
+        pass
+
+    def get(self, name: str, loader=None):
+        return self.entries[name][1]
+
+    def _get_all_traders(self):
+        return self.get(name="traders")
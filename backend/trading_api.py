@@ -8,9 +8,12 @@ import helpers
 
 
 class TradingAPI:
-    def __init__(self, api_key: str, api_secret: str):
+    def __init__(self, api_key: str, api_secret: str, markets: dict = None):
         self.api_key = api_key
         self.api_secret = api_secret
+        # Markets are the same for every account - they can be downloaded once (see 'load_markets')
+        # and shared instead of every call downloading them again
+        self.markets = markets
         self.init_limiter()
 
     def init_limiter(self):
@@ -28,6 +31,13 @@ class TradingAPI:
                 except Exception as e:
                     return {"response": e, "symbol": symbol}
                 return {"response": response, "symbol": symbol}
+            elif bound_task == "fetch_open_orders":
+                symbol = inner_metadata["symbol"]
+                try:
+                    response = await self.exchange.fetch_open_orders(symbol=symbol)
+                except Exception as e:
+                    return {"response": e, "symbol": symbol}
+                return {"response": response, "symbol": symbol}
             elif bound_task == "cancel_multi_orders":
                 order_id = inner_metadata["order_id"]
                 symbol = inner_metadata["symbol"]
@@ -140,10 +150,14 @@ class TradingAPI:
                     return False, error_msg
 
                 try:
+                    submitted_on_ts = helpers.get_current_timestamp_in_ms()
                     order = await self.exchange.create_order(symbol, 'limit', side, amount, price, {
                         'type': 'future',
                         'clientOrderId': f'TID_{position_table_id}',
                     })
+                    order["acked_on_ts"] = helpers.get_current_timestamp_in_ms()
+                    order["submitted_on_ts"] = submitted_on_ts
+                    order["trade_item_id"] = inner_metadata["trade_item_id"]
                     order["position_table_id"] = position_table_id
                     success_msg = f'Order successfully created: ({bound_task}), ({symbol}), ({position_table_id})'
                     logger.debug(success_msg)
@@ -384,8 +398,10 @@ class TradingAPI:
             }
         })
         # self.exchange.set_sandbox_mode(True)
+        if self.markets:
+            self.exchange.set_markets(self.markets)
 
-        if bound_task == "fetch_orders":
+        if bound_task in ["fetch_orders", "fetch_open_orders"]:
             symbols = metadata["symbols"]
             for symbol in symbols:
                 inner_metadata = {"symbol": symbol}
@@ -478,7 +494,8 @@ class TradingAPI:
                     "side": order["side"],
                     "leverage": order["leverage"],
                     "price": order["entry_price"],
-                    "user_amount": order["user_amount"]
+                    "user_amount": order["user_amount"],
+                    "trade_item_id": order.get("trade_item_id"),
                 }
                 task = asyncio.create_task(self.bound_fetch(bound_task=bound_task, inner_metadata=inner_metadata))
                 tasks.append(task)
@@ -502,7 +519,10 @@ class TradingAPI:
                 task = asyncio.create_task(self.bound_fetch(bound_task=bound_task, inner_metadata=inner_metadata))
                 tasks.append(task)
         elif bound_task == "get_min_qty_and_step_size_for_symbols":
-            markets = await self.exchange.fetch_markets()
+            if self.markets:
+                markets = list(self.markets.values())
+            else:
+                markets = await self.exchange.fetch_markets()
             results = {}
             market_ids = metadata["symbols"]  # ["BTCUSDT", "BNBUSDT"]
             for market in markets:
@@ -521,6 +541,10 @@ class TradingAPI:
                     # results[market['id']] = market['precision']['amount']
             await self.exchange.close()
             return results
+        elif bound_task == "load_markets":
+            markets = await self.exchange.load_markets()
+            await self.exchange.close()
+            return markets
         elif bound_task == "get_liquidation_prices":
             task = asyncio.create_task(self.bound_fetch(bound_task=bound_task, inner_metadata=metadata))
             tasks.append(task)
@@ -530,16 +554,7 @@ class TradingAPI:
             for position in positions:
                 side = position["side"]
                 opposite_side = self.flip_side(side=side)
-                if opposite_side == "buy":
-                    sl_price = (
-                        position["entry_price"]
-                        - ((position["entry_price"] - position["liquidation_price"]) * sl_ratio)
-                    )
-                else:
-                    sl_price = (
-                        position["entry_price"]
-                        + ((position["liquidation_price"] - position["entry_price"]) * sl_ratio)
-                    )
+                sl_price = self.get_sl_price(position=position, sl_ratio=sl_ratio)
                 inner_metadata = {
                     "orig_position_id": position["position_id"],
                     "symbol": position["symbol"],
@@ -745,6 +760,19 @@ class TradingAPI:
         
         return results
         
+    def load_markets(self):
+        """
+        Downloads Binance markets so they could be passed to other TradingAPI objects (the 'markets' argument)
+        Ex.: {"BTC/USDT:USDT": {"id": "BTCUSDT", "contract": True, ...}, ...}
+        """
+        bound_task = "load_markets"
+
+        loop = asyncio.get_event_loop()
+        future = asyncio.ensure_future(self.fetch_api_urls(bound_task=bound_task, metadata={}))
+        results = loop.run_until_complete(future)
+
+        return results
+
     def flip_side(self, side: str):
         valid_sides = ["buy", "sell"]
         if side not in valid_sides:
@@ -756,6 +784,11 @@ class TradingAPI:
         else:
             return "buy"
         
+    def get_sl_price(self, position: dict, sl_ratio: float):
+        if self.flip_side(side=position["side"]) == "buy":
+            return position["entry_price"] - ((position["entry_price"] - position["liquidation_price"]) * sl_ratio)
+        return position["entry_price"] + ((position["liquidation_price"] - position["entry_price"]) * sl_ratio)
+
     def get_liquidation_prices(self, metadata: dict):
         bound_task = "get_liquidation_prices"
 